@@ -0,0 +1,88 @@
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from PIL import Image
+
+def _attach_shared_memory(name):
+    """Attach to an existing shared memory block without letting this process unlink it at exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached blocks with the resource tracker, which would
+        # destroy the block when the first worker exits.
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+class BackgroundPool:
+    """
+    Background images decoded once into a single shared memory block.
+    Each background is stored as an RGB uint8 array; workers map the same block, so
+    sampling a background returns a zero-copy NumPy view instead of decoding a PNG.
+    The pool can be passed to worker processes directly: with fork it is inherited,
+    with spawn it is pickled as (name, shapes, offsets) and re-attached.
+    """
+
+    def __init__(self, shm, shapes, offsets, files, owner=False):
+        self.shm = shm
+        self.shapes = shapes
+        self.offsets = offsets
+        self.files = files
+        self.owner = owner
+
+    @classmethod
+    def create(cls, files, max_side=None):
+        """
+        Decode `files` into a new shared memory block.
+        If max_side is given, backgrounds whose longest side exceeds it are downscaled to fit.
+        """
+        if not files:
+            raise ValueError("No background images given.")
+        images = []
+        for background_file in files:
+            img = Image.open(background_file).convert('RGB')
+            if max_side is not None and max(img.size) > max_side:
+                scale = max_side / max(img.size)
+                img = img.resize((max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale))))
+            images.append(np.asarray(img))
+        shapes = [img.shape for img in images]
+        offsets = np.cumsum([0] + [img.nbytes for img in images]).tolist()
+        shm = shared_memory.SharedMemory(create=True, size=offsets[-1])
+        pool = cls(shm, shapes, offsets, list(files), owner=True)
+        for i, img in enumerate(images):
+            pool.image(i)[...] = img
+        return pool
+
+    def __getstate__(self):
+        return {'name': self.shm.name, 'shapes': self.shapes, 'offsets': self.offsets, 'files': self.files}
+
+    def __setstate__(self, state):
+        self.shm = _attach_shared_memory(state['name'])
+        self.shapes = state['shapes']
+        self.offsets = state['offsets']
+        self.files = state['files']
+        self.owner = False
+
+    def __len__(self):
+        return len(self.shapes)
+
+    @property
+    def nbytes(self):
+        return self.offsets[-1]
+
+    def image(self, i):
+        """Return background i as an (h, w, 3) uint8 view into shared memory."""
+        return np.ndarray(self.shapes[i], dtype=np.uint8, buffer=self.shm.buf, offset=self.offsets[i])
+
+    def choice(self):
+        """Return a uniformly chosen background (same random draw as np.random.choice on the file list)."""
+        return self.image(np.random.randint(len(self)))
+
+    def close(self):
+        """Release this process' mapping; the owner also destroys the block."""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
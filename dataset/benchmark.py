@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import image_distortion
+import gen_line_images as synthetic
+from backgrounds import BackgroundPool
+from PIL import Image
+
+PERCENTILES = [50, 90, 99]
+FONT_SIZE = 80  # generation.py renders at this size and distorts at 5 x 64 px
+
+# Texts of representative lengths, written with the basic Arabic letters the test font covers.
+LETTERS = [chr(c) for c in range(0x0621, 0x064B)]
+TEXTS = {
+    'short': LETTERS[0:3],
+    'word': LETTERS[3:10],
+    'long': LETTERS[10:24],
+    'line': ' '.join(''.join(LETTERS[i:i + 5]) for i in range(0, 40, 5)),
+}
+TEXTS = {name: ''.join(text) for name, text in TEXTS.items()}
+
+# Rows of the results file: one per (benchmark, case, width).
+results = []
+
+def time_call(func, repeats):
+    """Call func() `repeats` times and return the per-call latencies in milliseconds."""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+def record(benchmark, case, width, latencies):
+    """Add the latency percentiles of one case to the results; returns the row."""
+    row = {'benchmark': benchmark, 'case': case, 'width': int(width), 'calls': len(latencies),
+           'mean_ms': float(np.mean(latencies))}
+    for p in PERCENTILES:
+        row[f'p{p}_ms'] = float(np.percentile(latencies, p))
+    results.append(row)
+    return row
+
+def report(benchmark, case, width, latencies):
+    """record() a case and print its percentiles."""
+    row = record(benchmark, case, width, latencies)
+    percentiles = ", ".join(f"p{p} {row[f'p{p}_ms']:.2f}" for p in PERCENTILES)
+    print(f"{benchmark} {case} w={width}: {percentiles} ms")
+
+def make_test_font(path):
+    """
+    Write a TrueType font with a simple glyph for every basic Arabic letter and a space, so the
+    rendering benchmarks run without downloaded fonts. Glyph heights and widths vary by letter.
+    """
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    codepoints = [ord(c) for c in LETTERS] + [0x20]
+    names = [".notdef"] + [f"uni{c:04X}" for c in codepoints]
+    glyphs, metrics = {}, {}
+    for i, name in enumerate(names):
+        pen = TTGlyphPen(None)
+        width = 300 + (i * 53) % 400
+        if name not in (".notdef", "uni0020"):
+            top = 250 + (i * 37) % 550
+            bottom = -150 if i % 4 == 0 else 0
+            pen.moveTo((40, bottom))
+            pen.lineTo((40, top))
+            pen.lineTo((width - 40, top))
+            pen.lineTo((width - 40, bottom))
+            pen.closePath()
+            if i % 3 == 0:  # a dot above
+                pen.moveTo((width // 2 - 50, top + 100))
+                pen.lineTo((width // 2 - 50, top + 200))
+                pen.lineTo((width // 2 + 50, top + 200))
+                pen.lineTo((width // 2 + 50, top + 100))
+                pen.closePath()
+        glyphs[name] = pen.glyph()
+        metrics[name] = (width, 40)
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({c: f"uni{c:04X}" for c in codepoints})
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics(metrics)
+    builder.setupHorizontalHeader(ascent=1000, descent=-250)
+    builder.setupNameTable({"familyName": "BenchmarkSans", "styleName": "Regular"})
+    builder.setupOS2(sTypoAscender=1000, sTypoDescender=-250, usWinAscent=1000, usWinDescent=250)
+    builder.setupPost()
+    builder.save(path)
+
+def make_backgrounds(directory, count=4, seed=0):
+    """Write `count` paper-like noise textures as PNG files and return their paths."""
+    rng = np.random.RandomState(seed)
+    files = []
+    for i in range(count):
+        h, w = rng.randint(600, 1200), rng.randint(1500, 3000)
+        shade = rng.randint(200, 240, size=3)
+        noise = rng.normal(0, 8, size=(h // 4, w // 4, 1))
+        img = np.clip(shade + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"background_{i}.png")
+        Image.fromarray(img).resize((w, h), Image.BILINEAR).save(path)
+        files.append(path)
+    return files
+
+def make_word_image(height, width, seed=0):
+    """A white RGB image with dark strokes, standing in for a rendered word."""
+    rng = np.random.RandomState(seed)
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    for _ in range(max(1, width // 40)):
+        x, y = rng.randint(0, width - 10), rng.randint(0, height - 10)
+        img[y:y + rng.randint(5, height // 2), x:x + rng.randint(3, 30)] = rng.randint(0, 150)
+    return img
+
+def bench_warp(args):
+    """Compare the griddata warp with the cached mesh warp used by the distort_w/distort_h transforms."""
+    for width in args.widths:
+        img = make_word_image(args.height, width)
+        timings = {}
+        for name, exact in [('griddata', True), ('cached', False)]:
+            state = np.random.RandomState(0)
+            image_distortion.warp_image(img.copy(), random_state=state, w_mesh_std=2.3, exact=exact)  # warm-up
+            timings[name] = time_call(
+                lambda: image_distortion.warp_image(img.copy(), random_state=state, w_mesh_std=2.3, exact=exact),
+                args.repeats
+            )
+        for name, latencies in timings.items():
+            record('warp', name, width, latencies)
+        exact_ms, fast_ms = np.median(timings['griddata']), np.median(timings['cached'])
+        print(f"warp {args.height}x{width}: griddata {exact_ms:.2f} ms, cached {fast_ms:.2f} ms, "
+              f"speedup {exact_ms / fast_ms:.1f}x")
+
+def bench_remap(args):
+    """Time barrel, arc and rotate distortions with an empty remap cache and with warm cached grids."""
+    cases = [
+        ('barrel', lambda img: image_distortion.barrel_distortion(img, k_1=.03, k_2=.03)),
+        ('arc_left', lambda img: image_distortion.my_distort_arc_left(img, theta_max=np.pi/3.5, r=25)),
+        ('arc_right', lambda img: image_distortion.my_distort_arc_right(img, theta_max=np.pi/3.5, r=25)),
+        ('rotate', lambda img: image_distortion.my_distort_rotate(img, 2.0)),
+    ]
+    for width in args.widths:
+        img = make_word_image(args.height, width)
+        for name, distort in cases:
+            def cold():
+                image_distortion._remap_cache.clear()
+                distort(img)
+            cold_times = record('remap', f"{name} uncached", width, time_call(cold, args.repeats))
+            distort(img)
+            cached_times = record('remap', f"{name} cached", width, time_call(lambda: distort(img), args.repeats))
+            cold_ms, cached_ms = cold_times['p50_ms'], cached_times['p50_ms']
+            print(f"{name} {args.height}x{width}: uncached {cold_ms:.2f} ms, cached {cached_ms:.2f} ms, "
+                  f"speedup {cold_ms / cached_ms:.1f}x")
+
+def bench_batch(args):
+    """Compare per-image apply_augmentations with apply_augmentations_batch on word-sized images."""
+    rng = np.random.RandomState(0)
+    for width in args.widths:
+        # Short words: widths spread around `width` so several buckets are used.
+        imgs = [make_word_image(args.height, max(16, int(width * s)), seed=i)
+                for i, s in enumerate(rng.uniform(0.5, 1.5, args.batch_size))]
+        def single():
+            for img in imgs:
+                synthetic.apply_augmentations(Image.fromarray(img), distort_chance=1, blur_chance=1)
+        def batch():
+            synthetic.apply_augmentations_batch(imgs, distort_chance=1, blur_chance=1)
+        single(), batch()  # warm-up
+        single_ms = record('batch', 'per-image', width, time_call(single, args.repeats))['p50_ms']
+        batch_ms = record('batch', 'batch', width, time_call(batch, args.repeats))['p50_ms']
+        print(f"augment {args.batch_size} x {args.height}x~{width}: per-image {single_ms:.2f} ms, "
+              f"batch {batch_ms:.2f} ms, speedup {single_ms / batch_ms:.1f}x")
+
+def bench_render(args):
+    """Latency of the rendering stages of generation.py for texts of increasing length."""
+    with tempfile.TemporaryDirectory() as tmp:
+        font = os.path.join(tmp, "BenchmarkSans.ttf")
+        make_test_font(font)
+        pool = BackgroundPool.create(make_backgrounds(tmp))
+        try:
+            for name, text in TEXTS.items():
+                cases = [
+                    ('create_full_line_img',
+                     lambda: synthetic.create_full_line_img(text, font, args.font_size, img_ht=args.height)[0]),
+                    ('draw_text_on_background',
+                     lambda: synthetic.draw_text_on_background(text, font, args.font_size,
+                                                               background_img=pool.choice(), resized_ht=args.height)),
+                    ('main_generate_image',
+                     lambda: synthetic.main_generate_image(text, font, args.font_size, pool, ht=args.height,
+                                                           distort_chance=0.05, blur_chance=0.3)[0]),
+                ]
+                for case, render in cases:
+                    np.random.seed(0)
+                    width = render().size[0]  # warm-up (font loading)
+                    report('render', f"{case} {name}", width, time_call(render, args.repeats))
+        finally:
+            pool.close()
+
+def bench_blur(args):
+    """Latency of apply_blur at random radii."""
+    for width in args.widths:
+        img = Image.fromarray(make_word_image(args.height, width))
+        np.random.seed(0)
+        report('blur', 'apply_blur', width, time_call(lambda: synthetic.apply_blur(img), args.repeats))
+
+def bench_transform(args):
+    """Latency of every apply_random_transform method with random parameters."""
+    for width in args.widths:
+        img = make_word_image(args.height, width)
+        for index, method in enumerate(image_distortion.METHOD_NAMES):
+            transform = lambda: image_distortion.apply_random_transform(img, method_index=index)
+            np.random.seed(0)
+            transform()
+            report('transform', method, width, time_call(transform, args.repeats))
+
+BENCHMARKS = {
+    'warp': bench_warp,
+    'remap': bench_remap,
+    'batch': bench_batch,
+    'render': bench_render,
+    'blur': bench_blur,
+    'transform': bench_transform,
+}
+
+def library_versions():
+    import cv2, scipy, PIL, fontTools
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'Pillow': PIL.__version__,
+            'opencv': cv2.__version__, 'scipy': scipy.__version__, 'fontTools': fontTools.version}
+
+def compare(baseline_file):
+    """Print the p50 latency of every case relative to a results file of an earlier run."""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    old = {(r['benchmark'], r['case'], r['width']): r for r in baseline['results']}
+    print(f"Compared with {baseline_file} ({baseline['versions']}):")
+    for row in results:
+        previous = old.get((row['benchmark'], row['case'], row['width']))
+        if previous is not None:
+            ratio = row['p50_ms'] / previous['p50_ms']
+            print(f"{row['benchmark']} {row['case']} w={row['width']}: p50 {previous['p50_ms']:.2f} -> "
+                  f"{row['p50_ms']:.2f} ms ({ratio:.2f}x){'  SLOWER' if ratio > 1.1 else ''}")
+
+def main(args):
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {unknown}, choose from {list(BENCHMARKS)}")
+    for name in args.benchmarks or list(BENCHMARKS):
+        BENCHMARKS[name](args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'versions': library_versions(), 'platform': platform.platform(),
+                       'args': vars(args), 'results': results}, f, indent=1)
+        print(f"Wrote {len(results)} results to {args.output}.")
+    if args.compare:
+        compare(args.compare)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs='*', help=f"Benchmarks to run, from {list(BENCHMARKS)} (default: all)")
+    parser.add_argument("--height", type=int, default=320, help="Image height (generation distorts at 5 x 64 px)")
+    parser.add_argument("--widths", type=int, nargs='+', default=[200, 800, 2000], help="Image widths to test")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed calls per case")
+    parser.add_argument("--batch_size", type=int, default=64, help="Images per call in the batch benchmark")
+    parser.add_argument("--font_size", type=int, default=FONT_SIZE, help="Font size of the render benchmark")
+    parser.add_argument("--output", default=None, help="Write the latency percentiles of every case to this JSON file")
+    parser.add_argument("--compare", default=None, help="Compare with the JSON file of an earlier run (e.g. other library versions)")
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+import argparse
+import hashlib
+import os
+import pickle
+import random
+import re
+import shutil
+import numpy as np
+
+WORDS_FILE = "./words.pickle"
+CORPUS_DIR = "corpus_cache"  # preprocessed corpora, one subdirectory per source hash
+
+# Only basic Arabic letters (U+0621 to U+064A): no diacritics, punctuation or digits.
+arabic_letters_pattern = re.compile(r'^[\u0621-\u064A]+$')
+
+def is_arabic_word(word):
+    """Return True if the word consists solely of basic Arabic letters and is longer than one character."""
+    return len(word) > 1 and bool(arabic_letters_pattern.match(word))
+
+def source_hash(path, chunk_size=1 << 20):
+    """SHA-1 hex digest of the source pickle, which names its preprocessed corpus."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def build_corpus(source, directory):
+    """
+    Filter the word list in source with is_arabic_word, drop duplicates and store it in directory:
+    words.bin holds the UTF-8 words back to back, sorted by length (stable), offsets.npy their
+    byte offsets (one more than there are words) and bucket_starts.npy the first word of each
+    length, so every length bucket is a contiguous range of word ids.
+    """
+    with open(source, 'rb') as handle:
+        all_words = pickle.load(handle)
+    words = [w for w in dict.fromkeys(all_words) if is_arabic_word(w)]
+    del all_words
+    words.sort(key=len)
+    lengths = np.fromiter((len(w) for w in words), dtype=np.int64, count=len(words))
+    # Build into a temporary directory, so an interrupted build is never mistaken for a corpus.
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    sizes = np.zeros(len(words) + 1, dtype=np.int64)
+    with open(os.path.join(tmp, "words.bin"), 'wb') as f:
+        for i, word in enumerate(words):
+            data = word.encode('utf-8')
+            f.write(data)
+            sizes[i + 1] = len(data)
+    np.save(os.path.join(tmp, "offsets.npy"), np.cumsum(sizes))
+    max_length = int(lengths[-1]) if len(words) else 0
+    np.save(os.path.join(tmp, "bucket_starts.npy"), np.searchsorted(lengths, np.arange(max_length + 2)))
+    os.replace(tmp, directory)
+
+class WordCorpus:
+    """
+    Read-only, memory-mapped view of a corpus written by build_corpus. Only the words that are
+    looked up are decoded, so loading it costs no time and forked workers share its pages.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.blob = np.memmap(os.path.join(directory, "words.bin"), dtype=np.uint8, mode='r') \
+            if os.path.getsize(os.path.join(directory, "words.bin")) else np.zeros(0, dtype=np.uint8)
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode='r')
+        self.bucket_starts = np.load(os.path.join(directory, "bucket_starts.npy"), mmap_mode='r')
+
+    @classmethod
+    def load(cls, source=WORDS_FILE, cache_dir=CORPUS_DIR):
+        """Return the corpus of the source pickle, preprocessing it first if its content is new."""
+        directory = os.path.join(cache_dir, source_hash(source))
+        if not os.path.isdir(directory):
+            print(f"Preprocessing word corpus {source} into {directory}...")
+            build_corpus(source, directory)
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def length_range(self, min_length=None, max_length=None):
+        """Word ids (a range) of the words with min_length to max_length characters."""
+        last = len(self.bucket_starts) - 1
+        lo = 0 if min_length is None else min(max(min_length, 0), last)
+        hi = last if max_length is None else min(max(max_length + 1, lo), last)
+        return range(int(self.bucket_starts[lo]), int(self.bucket_starts[hi]))
+
+    def sample(self, k, min_length=None, max_length=None, rng=random):
+        """Sample k distinct words, optionally within a range of lengths, without materializing the corpus."""
+        ids = self.length_range(min_length, max_length)
+        if len(ids) < k:
+            raise ValueError(f"Not enough words available. Required {k}, found {len(ids)}.")
+        return [self[i] for i in rng.sample(ids, k)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess the word corpus for generation.py")
+    parser.add_argument("source", nargs='?', default=WORDS_FILE, help="Pickled list of words")
+    parser.add_argument("--cache_dir", default=CORPUS_DIR, help="Directory of preprocessed corpora")
+    args = parser.parse_args()
+    corpus = WordCorpus.load(args.source, args.cache_dir)
+    print(f"{len(corpus)} distinct Arabic words in {corpus.directory}.")
+    counts = np.diff(np.asarray(corpus.bucket_starts))
+    for length in np.flatnonzero(counts):
+        print(f"  length {length}: {counts[length]} words")
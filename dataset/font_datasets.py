@@ -0,0 +1,333 @@
+import array
+import csv
+import io
+import os
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, Sampler
+import gen_line_images as synthetic
+from mask_store import MaskStore
+
+MAX_IMAGE_WIDTH = 2304  # Same width cap as generation.py
+INDEX_SUFFIX = ".index.npz"  # cached FontDataset index next to its CSV
+BUCKET_WIDTH = 64  # width range of one WidthBucketBatchSampler bucket, in pixels
+
+def seed_worker(worker_id):
+    """
+    DataLoader worker_init_fn that seeds NumPy from the worker's torch seed.
+    The augmentation code draws from np.random, which DataLoader does not reseed, so without
+    this every worker would produce the same sequence of backgrounds and distortions.
+    """
+    np.random.seed(torch.initial_seed() % 2**32)
+
+def resize_to_height(img, image_height, max_width=MAX_IMAGE_WIDTH):
+    """Resize a PIL image to image_height keeping its aspect ratio, capping the width like generation.py."""
+    target_width = min(int(img.size[0] / img.size[1] * image_height), max_width)
+    return img.resize((target_width, image_height))
+
+def sorted_labels(first_seen, provisional):
+    """
+    Return (labels, targets): labels sorted like the notebook's FontDataset and int32 targets,
+    given the labels in order of first appearance and each row's index into that order.
+    """
+    order = sorted(range(len(first_seen)), key=lambda i: first_seen[i])
+    remap = np.empty(len(first_seen), dtype=np.int32)
+    remap[order] = np.arange(len(first_seen), dtype=np.int32)
+    return [first_seen[i] for i in order], remap[np.asarray(provisional, dtype=np.int32)]
+
+def parse_width(field):
+    """Image width of a CSV width field; 0 if it is empty (not recorded)."""
+    return int(field) if field else 0
+
+def build_path_index(csv_file):
+    """
+    Read an img_path,text CSV (lines.py) into compact arrays: the UTF-8 paths back to back in one
+    uint8 array, their int64 offsets (one more than there are rows), int32 targets, the labels and
+    the int32 image widths of the optional width column (0 where unknown).
+    """
+    blob = bytearray()
+    offsets = array.array('q', [0])
+    label_ids = {}
+    provisional = array.array('i')
+    widths = array.array('i')
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        columns = {name.strip(): i for i, name in enumerate(next(reader))}
+        path_column, text_column = columns['img_path'], columns['text']
+        width_column = columns.get('width')
+        for row in reader:
+            blob += row[path_column].encode('utf-8')
+            offsets.append(len(blob))
+            provisional.append(label_ids.setdefault(row[text_column], len(label_ids)))
+            widths.append(parse_width(row[width_column]) if width_column is not None else 0)
+    labels, targets = sorted_labels(list(label_ids), provisional)
+    return (np.frombuffer(bytes(blob), dtype=np.uint8), np.frombuffer(offsets, dtype=np.int64), targets, labels,
+            np.frombuffer(widths, dtype=np.int32))
+
+def load_path_index(csv_file, cache=True):
+    """
+    build_path_index, cached in <csv_file>.index.npz. The cache is rebuilt when the CSV's size or
+    modification time changes.
+    """
+    stat = os.stat(csv_file)
+    source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    index_file = csv_file + INDEX_SUFFIX
+    if cache and os.path.exists(index_file):
+        with np.load(index_file) as index:
+            if np.array_equal(index['source'], source) and 'widths' in index:
+                return (index['paths'], index['offsets'], index['targets'], [str(label) for label in index['labels']],
+                        index['widths'])
+    paths, offsets, targets, labels, widths = build_path_index(csv_file)
+    if cache:
+        tmp = index_file + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, source=source, paths=paths, offsets=offsets, targets=targets, labels=np.array(labels, dtype=str),
+                     widths=widths)
+        os.replace(tmp, index_file)
+    return paths, offsets, targets, labels, widths
+
+def load_index(index_file, split=None):
+    """
+    Columns of a data.npz index written by lines.py, as a dict of arrays plus 'labels' (the font
+    name table, always complete). With split ('train', 'val' or 'test'), the per-row columns are
+    restricted to the rows of that split. Image paths are returned as the 'paths' blob with the
+    'starts' and 'ends' of each row.
+    """
+    with np.load(index_file) as index:
+        columns = {name: index[name] for name in index.files}
+    labels = [str(label) for label in columns.pop('labels')]
+    split_names = [str(name) for name in columns.pop('split_names')]
+    if 'path_offsets' in columns:
+        path_offsets = columns.pop('path_offsets')
+        columns['starts'], columns['ends'] = path_offsets[:-1], path_offsets[1:]
+    shard_files = columns.pop('shard_files', None)
+    paths = columns.pop('paths', None)
+    if split is not None:
+        if split not in split_names:
+            raise ValueError(f"Unknown split {split}, choose from {split_names}")
+        rows = np.flatnonzero(columns['splits'] == split_names.index(split))
+        columns = {name: column[rows] for name, column in columns.items()}
+    if shard_files is not None:
+        columns['shard_files'] = [str(f) for f in shard_files]
+    if paths is not None:
+        columns['paths'] = paths
+    columns['labels'] = labels
+    return columns
+
+class FontDataset(Dataset):
+    """
+    Font classification samples listed in a CSV written by lines.py (img_path and text columns),
+    or in its columnar data.npz index. Same interface and labels as the notebook's FontDataset,
+    but the index is held in a few NumPy arrays instead of a DataFrame of Python strings: a
+    sample costs a slice of the path blob and a label lookup, and forked DataLoader workers
+    share the arrays copy-on-write (reference counting never touches their data pages). The
+    index of a CSV is cached next to it.
+
+    Args:
+        csv_file (str): CSV with img_path and text columns, and optionally width (see
+            WidthBucketBatchSampler; widths holds 0 where it is missing), or a data.npz index.
+        base_dir (str): Base directory to prepend to the image paths.
+        transform (callable, optional): Transform applied to the PIL image.
+        cache (bool): Store/reuse the index of a CSV in <csv_file>.index.npz.
+        split (str, optional): With a data.npz index, only the 'train', 'val' or 'test' rows.
+            The labels are those of the whole index, so they agree between the splits.
+    """
+
+    def __init__(self, csv_file, base_dir="", transform=None, cache=True, split=None):
+        self.base_dir = base_dir
+        self.transform = transform
+        if csv_file.endswith('.npz'):
+            index = load_index(csv_file, split)
+            self.paths, self.starts, self.ends = index['paths'], index['starts'], index['ends']
+            self.targets, self.labels, self.widths = index['targets'], index['labels'], index['widths']
+        else:
+            if split is not None:
+                raise ValueError("Splits are only recorded in the data.npz index written by lines.py.")
+            self.paths, offsets, self.targets, self.labels, self.widths = load_path_index(csv_file, cache)
+            self.starts, self.ends = offsets[:-1], offsets[1:]
+        self.label_to_index = {label: idx for idx, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.targets)
+
+    def path(self, idx):
+        """Image path of a sample, as written in the CSV."""
+        return self.paths[self.starts[idx]:self.ends[idx]].tobytes().decode('utf-8')
+
+    def __getitem__(self, idx):
+        image = Image.open(os.path.join(self.base_dir, self.path(idx))).convert('RGB')
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.targets[idx])
+
+class MaskAugmentDataset(Dataset):
+    """
+    Font classification samples built from a mask store (see generation.py --mask_store).
+    Background, ink color, blur and distortion are drawn fresh on every access inside the
+    DataLoader workers, so each epoch sees new augmentations without regenerating images.
+
+    Args:
+        store_dir (str): Mask store directory written by generation.py.
+        backgrounds: BackgroundPool, list of background files or a single file.
+        transform (callable, optional): Transform applied to the PIL image.
+        image_height (int): Height of the returned images (generation.py uses 64).
+        distort_chance, blur_chance (float): Augmentation probabilities (generation.py uses 0.05 and 0.3).
+
+    Use worker_init_fn=seed_worker in the DataLoader.
+    """
+
+    def __init__(self, store_dir, backgrounds, transform=None, image_height=64,
+                 distort_chance=0.05, blur_chance=0.3):
+        self.store = MaskStore(store_dir)
+        self.backgrounds = backgrounds
+        self.transform = transform
+        self.image_height = image_height
+        self.distort_chance = distort_chance
+        self.blur_chance = blur_chance
+        self.labels = self.store.fonts
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, idx):
+        mask = self.store[idx]
+        img, _ = synthetic.generate_image_from_mask(
+            mask, self.store.source_sizes[idx], self.backgrounds,
+            distort_chance=self.distort_chance, blur_chance=self.blur_chance
+        )
+        image = resize_to_height(img, self.image_height).convert('RGB')
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.store.labels[idx])
+
+def read_shard_csv(csv_file):
+    """Columns of a `lines.py --shards` CSV, in the form of load_index."""
+    shard_ids = {}
+    label_ids = {}
+    offsets, nbytes, shards = array.array('q'), array.array('i'), array.array('i')
+    provisional = array.array('i')
+    widths = array.array('i')
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        columns = {name.strip(): i for i, name in enumerate(next(reader))}
+        for row in reader:
+            path = row[columns['img_path']]
+            shards.append(shard_ids.setdefault(path, len(shard_ids)))
+            offsets.append(int(row[columns['offset']]))
+            nbytes.append(int(row[columns['nbytes']]))
+            provisional.append(label_ids.setdefault(row[columns['text']], len(label_ids)))
+            widths.append(parse_width(row[columns['width']]) if 'width' in columns else 0)
+    labels, targets = sorted_labels(list(label_ids), provisional)
+    return {'shard_files': list(shard_ids), 'shards': np.frombuffer(shards, dtype=np.int32),
+            'offsets': np.frombuffer(offsets, dtype=np.int64), 'nbytes': np.frombuffer(nbytes, dtype=np.int32),
+            'widths': np.frombuffer(widths, dtype=np.int32), 'labels': labels, 'targets': targets}
+
+class ShardFontDataset(Dataset):
+    """
+    Font classification samples stored in tar shards (generation.py --shards) and indexed by a
+    CSV (or the data.npz index) written with `lines.py --shards`. Same interface and labels as
+    the notebook's FontDataset, but each image is a byte range of a memory-mapped shard, so no
+    per-image files are opened.
+
+    Args:
+        csv_file (str): CSV with img_path (the shard), offset, nbytes and text columns, and
+            optionally width, or a data.npz index.
+        base_dir (str): Base directory to prepend to the shard paths.
+        transform (callable, optional): Transform applied to the PIL image.
+        split (str, optional): With a data.npz index, only the 'train', 'val' or 'test' rows.
+    """
+
+    def __init__(self, csv_file, base_dir="", transform=None, split=None):
+        self.base_dir = base_dir
+        self.transform = transform
+        if csv_file.endswith('.npz'):
+            index = load_index(csv_file, split)
+        elif split is not None:
+            raise ValueError("Splits are only recorded in the data.npz index written by lines.py.")
+        else:
+            index = read_shard_csv(csv_file)
+        self.shard_files, self.shards = index['shard_files'], index['shards']
+        self.offsets, self.nbytes, self.widths = index['offsets'], index['nbytes'], index['widths']
+        self.labels, self.targets = index['labels'], index['targets']
+        self.label_to_index = {label: idx for idx, label in enumerate(self.labels)}
+        self.maps = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    def _shard(self, i):
+        # Mapped lazily so each DataLoader worker maps the shards itself.
+        if self.maps is None:
+            self.maps = [np.memmap(os.path.join(self.base_dir, f), dtype=np.uint8, mode='r') for f in self.shard_files]
+        return self.maps[self.shards[i]]
+
+    def __getitem__(self, idx):
+        start = self.offsets[idx]
+        data = self._shard(idx)[start:start + self.nbytes[idx]]
+        image = Image.open(io.BytesIO(data.tobytes())).convert('RGB')
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.targets[idx])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['maps'] = None
+        return state
+
+class WidthBucketBatchSampler(Sampler):
+    """
+    Batch sampler for training at the stored 64 px height instead of stretching every image to
+    224 x 224. Samples are grouped by their width (the widths of FontDataset or ShardFontDataset,
+    recorded by generation.py) into buckets of bucket_width pixels, and every batch comes from a
+    single bucket, so pad_collate pads each image by less than bucket_width pixels. Batches are
+    shuffled within and across buckets, seeded per epoch (set_epoch). Samples of unknown width
+    (0) form a bucket of their own.
+
+    Use it as batch_sampler together with collate_fn=pad_collate.
+    """
+
+    def __init__(self, widths, batch_size, bucket_width=BUCKET_WIDTH, shuffle=True, drop_last=False, seed=0):
+        buckets = -(-np.asarray(widths, dtype=np.int64) // bucket_width)
+        order = np.argsort(buckets, kind='stable')
+        self.buckets = [b for b in np.split(order, np.cumsum(np.bincount(buckets))[:-1]) if len(b)]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(b) // self.batch_size for b in self.buckets)
+        return sum(-(-len(b) // self.batch_size) for b in self.buckets)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        order = rng.permutation(len(batches)) if self.shuffle else range(len(batches))
+        for i in order:
+            yield batches[i].tolist()
+
+def pad_collate(batch, pad_value=0.0):
+    """
+    collate_fn for images of one height and different widths: stacks the (C x H x W tensor, label)
+    samples into a batch padded on the right with pad_value to its widest image. Use a transform
+    without Resize (e.g. ToTensor and Normalize, where 0 pads with the mean colour).
+    """
+    images, labels = zip(*batch)
+    channels, height = images[0].shape[:2]
+    padded = images[0].new_full((len(images), channels, height, max(img.shape[2] for img in images)), pad_value)
+    for i, img in enumerate(images):
+        padded[i, :, :, :img.shape[2]] = img
+    return padded, torch.tensor(labels)
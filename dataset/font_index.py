@@ -0,0 +1,220 @@
+import warnings
+warnings.filterwarnings("ignore", message="256 extra bytes in post.stringData array")
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from fontTools.ttLib import TTFont, TTLibError
+from PIL import Image
+import gen_line_images as synthetic
+
+FONT_INDEX_FILE = "font_index.json"
+INDEX_VERSION = 1
+# Check outcomes that say more about the run (a loaded machine, a short --font_timeout) than about
+# the font; they are never stored, so the font is checked again by the next run.
+TRANSIENT_ERROR_CLASSES = ('timeout', 'crashed')
+
+# Basic Arabic letters every font must cover, and the block whose coverage is recorded.
+ARABIC_LETTERS = [chr(c) for c in range(0x0621, 0x064B)]
+COVERAGE_RANGE = (0x0600, 0x06FF)
+
+# FreeType errors raised by broken hinting programs or outlines.
+RENDER_ERROR_PHRASES = ["execution context too long", "invalid outline", "code overflow", "invalid argument"]
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the SHA-1 hex digest of a file's content."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def coverage_ranges(cmap):
+    """Compress the cmap codepoints inside COVERAGE_RANGE into a list of [start, end] ranges."""
+    ranges = []
+    for c in range(COVERAGE_RANGE[0], COVERAGE_RANGE[1] + 1):
+        if c not in cmap:
+            continue
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return ranges
+
+def coverage_set(record):
+    """Return the set of covered codepoints stored in an index record."""
+    return {c for start, end in record['coverage'] for c in range(start, end + 1)}
+
+def check_glyphs(font_temp, cmap):
+    """
+    Check that every basic Arabic letter maps to a non-empty glyph.
+    Handles both TTF fonts (glyf table) and OTF fonts (CFF table).
+    Returns (error_class, message), or (None, None) if all letters are usable.
+    """
+    for letter in ARABIC_LETTERS:
+        if ord(letter) not in cmap:
+            return 'missing_letter', f"missing letter {letter} in cmap"
+        glyph_name = cmap[ord(letter)]
+        try:
+            if "glyf" in font_temp:
+                glyf = font_temp["glyf"]
+                if glyph_name not in glyf.glyphs:
+                    return 'missing_glyph', f"missing glyph {glyph_name} for letter {letter} in glyf table"
+                # Indexing the table (rather than .glyphs) expands the glyph so numberOfContours is set.
+                num_contours = getattr(glyf[glyph_name], "numberOfContours", None)
+                if not num_contours:
+                    return 'empty_glyph', f"empty glyph for letter {letter} (glyph name: {glyph_name}) in glyf table"
+            elif "CFF " in font_temp:
+                charstrings = font_temp["CFF "].cff.topDictIndex[0].CharStrings
+                if glyph_name not in charstrings:
+                    return 'missing_glyph', f"missing glyph {glyph_name} for letter {letter} in CFF table"
+            else:
+                return 'no_outlines', "neither a glyf nor a CFF table"
+        except TTLibError as err:
+            return 'glyph_error', str(err)
+    return None, None
+
+def check_font(font, test_word):
+    """
+    Run the cmap, glyph and test-render checks on a font file.
+    Returns a JSON-serialisable record; record['valid'] is True only if every check passed.
+    """
+    record = {'coverage': [], 'glyph_error': None, 'test_word': test_word, 'render_ok': None,
+              'render_seconds': None, 'error_class': None, 'error': None, 'valid': False}
+    try:
+        font_temp = TTFont(font)
+        cmap = font_temp['cmap'].getBestCmap()
+    except Exception as e:
+        record['error_class'], record['error'] = 'unreadable', str(e)
+        return record
+    try:
+        if cmap is None:
+            record['error_class'], record['error'] = 'no_cmap', "no cmap"
+            return record
+        record['coverage'] = coverage_ranges(cmap)
+        error_class, error = check_glyphs(font_temp, cmap)
+    finally:
+        font_temp.close()
+    if error_class is not None:
+        record['glyph_error'] = error
+        record['error_class'], record['error'] = error_class, error
+        return record
+
+    # Render one test word on a plain canvas to catch FreeType errors.
+    rendered_text = "".join([e for e in test_word if ord(e) in cmap])
+    start = time.perf_counter()
+    try:
+        img = synthetic.draw_text_on_background(
+            rendered_text, font, 40, background_img=Image.new('RGB', (64, 64), 'white'), resized_ht=64
+        )
+    except Exception as e:
+        err_str = str(e).lower()
+        known = any(phrase in err_str for phrase in RENDER_ERROR_PHRASES)
+        record['render_ok'] = False
+        record['error_class'] = 'render_freetype' if known else 'render_error'
+        record['error'] = str(e)
+        return record
+    record['render_seconds'] = time.perf_counter() - start
+    if img is None:
+        record['render_ok'] = False
+        record['error_class'], record['error'] = 'render_empty', f"empty render of '{rendered_text}'"
+        return record
+    record['render_ok'] = True
+    record['valid'] = True
+    return record
+
+class FontIndex:
+    """
+    Persistent font validation results, keyed by the SHA-1 of each font file.
+    File paths map to their hash through a (size, mtime) stat cache, so unchanged
+    files are neither rehashed nor revalidated on later runs.
+    """
+
+    def __init__(self, path=FONT_INDEX_FILE):
+        self.path = path
+        self.entries = {}
+        self.files = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self.entries = data['entries']
+                    self.files = data['files']
+                else:
+                    print(f"Font index {path} has an old format, rebuilding it.")
+            except Exception as e:
+                print(f"Error reading font index {path}: {e}")
+
+    def font_hash(self, font):
+        """Return the content hash of a font file, rehashing only if its size or mtime changed."""
+        st = os.stat(font)
+        cached = self.files.get(font)
+        if cached is not None and cached['size'] == st.st_size and cached['mtime'] == st.st_mtime_ns:
+            return cached['sha1']
+        sha1 = file_hash(font)
+        self.files[font] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': sha1}
+        self.dirty = True
+        return sha1
+
+    def lookup(self, font):
+        """Return the stored record for a font file, or None if it has not been validated yet."""
+        try:
+            return self.entries.get(self.font_hash(font))
+        except OSError:
+            return None
+
+    def add(self, font, record):
+        """Store a validation record for a font file (transient failures are not stored)."""
+        if record.get('error_class') in TRANSIENT_ERROR_CLASSES:
+            return
+        self.entries[self.font_hash(font)] = dict(record, path=font)
+        self.dirty = True
+
+    def validate(self, font, test_word):
+        """Return the record for a font, running check_font only for new or changed files."""
+        record = self.lookup(font)
+        if record is None:
+            record = check_font(font, test_word)
+            try:
+                self.add(font, record)
+            except OSError:
+                pass
+        return record
+
+    def save(self):
+        """Write the index atomically (no-op if nothing changed); processes sharing the index use their own temporary file."""
+        if not self.dirty or not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+def main(args):
+    """Validate every font in a directory and store the results in the index."""
+    index = FontIndex(args.index)
+    fonts = synthetic.get_fonts(args.font_path, "")
+    test_words = ["كلمة", "مثال", "اختبار"]
+    counts = {}
+    for i, font in enumerate(fonts, start=1):
+        record = index.validate(font, random.choice(test_words))
+        key = record['error_class'] or 'valid'
+        counts[key] = counts.get(key, 0) + 1
+        if i % 500 == 0:
+            index.save()
+    index.save()
+    print(f"Indexed {len(fonts)} fonts into {args.index}:")
+    for key, count in sorted(counts.items()):
+        print(f"  {key}: {count}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("font_path", nargs='?', default="./fonts_2K", help="Font directory to index")
+    parser.add_argument("--index", default=FONT_INDEX_FILE, help="Path of the font index file")
+    main(parser.parse_args())
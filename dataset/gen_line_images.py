@@ -2,23 +2,16 @@ import warnings
 warnings.filterwarnings("ignore", message="256 extra bytes in post.stringData array")
 
 import os
+import functools
 from PIL import Image, ImageFont, ImageDraw, ImageFilter, ImageOps, ImageEnhance
+from fontTools.ttLib import TTFont
 import numpy as np
 import time
 import cv2
 import image_distortion
-import re
-
-# --- New helper to filter Arabic words ---
-# Only Arabic letters (from U+0621 to U+064A), excluding diacritics, punctuation, and digits.
-arabic_letters_pattern = re.compile(r'^[\u0621-\u064A]+$')
-
-def is_arabic_word(word):
-    """
-    Returns True if the word consists solely of basic Arabic letters (excluding diacritics, punctuation, and digits)
-    and is longer than one character.
-    """
-    return len(word) > 1 and bool(arabic_letters_pattern.match(word))
+from backgrounds import BackgroundPool
+from corpus import is_arabic_word
+from stage_timer import stage
 
 # Global parameters
 SEED = 42
@@ -32,6 +25,7 @@ MAX_FONT_SIZE = 40
 BUFFER_x = 5  # Buffer to leave in line images (x-axis)
 BUFFER_y = 5  # Buffer (y-axis)
 IMAGE_HT = 64  # Image height to save
+FONT_CACHE_SIZE = 64  # Parsed fonts kept per process (font handles and cmaps)
 
 # def get_fonts(font_path=None, type='regular'):
 #     if font_path is None:
@@ -78,6 +72,31 @@ def get_fonts(font_path=None, type='regular'):
     return list(font_dict.values())
 
 
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font, font_size):
+    """
+    Returns a FreeTypeFont for (font, font_size), reusing handles already parsed by this process.
+    Workers go through their share font by font, so a small LRU cache avoids reparsing the
+    same font file for every word.
+    """
+    return ImageFont.truetype(font=font, size=font_size)
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_cmap(font):
+    """
+    Returns the best cmap (codepoint -> glyph name) of a font file, or None if it has none.
+    The returned dict is shared between callers and must not be modified.
+    """
+    font_temp = TTFont(font)
+    try:
+        return font_temp['cmap'].getBestCmap()
+    finally:
+        font_temp.close()
+
+def font_label(font):
+    """Class label of a font file: its base name without extension or trailing spaces/underscores."""
+    return os.path.splitext(os.path.basename(font))[0].rstrip(" _")
+
 def set_buffers(x, y):
     global BUFFER_x, BUFFER_y
     BUFFER_x = x
@@ -90,7 +109,7 @@ def get_font(font_list, min_size=25, max_size=40):
     
 def create_full_line_img(text, font, font_size, img_ht=IMAGE_HT, flip=False):
     # Load the font and compute the text bounding box.
-    image_font = ImageFont.truetype(font=font, size=font_size)
+    image_font = load_font(font, font_size)
     (left, top, right, bottom) = image_font.getbbox(text)
     abs_left = np.abs(left)
     abs_top = np.abs(top)
@@ -166,44 +185,98 @@ def read_line_img_from_file(img_file, new_ht=IMAGE_HT):
     resized_img = cv2.resize(img, (new_width, new_ht))
     return resized_img, (new_width, new_ht)
 
-def draw_text_on_background(text, font, font_size, offset=None, background_file=None, 
-                              background_img=None, color=None, resized_ht=None, resized_width=None):
-    if background_img is None:
-        background_img = Image.open(background_file)
-    image_font = ImageFont.truetype(font=font, size=font_size)
-    background_size = background_img.size
-
-    if np.random.rand() < 0.8:  # 80% chance black
-        color = (0, 0, 0)
-    else:  # 20% chance gray
-        gray_value = np.random.randint(50, 150)  # medium-dark gray
-        color = (gray_value, gray_value, gray_value)
-    
+def render_text_mask(text, font, font_size):
+    """
+    Renders text once as an 8-bit coverage mask (0 = background, 255 = ink) cropped to the
+    text bounding box. Returns None if the bounding box is empty.
+    """
+    with stage('font_load'):
+        image_font = load_font(font, font_size)
     (left, top, right, bottom) = image_font.getbbox(text)
     width = np.abs(right - left)
     ht = np.abs(bottom - top)
     if width == 0 or ht == 0:
         return None
-    font_x = -left
-    font_y = -top
-    if background_size[0] < width or background_size[1] < ht:
-        background_img = background_img.resize((width, ht))
+    mask = Image.new('L', (width, ht), color=0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=image_font, fill=255)
+    return np.asarray(mask)
+
+def composite_text(patch, mask, color):
+    """
+    Blends a solid text color into an (h, w, 3) uint8 background patch through a coverage mask.
+    Uses the same rounding as PIL's masked fill, so the result matches ImageDraw.text exactly.
+    """
+    alpha = mask[:, :, None].astype(np.uint32)
+    blended = patch.astype(np.uint32) * (255 - alpha) + np.asarray(color, dtype=np.uint32) * alpha + 128
+    return ((blended + (blended >> 8)) >> 8).astype(np.uint8)
+
+def choose_text_color():
+    """Draws the ink color: 80% black, 20% medium-dark gray."""
+    if np.random.rand() < 0.8:  # 80% chance black
+        return (0, 0, 0)
+    gray_value = np.random.randint(50, 150)  # medium-dark gray
+    return (gray_value, gray_value, gray_value)
+
+def choose_background(background_file):
+    """
+    Picks a background from a BackgroundPool, a list of files or a single file.
+    Returns (background_file, background_img); exactly one of them is set.
+    """
+    if isinstance(background_file, BackgroundPool):
+        return None, background_file.choice()
+    if isinstance(background_file, list):
+        return np.random.choice(background_file), None
+    return background_file, None
+
+def sample_background_patch(background_img, width, ht, offset=None):
+    """
+    Returns a (ht, width, 3) uint8 window of the background at a random (or given) offset.
+    Backgrounds smaller than the window are resized to it. background_img may be a PIL image
+    or a NumPy view from a BackgroundPool; for views only the window is copied.
+    """
+    if isinstance(background_img, np.ndarray):
+        background_size = (background_img.shape[1], background_img.shape[0])
+    else:
         background_size = background_img.size
+    if background_size[0] < width or background_size[1] < ht:
+        if isinstance(background_img, np.ndarray):
+            background_img = Image.fromarray(background_img)
+        return np.asarray(background_img.resize((width, ht)).convert('RGB'))
     if offset is None:
         valid_left = np.random.randint(background_size[0] - width + 1)
         valid_top = np.random.randint(background_size[1] - ht + 1)
-    offset = (font_x + valid_left, font_y + valid_top)
-    draw = ImageDraw.Draw(background_img)
-    draw.text(offset, text, font=image_font, fill=color)
-    background_img = background_img.crop((valid_left, valid_top, valid_left + width, valid_top + ht))
-    width, ht = background_img.size
-    if width == 0 or ht == 0:
-        return None
+    else:
+        valid_left, valid_top = offset
+    if isinstance(background_img, np.ndarray):
+        return background_img[valid_top:valid_top + ht, valid_left:valid_left + width]
+    return np.asarray(background_img.crop((valid_left, valid_top, valid_left + width, valid_top + ht)).convert('RGB'))
+
+def draw_text_on_background(text, font, font_size, offset=None, background_file=None, 
+                              background_img=None, color=None, resized_ht=None, resized_width=None,
+                              return_mask=False):
+    # The text is rendered as a coverage mask and blended into just the background window it
+    # lands in. background_img may be a PIL image or a NumPy view from a BackgroundPool.
+    # With return_mask, returns (img, mask, (width, ht)): the clean coverage mask resized like img
+    # and the size the text had at font resolution.
+    if background_img is None:
+        background_img = Image.open(background_file)
+    color = choose_text_color()
+    mask = render_text_mask(text, font, font_size)
+    if mask is None:
+        return (None, None, None) if return_mask else None
+    ht, width = mask.shape
+    patch = sample_background_patch(background_img, width, ht, offset)
+    background_img = Image.fromarray(composite_text(patch, mask, color))
     if resized_ht is not None and resized_width is None:
         resized_width = int(width / ht * resized_ht)
     if resized_ht is not None:
         background_img = background_img.resize((resized_width, resized_ht))
-    return background_img
+    if not return_mask:
+        return background_img
+    mask_img = Image.fromarray(mask)
+    if resized_ht is not None:
+        mask_img = mask_img.resize((resized_width, resized_ht))
+    return background_img, np.asarray(mask_img), (width, ht)
 
 # def apply_blur(img, radius=None):
 #     if radius is None:
@@ -216,27 +289,107 @@ def apply_blur(img, radius=None):
         radius = np.random.uniform(0.5, 2.0)  # subtle blur from 0.5 to 2.0
     return img.filter(ImageFilter.GaussianBlur(radius=radius))
 
-def main_generate_image(text, font, font_size, background_file, 
-                        distort_chance=0.3, blur_chance=0.5, ht=60, flip=False):
+def apply_augmentations(img, distort_chance=0.3, blur_chance=0.5, flip=False):
+    """Applies the random blur, distortion and flip stages of main_generate_image to a rendered image."""
     img_blurred = False
     img_distorted = False
     distortion = 'None'
-    if isinstance(background_file, list):
-        background = np.random.choice(background_file)
-    else:
-        background = background_file
-    img = draw_text_on_background(text, font, font_size, background_file=background, resized_ht=ht)
-    if img is None:
-        return img, None
     blur = np.random.rand()
     if blur < blur_chance:
-        img = apply_blur(img)
+        with stage('blur'):
+            img = apply_blur(img)
         img_blurred = True
     distort = np.random.rand()
     if distort < distort_chance:
-        img, distortion = image_distortion.apply_random_transform(np.array(img))
-        img = Image.fromarray(img)
+        with stage('distortion'):
+            img, distortion = image_distortion.apply_random_transform(np.array(img))
+            img = Image.fromarray(img)
         img_distorted = True
     if flip:
         img = ImageOps.mirror(img)
     return img, {'blurred': img_blurred, 'distorted': img_distorted, 'distortion': distortion}
+
+def apply_blur_batch(images, radius=None):
+    """
+    Blurs equally tall uint8 arrays with one Gaussian radius in a single cv2.GaussianBlur call
+    over a stack of the images, each mirror-padded by the kernel radius. OpenCV uses a true
+    Gaussian kernel where PIL approximates it with box blurs, so results differ from apply_blur
+    by about 0.1 gray levels on average.
+    """
+    if radius is None:
+        radius = np.random.uniform(0.5, 2.0)  # subtle blur from 0.5 to 2.0
+    # Kernel size OpenCV picks for uint8 images with ksize=(0, 0).
+    margin = int(round(radius * 3)) + 1
+    ht = images[0].shape[0]
+    tile_ht = ht + 2 * margin
+    tile_width = max(img.shape[1] for img in images) + 2 * margin
+    stack = np.concatenate([cv2.copyMakeBorder(img, margin, margin, margin, tile_width - margin - img.shape[1],
+                                               cv2.BORDER_REFLECT_101) for img in images])
+    blurred = cv2.GaussianBlur(stack, (0, 0), radius)
+    return [blurred[i * tile_ht + margin:i * tile_ht + margin + ht, margin:margin + img.shape[1]]
+            for i, img in enumerate(images)]
+
+def apply_augmentations_batch(images, distort_chance=0.3, blur_chance=0.5, flip=False,
+                              bucket_width=image_distortion.REMAP_BUCKET_WIDTH):
+    """
+    Batch version of apply_augmentations for (ht, w, 3) uint8 arrays of one height, e.g. rendered
+    words resized to a common height. Blur and distortion are drawn per image. Blurred images
+    share one radius per width bucket, and distortions go through
+    image_distortion.apply_random_transform_batch. Images stay NumPy arrays throughout.
+    Returns (images, infos) in input order.
+    """
+    blurred = np.random.rand(len(images)) < blur_chance
+    distorted = np.random.rand(len(images)) < distort_chance
+    results = list(images)
+    for bucket in image_distortion.width_buckets([img.shape[1] for img in images], bucket_width).values():
+        indices = [i for i in bucket if blurred[i]]
+        if indices:
+            for i, img in zip(indices, apply_blur_batch([results[i] for i in indices])):
+                results[i] = img
+    infos = [{'blurred': bool(blurred[i]), 'distorted': bool(distorted[i]), 'distortion': 'None'}
+             for i in range(len(images))]
+    indices = np.flatnonzero(distorted)
+    if len(indices):
+        distorted_imgs, methods = image_distortion.apply_random_transform_batch(
+            [results[i] for i in indices], bucket_width=bucket_width)
+        for i, img, method in zip(indices, distorted_imgs, methods):
+            results[i] = img
+            infos[i]['distortion'] = method
+    if flip:
+        results = [np.ascontiguousarray(img[:, ::-1]) for img in results]
+    return results, infos
+
+def main_generate_image(text, font, font_size, background_file, 
+                        distort_chance=0.3, blur_chance=0.5, ht=60, flip=False, return_mask=False):
+    # With return_mask, the info dict also holds 'mask' (the clean text mask before augmentation)
+    # and 'source_size' (see draw_text_on_background).
+    with stage('draw'):
+        background, background_img = choose_background(background_file)
+        img = draw_text_on_background(text, font, font_size, background_file=background,
+                                      background_img=background_img, resized_ht=ht, return_mask=return_mask)
+    if return_mask:
+        img, mask, source_size = img
+    if img is None:
+        return img, None
+    img, info = apply_augmentations(img, distort_chance, blur_chance, flip)
+    if return_mask:
+        info['mask'] = mask
+        info['source_size'] = source_size
+    return img, info
+
+def generate_image_from_mask(mask, source_size, background_file, distort_chance=0.3, blur_chance=0.5, flip=False):
+    """
+    Recreates a main_generate_image sample from a stored clean text mask with fresh random draws.
+    source_size is the (width, ht) the text had at font resolution, so the background window is
+    taken at the same scale as during generation and then resized to the mask.
+    """
+    background, background_img = choose_background(background_file)
+    if background_img is None:
+        background_img = Image.open(background)
+    color = choose_text_color()
+    patch = sample_background_patch(background_img, source_size[0], source_size[1])
+    ht, width = mask.shape
+    if patch.shape[:2] != (ht, width):
+        patch = np.asarray(Image.fromarray(patch).resize((width, ht)))
+    img = Image.fromarray(composite_text(patch, mask, color))
+    return apply_augmentations(img, distort_chance, blur_chance, flip)
@@ -4,15 +4,29 @@ warnings.filterwarnings("ignore", message="256 extra bytes in post.stringData ar
 
 import argparse
 import gen_line_images as synthetic
+import image_distortion
 import random
 import os
-import pickle
 import numpy as np
 import glob
-from fontTools.ttLib import TTFont, TTLibError
-import uuid
+from font_index import FontIndex, FONT_INDEX_FILE, check_font, file_hash
+from task_pool import TimeoutPool, TaskTimeout, WorkerDied, worker_slot, heartbeat
+from backgrounds import BackgroundPool
+from mask_store import MaskStoreWriter, drop_masks
+from shards import ShardWriter, SHARD_SIZE, finalize_shards
+import stage_timer
+from stage_timer import StageTimer, stage, count
+from image_writer import ImageWriter, IMAGE_CODECS, WRITER_THREADS, WRITE_QUEUE, write_file
+from manifests import read_rows, merge_manifests
+from corpus import WordCorpus, WORDS_FILE
+import json
+import hashlib
+import collections
+import functools
+import shutil
+import tempfile
+import threading
 import multiprocessing
-import re
 from tqdm import tqdm  # progress bar library
 import time
 import logging
@@ -24,45 +38,41 @@ np.random.seed(GLOBAL_SEED)
 
 MIN_FONT_SIZE = 8
 MAX_FONT_SIZE = 40
+FONT_CHECK_TIMEOUT = 60  # seconds before a font check is killed (hinting programs can hang FreeType)
+CHUNK_SIZE = 64  # words per generation task
+RENDER_TIMEOUT = 60  # seconds a worker may spend on one sample before it is killed and the font quarantined
+SPARE_FONTS = 8  # validated fonts kept per run to replace quarantined ones
+FAILED_FONTS_FILE = "failed_fonts.txt"  # fonts excluded from future runs
+RUN_FILE = "run.json"         # selected fonts and words, stored in each run directory
+JOURNAL_DIR = ".journal"      # per-worker logs of completed cells, inside each run directory
+DISTORT_CHANCE = 0.05
+BLUR_CHANCE = 0.3
+# Part of every cell key: bump it when a change to the rendering code changes the images, so
+# --incremental renders every cell again instead of reusing the previous run's images.
+RENDER_VERSION = 1
 
-# --- Helper to filter Arabic words (only basic letters, no diacritics, punctuation, or digits) ---
-arabic_letters_pattern = re.compile(r'^[\u0621-\u064A]+$')
-
-def is_arabic_word(word):
-    """Return True if the word consists solely of basic Arabic letters and is longer than one character."""
-    return len(word) > 1 and bool(arabic_letters_pattern.match(word))
-
-def sample_fonts_and_words(all_fonts, all_words, dataset_size):
-    """Randomly sample dataset_size unique fonts and dataset_size unique words."""
+def sample_fonts_and_words(all_fonts, corpus, dataset_size):
+    """Randomly sample dataset_size unique fonts and dataset_size unique words of the corpus."""
     if len(all_fonts) < dataset_size:
         raise ValueError(f"Not enough fonts available. Required {dataset_size}, found {len(all_fonts)}")
-    if len(all_words) < dataset_size:
-        raise ValueError(f"Not enough words available. Required {dataset_size}, found {len(all_words)}")
     selected_fonts = random.sample(all_fonts, dataset_size)
-    selected_words = random.sample(all_words, dataset_size)
+    selected_words = corpus.sample(dataset_size)
     return selected_fonts, selected_words
 
-def save_img_text(img, font, output_path, unique_suffix):
-    """Save the image using a file name that includes the font name and a unique suffix."""
-    base_font = os.path.splitext(os.path.basename(font))[0]
-    img_filename = os.path.join(output_path, f"{base_font}_{unique_suffix}.jpg")
-    img.convert('RGB').save(img_filename)
-    return img_filename
-
-def try_fix_rendered_text(rendered_text, font, font_size, all_backgrounds, image_height):
+def try_fix_rendered_text(rendered_text, font, font_size, all_backgrounds, image_height, return_mask=False):
     """Try to fix rendered_text by replacing one character at a time with a space."""
     for char in rendered_text:
         try:
             modified_text = rendered_text.replace(char, ' ')
-            img, _ = synthetic.main_generate_image(
+            img, info = synthetic.main_generate_image(
                 modified_text, font, font_size, all_backgrounds,
-                ht=image_height * 5, distort_chance=0.05, blur_chance=0.3, flip=False
+                ht=image_height * 5, distort_chance=DISTORT_CHANCE, blur_chance=BLUR_CHANCE, flip=False, return_mask=return_mask
             )
             if img is not None:
-                return modified_text, img
+                return modified_text, img, info
         except Exception:
             continue
-    return None, None
+    return None, None, None
 
 def create_placeholder_image(font, image_height):
     """
@@ -88,276 +98,658 @@ def create_placeholder_image(font, image_height):
     draw.text(position, fallback_word, fill="black", font=basic_font)
     return img
 
-def worker_process_groups(group_list, all_backgrounds, font_size, image_height, output_path, seed, pos, 
-                            failed_fonts_gen, progress_counter, selected_words, max_attempts=3, max_fallback_attempts=3):
-    """
-    Processes a list of (word, font, index) tuples.
-    Each tuple is processed exactly once by calling process_tuple().
-    A dedicated logger is used; log messages are flushed immediately.
-    """
-    logger = logging.getLogger(f"worker_{pos}")
+def worker_logger(name):
+    """Logger writing warnings and errors to <name>.log."""
+    logger = logging.getLogger(name)
     logger.setLevel(logging.WARNING)
-    fh = logging.FileHandler(f"worker_{pos}.log", mode='w', encoding='utf-8')
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
-
-    random.seed(seed)
-    np.random.seed(seed)
-    output_dict = {}
+    if not logger.handlers:
+        # Appending, since the worker handles many chunks (and may be restarted).
+        fh = logging.FileHandler(f"{name}.log", mode='a', encoding='utf-8')
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        fh.setFormatter(formatter)
+        logger.addHandler(fh)
+    return logger
 
-    def flush_logger():
-        for handler in logger.handlers:
-            handler.flush()
+def flush_logger(logger):
+    for handler in logger.handlers:
+        handler.flush()
 
-    def process_tuple(word, font, idx):
-        try:
-            font_temp = TTFont(font)
-            cmap = font_temp['cmap'].getBestCmap()
-        except Exception as e:
-            logger.error(f"Error reading font {font}: {e}")
-            flush_logger()
-            return None, None
+def render_word(word, font, font_size, all_backgrounds, image_height, selected_words, logger,
+                max_attempts=3, max_fallback_attempts=3, return_mask=False):
+    """
+    Render word with font the way generation.py does, seeded by the caller. Characters missing
+    from the font's cmap are dropped; a failed render is retried with try_fix_rendered_text, and
+    after max_attempts the word is replaced by random words of selected_words. Returns
+    (rendered text, image, info), or (None, None, None) if nothing could be rendered.
+    Problems are logged to logger.
+    """
+    try:
+        with stage('font_load'):
+            cmap = synthetic.load_cmap(font)
+    except Exception as e:
+        logger.error(f"Error reading font {font}: {e}")
+        flush_logger(logger)
+        return None, None, None
 
-        if cmap is None:
-            logger.error(f"No cmap for font {os.path.basename(font)}.")
-            flush_logger()
-            return None, None
+    if cmap is None:
+        logger.error(f"No cmap for font {os.path.basename(font)}.")
+        flush_logger(logger)
+        return None, None, None
 
-        current_word = word
-        for attempt in range(1, max_attempts+1):
-            try:
+    current_word = word
+    for attempt in range(1, max_attempts+1):
+        try:
+            with stage('cmap_filter'):
                 rendered_text = "".join([e for e in current_word if ord(e) in cmap])
-            except Exception as e:
-                logger.error(f"Error processing word '{current_word}' for font {font}: {e}")
-                flush_logger()
-                continue
-            if len(rendered_text) == 0:
-                logger.warning(f"Rendered text empty for '{current_word}' with font {font} on primary attempt {attempt}.")
-                flush_logger()
-                continue
-            try:
-                img, _ = synthetic.main_generate_image(
-                    rendered_text, font, font_size, all_backgrounds,
-                    ht=image_height * 5, distort_chance=0.05, blur_chance=0.3, flip=False
-                )
-            except Exception as e:
-                logger.error(f"Exception during image generation for '{rendered_text}' with font {font}: {e}")
-                flush_logger()
-                # Check for problematic phrases.
-                err_str = str(e).lower()
-                if any(phrase in err_str for phrase in ["execution context too long", "invalid outline", "code overflow", "invalid argument"]):
-                    # Skip further attempts for this font.
-                    return None, None
-                fixed_text, img = try_fix_rendered_text(rendered_text, font, font_size, all_backgrounds, image_height)
-                if fixed_text is not None and img is not None:
-                    current_word = fixed_text
-                else:
-                    continue
-            if img is None:
-                logger.warning(f"Image generation returned None for '{rendered_text}' with font {font} on primary attempt {attempt}.")
-                flush_logger()
+        except Exception as e:
+            logger.error(f"Error processing word '{current_word}' for font {font}: {e}")
+            flush_logger(logger)
+            continue
+        if len(rendered_text) == 0:
+            logger.warning(f"Rendered text empty for '{current_word}' with font {font} on primary attempt {attempt}.")
+            flush_logger(logger)
+            continue
+        try:
+            img, info = synthetic.main_generate_image(
+                rendered_text, font, font_size, all_backgrounds,
+                ht=image_height * 5, distort_chance=DISTORT_CHANCE, blur_chance=BLUR_CHANCE, flip=False,
+                return_mask=return_mask
+            )
+        except Exception as e:
+            logger.error(f"Exception during image generation for '{rendered_text}' with font {font}: {e}")
+            flush_logger(logger)
+            # Check for problematic phrases.
+            err_str = str(e).lower()
+            if any(phrase in err_str for phrase in ["execution context too long", "invalid outline", "code overflow", "invalid argument"]):
+                # Skip further attempts for this font.
+                return None, None, None
+            count('retry', os.path.basename(font))
+            with stage('retry'):
+                fixed_text, img, info = try_fix_rendered_text(rendered_text, font, font_size, all_backgrounds, image_height,
+                                                               return_mask=return_mask)
+            if fixed_text is not None and img is not None:
+                current_word = fixed_text
+            else:
                 continue
-            return rendered_text, img
+        if img is None:
+            logger.warning(f"Image generation returned None for '{rendered_text}' with font {font} on primary attempt {attempt}.")
+            flush_logger(logger)
+            continue
+        return rendered_text, img, info
 
-        for fallback in range(1, max_fallback_attempts+1):
-            current_word = random.choice(selected_words)
-            try:
+    for fallback in range(1, max_fallback_attempts+1):
+        count('fallback', os.path.basename(font))
+        current_word = random.choice(selected_words)
+        try:
+            with stage('cmap_filter'):
                 rendered_text = "".join([e for e in current_word if ord(e) in cmap])
-            except Exception as e:
-                logger.error(f"Fallback error processing word '{current_word}' for font {font}: {e}")
-                flush_logger()
-                continue
-            if len(rendered_text) == 0:
-                logger.warning(f"Fallback: Rendered text empty for '{current_word}' with font {font} on fallback attempt {fallback}.")
-                flush_logger()
-                continue
-            try:
-                img, _ = synthetic.main_generate_image(
-                    rendered_text, font, font_size, all_backgrounds,
-                    ht=image_height * 5, distort_chance=0.05, blur_chance=0.3, flip=False
-                )
-            except Exception as e:
-                logger.error(f"Fallback exception during image generation for '{rendered_text}' with font {font}: {e}")
-                flush_logger()
-                fixed_text, img = try_fix_rendered_text(rendered_text, font, font_size, all_backgrounds, image_height)
-                if fixed_text is not None and img is not None:
-                    rendered_text = fixed_text
-                else:
-                    continue
-            if img is None:
-                logger.warning(f"Fallback: Image generation returned None for '{rendered_text}' with font {font} on fallback attempt {fallback}.")
-                flush_logger()
+        except Exception as e:
+            logger.error(f"Fallback error processing word '{current_word}' for font {font}: {e}")
+            flush_logger(logger)
+            continue
+        if len(rendered_text) == 0:
+            logger.warning(f"Fallback: Rendered text empty for '{current_word}' with font {font} on fallback attempt {fallback}.")
+            flush_logger(logger)
+            continue
+        try:
+            img, info = synthetic.main_generate_image(
+                rendered_text, font, font_size, all_backgrounds,
+                ht=image_height * 5, distort_chance=DISTORT_CHANCE, blur_chance=BLUR_CHANCE, flip=False,
+                return_mask=return_mask
+            )
+        except Exception as e:
+            logger.error(f"Fallback exception during image generation for '{rendered_text}' with font {font}: {e}")
+            flush_logger(logger)
+            count('retry', os.path.basename(font))
+            with stage('retry'):
+                fixed_text, img, info = try_fix_rendered_text(rendered_text, font, font_size, all_backgrounds, image_height,
+                                                               return_mask=return_mask)
+            if fixed_text is not None and img is not None:
+                rendered_text = fixed_text
+            else:
                 continue
-            return rendered_text, img
+        if img is None:
+            logger.warning(f"Fallback: Image generation returned None for '{rendered_text}' with font {font} on fallback attempt {fallback}.")
+            flush_logger(logger)
+            continue
+        return rendered_text, img, info
 
-        return None, None
+    return None, None, None
 
-    for word, font, idx in group_list:
-        rendered_text, img = process_tuple(word, font, idx)
+def worker_process_groups(group_list, all_backgrounds, font_size, image_height, output_path, pos, 
+                            selected_words, max_attempts=3, max_fallback_attempts=3,
+                            mask_store=None, save_images=True, distortion_bank=None, shard_size=None,
+                            codec='jpeg', quality=None, writer_threads=WRITER_THREADS, write_queue=WRITE_QUEUE,
+                            profile=False, log_prefix="worker"):
+    """
+    Processes a list of (word, font, font index, word index, seed, cell key) tuples and returns the number of
+    images saved, the counters of the image writer and, with profile, the stage timings of the
+    samples (a stage_timer.StageTimer in to_dict() form; otherwise None).
+    Each tuple is processed exactly once by calling render_word(), after seeding the random
+    generators with its own seed, and saved as <font>_<font index>_<word index>.jpg (or the
+    extension of codec).
+    Encoding and writing run on writer_threads threads behind a queue of write_queue images, so
+    they overlap with rendering (see image_writer.ImageWriter). The writer belongs to the worker
+    process and is kept across chunks (see worker_image_writer): images still queued when a chunk
+    ends are journaled by a later chunk or when the worker stops.
+    Completed cells are appended to the journal of this worker in output_path (see read_journal).
+    A dedicated logger (<log_prefix>_<pos>.log) is used; log messages are flushed immediately.
+    If mask_store is set, the clean text mask of every rendered sample is appended to that
+    mask store directory with its cell key (so a cell rendered again by a resume is read once);
+    with save_images=False no JPEGs are written (masks only).
+    If distortion_bank is set, barrel/arc/rotate parameters come from a fixed bank of that many
+    settings per method, so their remap grids are reused (see image_distortion.set_parameter_bank).
+    If shard_size is set, images are appended to tar shards of about that many bytes in output_path
+    instead of being saved as separate JPEGs (see shards.py).
+    """
+    logger = worker_logger(f"{log_prefix}_{pos}")
+    if distortion_bank is not None:
+        image_distortion.set_parameter_bank(distortion_bank, seed=GLOBAL_SEED)
+    saved = 0
+    timer = StageTimer() if profile else None
+    stage_timer.activate(timer)
+    mask_writer = MaskStoreWriter(mask_store, pos) if mask_store is not None else None
+    writer, journal = worker_image_writer(output_path, pos, writer_threads, write_queue, codec, quality, logger)
+
+    def store_file(file_name, data):
+        write_file(os.path.join(output_path, file_name), data)
+        return file_name
+
+    def store_member(member, data):
+        return f"{worker_shard_writer(output_path, pos, shard_size).add(member, data)}/{member}"
+
+    for word, font, font_idx, idx, seed, key in group_list:
+        # Each sample gets the full render budget of the pool (see RENDER_TIMEOUT).
+        heartbeat()
+        random.seed(seed)
+        np.random.seed(seed)
+        if timer is not None:
+            timer.start_sample()
+        rendered_text, img, info = render_word(word, font, font_size, all_backgrounds, image_height, selected_words,
+                                               logger, max_attempts, max_fallback_attempts, mask_writer is not None)
+        if mask_writer is not None and info is not None and info.get('mask') is not None:
+            mask_writer.append(info['mask'], info['source_size'], synthetic.font_label(font), rendered_text, key)
+            mask_writer.flush()
+        if not save_images:
+            # Masks only: a failed render gets no placeholder, and stays unjournaled for a resume.
+            if img is not None:
+                journal_cell(journal, font_idx, idx, "", font)
+            else:
+                logger.error(f"Failed to generate mask for (word: {word}, font: {font}).")
+                flush_logger(logger)
+            if timer is not None:
+                timer.end_sample(os.path.basename(font))
+            continue
         if img is None:
             logger.error(f"Failed to generate image for (word: {word}, font: {font}). Using placeholder.")
-            flush_logger()
+            flush_logger(logger)
+            count('placeholder', os.path.basename(font))
             try:
                 img = create_placeholder_image(font, image_height)
             except Exception as e_save:
                 logger.error(f"Error creating placeholder image for font {font}: {e_save}")
-                flush_logger()
-                with progress_counter.get_lock():
-                    progress_counter.value += 1
+                flush_logger(logger)
+                if timer is not None:
+                    timer.end_sample(os.path.basename(font))
                 continue
         # Enforce a maximum width of 2304 pixels.
-        target_width = int(img.size[0] / img.size[1] * image_height)
-        if target_width > 2304:
-            target_width = 2304
-        img = img.resize((target_width, image_height))
-        unique_suffix = f"{os.path.splitext(os.path.basename(font))[0]}_{pos}_{idx}_{uuid.uuid4().hex[:8]}"
-        try:
-            file_name = save_img_text(img, font, output_path, unique_suffix)
-        except Exception as e_save:
-            logger.error(f"Error saving image for (word: {word}, font: {font}): {e_save}")
-            flush_logger()
-            with progress_counter.get_lock():
-                progress_counter.value += 1
+        with stage('resize'):
+            target_width = int(img.size[0] / img.size[1] * image_height)
+            if target_width > 2304:
+                target_width = 2304
+            img = img.resize((target_width, image_height))
+        file_name = f"{os.path.splitext(os.path.basename(font))[0]}_{font_idx}_{idx}{writer.extension}"
+        store = functools.partial(store_file if shard_size is None else store_member, file_name)
+        saved += journal_written(journal, writer.submit(img, store, (word, font, font_idx, idx, img.size, key)),
+                                 logger, timer)
+        if timer is not None:
+            timer.end_sample(os.path.basename(font))
+
+    heartbeat()
+    # The images still queued are not waited for; they are journaled later.
+    saved += journal_written(journal, writer.poll(), logger, timer)
+    stage_timer.activate(None)
+    if mask_writer is not None:
+        mask_writer.close()
+    stats = dict(writer.stats)
+    writer.stats.clear()
+    return saved, stats, timer.to_dict() if timer is not None else None
+
+# Arguments of worker_process_groups shared by every chunk, set once per pool worker.
+_generation_args = None
+# ShardWriter of this worker process, kept open across chunks. It is first needed on an image
+# writer thread, so it is created under a lock.
+_shard_writer = None
+_shard_writer_lock = threading.Lock()
+
+def worker_shard_writer(directory, pos, shard_size):
+    """Return the shard writer of this process; the pid in its prefix keeps a restarted worker off the old shards."""
+    global _shard_writer
+    with _shard_writer_lock:
+        if _shard_writer is None:
+            _shard_writer = ShardWriter(directory, f"shard_{pos}_{os.getpid()}", shard_size)
+        return _shard_writer
+
+# (ImageWriter, journal, logger) of this worker process, kept across chunks so encoding and
+# writing never wait for a chunk to end. close_worker_image_writer drains it when the worker
+# stops; a worker that is killed loses its queued images, which stay unjournaled for a resume.
+_image_writer = None
+
+def worker_image_writer(output_path, pos, writer_threads, write_queue, codec, quality, logger):
+    """Return the image writer and journal of this process, opening them on first use."""
+    global _image_writer
+    if _image_writer is None:
+        os.makedirs(os.path.join(output_path, JOURNAL_DIR), exist_ok=True)
+        journal = open(os.path.join(output_path, JOURNAL_DIR, f"journal_{pos}.tsv"), 'a', encoding='utf-8')
+        _image_writer = (ImageWriter(writer_threads, write_queue, codec, quality), journal, logger)
+    return _image_writer[:2]
+
+def journal_cell(journal, font_idx, idx, file_name, font, size=("", ""), key=""):
+    """Append a completed cell to a worker journal (see read_journal)."""
+    journal.write(f"{font_idx}\t{idx}\t{file_name}\t{os.path.basename(font)}\t{size[0]}\t{size[1]}\t{key}\n")
+    journal.flush()
+
+def journal_written(journal, finished, logger, timer=None):
+    """
+    Journal the cells of the (tag, result, error) images an ImageWriter finished, so cells are
+    journaled only once their image is on disk; returns the number of images saved.
+    """
+    saved = 0
+    for (word, font, font_idx, idx, size, key), result, error in finished:
+        if error is not None:
+            logger.error(f"Error saving image for (word: {word}, font: {font}): {error}")
+            flush_logger(logger)
             continue
-        output_dict[file_name] = os.path.basename(font)
-        with progress_counter.get_lock():
-            progress_counter.value += 1
+        journal_name, (encode_seconds, write_seconds) = result
+        if timer is not None:
+            timer.record('encode', encode_seconds)
+            timer.record('write', write_seconds)
+        saved += 1
+        journal_cell(journal, font_idx, idx, journal_name, font, size, key)
+    return saved
 
-    os.makedirs("word_dict", exist_ok=True)
-    dict_filename = os.path.join("word_dict", f"{uuid.uuid4().hex}.pkl")
-    with open(dict_filename, 'wb') as f:
-        pickle.dump(output_dict, f)
-    logger.error(f"Process (seed {seed}, pos {pos}) finished generating {len(output_dict)} images and saved dictionary as {dict_filename}.")
-    flush_logger()
+def close_worker_image_writer():
+    """TimeoutPool finalizer of the generation workers: write and journal the images still queued."""
+    global _image_writer
+    if _image_writer is not None:
+        writer, journal, logger = _image_writer
+        journal_written(journal, writer.drain(), logger)
+        writer.close()
+        journal.close()
+        _image_writer = None
+
+def init_generation_worker(all_backgrounds, font_size, image_height, output_path, selected_words, font_hashes, context,
+                           options):
+    """
+    TimeoutPool initializer for generate_chunk; font_hashes and context are the inputs of cell_key,
+    options are keyword arguments of worker_process_groups.
+    """
+    global _generation_args
+    _generation_args = (all_backgrounds, font_size, image_height, output_path, selected_words, font_hashes, context, options)
+
+def cell_seed(font_hash, word, epoch=0):
+    """
+    Seed of one (font, word) cell, derived from the font file's content hash and the word rather
+    than their positions in the run, so the image of a cell does not depend on chunking, workers,
+    resuming or on which other fonts and words the run has. render_dataset.py draws the samples
+    of later epochs with epoch > 0.
+    """
+    digest = hashlib.blake2b(f"{GLOBAL_SEED}\t{font_hash}\t{word}\t{epoch}".encode('utf-8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'little')
+
+def render_context(background_files, background_max_side, selected_words, font_size, image_height, options):
+    """
+    Hash of the inputs shared by every cell: the background images (their contents, in the name
+    order in which cells draw them), the word list (fallback words are drawn from it), the
+    rendering and augmentation settings, the image format and RENDER_VERSION.
+    """
+    sha = hashlib.sha1()
+    for background_file in sorted(background_files):
+        sha.update(file_hash(background_file).encode())
+    settings = {'background_max_side': background_max_side, 'font_size': font_size, 'image_height': image_height,
+                'distort_chance': DISTORT_CHANCE, 'blur_chance': BLUR_CHANCE, 'version': RENDER_VERSION,
+                'distortion_bank': options['distortion_bank'], 'codec': options['codec'], 'quality': options['quality']}
+    sha.update(json.dumps([settings, selected_words], ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return sha.hexdigest()
+
+def cell_key(font_hash, word, seed, context):
+    """Content key of a cell: its image is fully determined by the font file, the word, the seed and the context."""
+    return hashlib.sha1(f"{font_hash}\t{word}\t{seed}\t{context}".encode('utf-8')).hexdigest()
+
+def generate_chunk(font, font_idx, word_ids):
+    """Pool task: generate the images of one font for the given (1-based) indices into selected_words."""
+    all_backgrounds, font_size, image_height, output_path, selected_words, font_hashes, context, options = _generation_args
+    group = []
+    for i in word_ids:
+        word = selected_words[i - 1]
+        seed = cell_seed(font_hashes[font], word)
+        group.append((word, font, font_idx, i, seed, cell_key(font_hashes[font], word, seed, context)))
+    return worker_process_groups(group, all_backgrounds, font_size, image_height, output_path,
+                                 worker_slot(), selected_words, **options)
 
-def validate_fonts(selected_fonts, selected_words):
+def journal_key(row):
+    """Sort key of a journal row: font label, then font and word index."""
+    font_idx, idx, file_name, font, width, height, key = row
+    return synthetic.font_label(font), int(font_idx), int(idx)
+
+def make_chunks(fonts, num_words, chunk_size, costs=None, done=None, font_ids=None):
+    """
+    Split the fonts x words grid (only the rows of font_ids, if given) into generate_chunk tasks
+    of up to chunk_size words, leaving out the cells marked in done (see read_journal).
+    Chunks are ordered by font label, so each worker receives them, and writes its journal, in
+    journal_key order. If costs (an estimate per font) are given, chunks of the most expensive
+    fonts come first instead, so they do not end up in the tail of the run.
+    """
+    if font_ids is None:
+        font_ids = range(len(fonts))
+    order = sorted(font_ids, key=lambda i: (synthetic.font_label(fonts[i]), i))
+    if costs is not None:
+        order = sorted(order, key=lambda i: -costs[i])
+    chunks = []
+    for font_idx in order:
+        word_ids = [i for i in range(1, num_words + 1) if done is None or not done[font_idx, i]]
+        for start in range(0, len(word_ids), chunk_size):
+            chunks.append((fonts[font_idx], font_idx, word_ids[start:start + chunk_size]))
+    return chunks
+
+def parse_shard(text):
+    """argparse type of --shard: 'i/k' -> (i, k) with 0 <= i < k."""
+    try:
+        i, k = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/k, got {text!r}")
+    if not 0 <= i < k:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{k - 1}, got {i}")
+    return i, k
+
+def shard_fonts(num_fonts, shard=None):
+    """
+    Font indices (rows of the grid) generated by part i of k: every k-th font, starting at i.
+    Whole rows are assigned, so a quarantined font and its replacement stay within one part.
+    """
+    if shard is None:
+        return list(range(num_fonts))
+    i, k = shard
+    return list(range(i, num_fonts, k))
+
+def journal_files(run_path):
+    """
+    The journals of a run directory: one per worker process, with (font index, word index,
+    image file name, font file name, image width, image height, cell key) rows. Images in shards
+    are named <shard file>/<member>. Journals of older runs lack the later columns (read as "").
+    """
+    return sorted(glob.glob(os.path.join(run_path, JOURNAL_DIR, "journal_*.tsv")))
+
+def read_journal(run_path, fonts, num_words, save_images=True):
+    """
+    Return a (len(fonts), num_words + 1) boolean array marking the (font index, word index) cells
+    completed in a run directory with the current font of their index (a quarantined font's cells
+    do not count). With save_images, cells whose image (or shard) is missing on disk are not marked.
+    """
+    files = set(os.listdir(run_path)) if save_images else None
+    font_names = [os.path.basename(font) for font in fonts]
+    done = np.zeros((len(fonts), num_words + 1), dtype=bool)
+    for journal_file in journal_files(run_path):
+        for font_idx, idx, file_name, font, width, height, key in read_rows(journal_file, 7, optional=3):
+            if save_images and file_name.split('/')[0] not in files:
+                continue
+            if font != font_names[int(font_idx)]:
+                continue
+            done[int(font_idx), int(idx)] = True
+    return done
+
+def merge_journals(run_path):
+    """Stream the journal rows of a run in journal_key order, once per cell and font (a resumed cell can appear twice)."""
+    previous = None
+    for row in merge_manifests(journal_files(run_path), 7, journal_key, optional=3):
+        cell = (row[0], row[1], row[3])
+        if cell != previous:
+            yield row
+        previous = cell
+
+def link_or_copy(source, target):
+    """Hard-link source as target, copying it where links are not possible (another file system)."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def reuse_cells(previous_run, run_path, fonts, words, font_ids, font_hashes, context, done):
+    """
+    Hard-link the images of previous_run whose journaled cell key equals the key of a cell of this
+    run into run_path, and journal them (journal_reused.tsv), marking them in done, so only cells
+    whose inputs changed are rendered. Cells are matched by key alone, so a cell is reused even if
+    its font or word moved to another index. The keys of this run and the journals of
+    previous_run are both streamed in key order (see manifests.py) and joined. Returns the number
+    of cells reused. Shard members and cells journaled without a key (older runs) are not reused.
+    """
+    names = [os.path.splitext(os.path.basename(font))[0] for font in fonts]
+    reused = 0
+    os.makedirs(os.path.join(run_path, JOURNAL_DIR), exist_ok=True)
+    handle, cells_file = tempfile.mkstemp(suffix=".tsv", dir=os.path.join(run_path, JOURNAL_DIR))
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            for font_idx in font_ids:
+                font_hash = font_hashes[fonts[font_idx]]
+                for idx, word in enumerate(words, start=1):
+                    if not done[font_idx, idx]:
+                        f.write(f"{cell_key(font_hash, word, cell_seed(font_hash, word), context)}\t{font_idx}\t{idx}\n")
+        previous_rows = merge_manifests(journal_files(previous_run), 7, lambda row: row[6], optional=3)
+        previous = next(previous_rows, None)
+        group_key, group = None, []  # previous rows of the last key seen
+        with open(os.path.join(run_path, JOURNAL_DIR, "journal_reused.tsv"), 'a', encoding='utf-8') as journal:
+            for key, font_idx, idx in merge_manifests([cells_file], 3, lambda row: row[0]):
+                while previous is not None and previous[6] <= key:
+                    if previous[6] != group_key:
+                        group_key, group = previous[6], []
+                    if previous[2] and '/' not in previous[2]:
+                        group.append(previous)
+                    previous = next(previous_rows, None)
+                if group_key != key:
+                    continue
+                font_idx, idx = int(font_idx), int(idx)
+                for _, _, file_name, _, width, height, _ in group:
+                    # Named after the cell's current font file and indices.
+                    new_name = f"{names[font_idx]}_{font_idx}_{idx}{os.path.splitext(file_name)[1]}"
+                    try:
+                        link_or_copy(os.path.join(previous_run, file_name), os.path.join(run_path, new_name))
+                    except FileNotFoundError:
+                        continue
+                    except FileExistsError:
+                        pass
+                    journal.write(f"{font_idx}\t{idx}\t{new_name}\t{os.path.basename(fonts[font_idx])}\t{width}\t{height}\t{key}\n")
+                    done[font_idx, idx] = True
+                    reused += 1
+                    break
+    finally:
+        os.remove(cells_file)
+    return reused
+
+def save_run(run_path, selected_fonts, selected_words, spare_fonts=(), quarantined=()):
+    """
+    Store the fonts and words of the run in its directory (created if needed), so --resume
+    generates the same cells. spare_fonts are validated fonts left to replace quarantined ones;
+    quarantined lists {'font', 'font_idx', 'error'} of the fonts replaced so far.
+    """
+    os.makedirs(run_path, exist_ok=True)
+    tmp = os.path.join(run_path, RUN_FILE + ".tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'fonts': selected_fonts, 'words': selected_words, 'spares': list(spare_fonts),
+                   'quarantined': list(quarantined)}, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(run_path, RUN_FILE))
+
+def load_run(run_path):
+    """Return (fonts, words, spare fonts, quarantined fonts) of a run directory."""
+    with open(os.path.join(run_path, RUN_FILE), 'r', encoding='utf-8') as f:
+        run = json.load(f)
+    return run['fonts'], run['words'], run.get('spares', []), run.get('quarantined', [])
+
+def exclude_font(font):
+    """Add a font to FAILED_FONTS_FILE, so later runs do not select it."""
+    with open(FAILED_FONTS_FILE, 'a', encoding='utf-8') as f:
+        f.write(os.path.basename(font) + "\n")
+
+def remove_quarantined_images(run_path, quarantined):
+    """
+    Delete the loose images rendered with quarantined fonts, replaced or not (shard members are
+    skipped by lines.py).
+    """
+    for entry in quarantined:
+        base_font = os.path.splitext(os.path.basename(entry['font']))[0]
+        for file_name in glob.glob(os.path.join(glob.escape(run_path), f"{glob.escape(base_font)}_{entry['font_idx']}_*")):
+            os.remove(file_name)
+
+def remove_quarantined_masks(mask_store, quarantined, selected_words, font_index, context):
+    """Drop the masks rendered with quarantined fonts from the mask store, by the keys of their cells."""
+    keys = set()
+    for entry in quarantined:
+        font_hash = font_index.font_hash(entry['font'])
+        keys.update(cell_key(font_hash, word, cell_seed(font_hash, word), context) for word in selected_words)
+    return drop_masks(mask_store, keys)
+
+def run_directories(output_path):
+    """Versioned run directories (<output_path>@<run id>) of an output path, oldest first."""
+    return sorted(d for d in glob.glob(glob.escape(output_path) + "@*") if os.path.isdir(d) and not os.path.islink(d))
+
+def remove_directories(directories):
+    """Delete directories, warning about (rather than raising on) the ones that cannot be deleted."""
+    for directory in directories:
+        try:
+            shutil.rmtree(directory)
+        except OSError as e:
+            print(f"WARNING: Could not remove {directory}: {e}")
+
+def publish_run(run_path, output_path):
+    """
+    Make output_path a symlink to run_path, replacing the previous link in one atomic rename,
+    then delete the other run directories of output_path. Returns the (non-daemon) thread that
+    deletes them, so a slow or failing delete neither holds up nor fails the publication.
+    """
+    if os.path.isdir(output_path) and not os.path.islink(output_path):
+        # Output of a run from before versioned directories.
+        os.rename(output_path, output_path + "@legacy")
+    link = output_path + ".tmp"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(run_path), link)
+    os.replace(link, output_path)
+    # Old runs are first renamed out of the run directories, so a half-deleted run is never
+    # resumed; what an interrupted or failed delete leaves behind is retried by the next publish.
+    trash = [d for d in glob.glob(glob.escape(output_path) + ".removing@*") if os.path.isdir(d)]
+    for old_run in run_directories(output_path):
+        if os.path.realpath(old_run) != os.path.realpath(run_path):
+            removing = output_path + ".removing" + old_run[len(output_path):]
+            try:
+                os.rename(old_run, removing)
+            except OSError as e:
+                print(f"WARNING: Could not remove old run {old_run}: {e}")
+                continue
+            print(f"Removing old run {old_run}")
+            trash.append(removing)
+    thread = threading.Thread(target=remove_directories, args=(trash,), name="remove-old-runs")
+    thread.start()
+    return thread
+
+def font_cost(font, font_index):
+    """Cost estimate for a font: the time its validation test render took (0 if unknown)."""
+    record = font_index.lookup(font)
+    if record is None:
+        return 0
+    return record.get('render_seconds') or 0
+
+def validate_fonts(candidate_fonts, selected_words, font_index=None, dataset_size=None, processes=1, timeout=None):
     """
     Validate fonts to ensure they contain all basic Arabic letters.
     This function handles both TTF fonts (with a glyf table) and OTF fonts (with a CFF table).
-    Additionally, it calls synthetic.main_generate_image on test words to catch errors like
+    Additionally, it renders a test word to catch errors like
     "execution context too long", "invalid outline", "code overflow", or "invalid argument".
+
+    Results are looked up in (and added to) font_index, so unchanged fonts are not rechecked.
+    Unknown fonts are checked in a pool of `processes` workers; a font whose check takes longer
+    than `timeout` seconds is killed and rejected. Timeouts and crashed checks are not kept in
+    font_index, so those fonts are checked again by the next run. Candidates are streamed in order and
+    validation stops once the first `dataset_size` valid fonts (in candidate order) are known,
+    so the selection does not depend on which worker finishes first.
     """
+    if font_index is None:
+        font_index = FontIndex(None)
+    if dataset_size is None:
+        dataset_size = len(candidate_fonts)
+    # Choose test words up front so the random stream does not depend on completion order.
+    test_words = [random.choice(selected_words) for _ in candidate_fonts]
+    records = [None] * len(candidate_fonts)
     valid_fonts = []
     failed_fonts = []
-    all_arabic_letters = [chr(c) for c in range(0x0621, 0x064B)]
-    for font in selected_fonts:
-        try:
-            font_temp = TTFont(font)
-            cmap = font_temp['cmap'].getBestCmap()
-        except Exception as e:
-            print(f"Error reading font {font}: {e}")
-            failed_fonts.append(font)
-            continue
-        if cmap is None:
-            print(f"No cmap for font {font}.")
-            failed_fonts.append(font)
-            continue
-        font_valid = True
-        for letter in all_arabic_letters:
-            if ord(letter) not in cmap:
-                font_valid = False
-                print(f"Font {font} is missing letter {letter} in cmap.")
-                break
-            glyph_name = cmap[ord(letter)]
-            try:
-                if "glyf" in font_temp:
-                    if glyph_name not in font_temp["glyf"].glyphs:
-                        font_valid = False
-                        print(f"Font {font} is missing glyph {glyph_name} for letter {letter} in glyf table.")
-                        break
-                    else:
-                        num_contours = getattr(font_temp["glyf"].glyphs[glyph_name], "numberOfContours", None)
-                        if not num_contours or num_contours == 0:
-                            font_valid = False
-                            print(f"Font {font} has empty glyph for letter {letter} (glyph name: {glyph_name}) in glyf table.")
-                            break
-                elif "CFF " in font_temp:
-                    cff = font_temp["CFF "]
-                    charstrings = cff.cff.topDictIndex[0].CharStrings
-                    if glyph_name not in charstrings:
-                        font_valid = False
-                        print(f"Font {font} is missing glyph {glyph_name} for letter {letter} in CFF table.")
-                        break
-                else:
-                    font_valid = False
-                    print(f"Font {font} has neither a glyf nor a CFF table.")
-                    break
-            except TTLibError as err:
-                font_valid = False
-                print(f"Font {font} failed validation: {err}")
-                break
-        if font_valid:
-            # Try generating an image for one test word to catch additional errors.
-            test_word = random.choice(selected_words)
-            try:
-                rendered_text = "".join([e for e in test_word if ord(e) in cmap])
-                img, _ = synthetic.main_generate_image(
-                    rendered_text, font, 40, [], ht=64, distort_chance=0, blur_chance=0, flip=False
-                )
-            except Exception as e:
-                err_str = str(e).lower()
-                if any(phrase in err_str for phrase in ["execution context too long", "invalid outline", "code overflow", "invalid argument"]):
-                    font_valid = False
-                    print(f"Font {font} failed image generation test: {e}")
-                else:
-                    font_valid = False
-                    print(f"Font {font} failed unknown image generation test: {e}")
-            if font_valid:
+    frontier = 0     # candidates before this index are resolved and counted
+    next_submit = 0  # next candidate to look up or submit
+    in_flight = 0
+
+    def advance():
+        nonlocal frontier
+        while frontier < len(candidate_fonts) and records[frontier] is not None and len(valid_fonts) < dataset_size:
+            font, record = candidate_fonts[frontier], records[frontier]
+            if record['valid']:
                 valid_fonts.append(font)
             else:
-                print(f"Font {font} failed test word rendering.")
+                print(f"Font {font} failed validation ({record['error_class']}): {record['error']}")
                 failed_fonts.append(font)
-        else:
-            print(f"Font {font} failed validation.")
-            failed_fonts.append(font)
-    return valid_fonts, failed_fonts
-
-def main(args):
-    # Delete old worker log files.
-    log_files = glob.glob(os.path.join(os.getcwd(), "worker_*.log"))
-    for log_file in log_files:
-        try:
-            os.remove(log_file)
-        except Exception as e:
-            print(f"Error deleting log file {log_file}: {e}")
-
-    # Define output paths.
-    OUTPUT_PATH = os.path.join("word_images", args.data_dir)
-    FONT_PATH = './fonts_2K'
-    BACKGROUND_FOLDER = './images/'
-
-    os.makedirs(OUTPUT_PATH, exist_ok=True)
-    os.makedirs("word_dict", exist_ok=True)
-
-    # Clean old files.
-    for f in glob.glob(os.path.join(OUTPUT_PATH, "*")):
-        os.remove(f)
-    for f in glob.glob(os.path.join("word_dict", "*")):
-        os.remove(f)
-
-    FONT_SIZE = 80
-    IMAGE_HT = 64
+            frontier += 1
 
-    BACKGROUND_FOLDER_NAME = glob.glob(BACKGROUND_FOLDER + "*.png")
+    with TimeoutPool(processes, check_font_task, timeout=timeout) as pool:
+        results = pool.as_completed()
+        while len(valid_fonts) < dataset_size and frontier < len(candidate_fonts):
+            # Keep a bounded window of checks in flight ahead of the frontier.
+            while next_submit < len(candidate_fonts) and in_flight < 2 * pool.processes:
+                font = candidate_fonts[next_submit]
+                record = font_index.lookup(font)
+                if record is not None:
+                    records[next_submit] = record
+                else:
+                    pool.submit(next_submit, font, test_words[next_submit])
+                    in_flight += 1
+                next_submit += 1
+            advance()
+            if len(valid_fonts) >= dataset_size or in_flight == 0:
+                continue
+            (i, font, test_word), record, error = next(results)
+            in_flight -= 1
+            if error is not None:
+                if isinstance(error, TaskTimeout):
+                    error_class = 'timeout'
+                elif isinstance(error, WorkerDied):
+                    error_class = 'crashed'
+                else:
+                    error_class = 'check_error'
+                record = {'coverage': [], 'glyph_error': None, 'test_word': test_word, 'render_ok': False,
+                          'render_seconds': None, 'error_class': error_class, 'error': str(error), 'valid': False}
+            records[i] = record
+            try:
+                font_index.add(font, record)
+            except OSError:
+                pass
+            advance()
+    return valid_fonts, failed_fonts
 
-    # Load all words.
-    with open('./words.pickle', 'rb') as handle:
-        all_words = pickle.load(handle)
+def check_font_task(i, font, test_word):
+    """Pool task wrapper around font_index.check_font."""
+    return check_font(font, test_word)
 
-    # Filter to only Arabic words (and longer than one character) and exclude Arabic digits.
-    all_words = [w for w in all_words if is_arabic_word(w)]
-    if len(all_words) < args.dataset_size:
-        raise ValueError(f"Not enough Arabic words available. Required {args.dataset_size}, found {len(all_words)}.")
+def choose_fonts_and_words(args, font_path, font_index):
+    """Sample the words and validated fonts of a new run; returns (selected_fonts, selected_words, spare_fonts)."""
+    # Memory-map the preprocessed corpus: distinct Arabic words only (longer than one character,
+    # no diacritics or digits), built from words.pickle on first use.
+    corpus = WordCorpus.load(args.words)
+    if len(corpus) < args.dataset_size:
+        raise ValueError(f"Not enough Arabic words available. Required {args.dataset_size}, found {len(corpus)}.")
 
     # Get list of fonts.
-    all_fonts = synthetic.get_fonts(FONT_PATH, "")
+    all_fonts = synthetic.get_fonts(font_path, "")
     random.shuffle(all_fonts)
     if len(all_fonts) < args.dataset_size:
         raise ValueError(f"Not enough fonts available. Required {args.dataset_size}, found {len(all_fonts)}.")
 
     # Exclude fonts that previously failed generation (if file exists).
-    failed_fonts_file = "failed_fonts.txt"
+    failed_fonts_file = FAILED_FONTS_FILE
     failed_fonts_set = set()
     if os.path.exists(failed_fonts_file):
         try:
@@ -376,7 +768,7 @@ def main(args):
 
     # Sample exactly dataset_size unique fonts and words.
     dataset_size = args.dataset_size
-    selected_fonts, selected_words = sample_fonts_and_words(all_fonts, all_words, dataset_size)
+    selected_fonts, selected_words = sample_fonts_and_words(all_fonts, corpus, dataset_size)
     print(f"Initially sampled {len(selected_fonts)} fonts and {len(selected_words)} words.")
     
     # Export the selected words to a text file.
@@ -387,42 +779,21 @@ def main(args):
                 f.write(clean_word + "\n")
     print("Exported selected words to 'selected_words.txt'.")
 
-    # Validate fonts (handling both TTF and OTF with CFF)
-    valid_fonts, _ = validate_fonts(selected_fonts, selected_words)
-    unique_all_fonts = list(dict.fromkeys(all_fonts))
-    while len(valid_fonts) < dataset_size:
-        remaining_fonts = [f for f in unique_all_fonts if f not in valid_fonts]
-        if not remaining_fonts:
-            raise ValueError(f"Not enough valid fonts available. Only {len(valid_fonts)} valid fonts found, required {dataset_size}.")
-        added_this_round = False
-        for new_font in remaining_fonts:
-            try:
-                font_temp = TTFont(new_font)
-                cmap = font_temp['cmap'].getBestCmap()
-            except Exception as e:
-                continue
-            if cmap is None:
-                continue
-            tests = random.sample(selected_words, 2)
-            valid = True
-            for word in tests:
-                try:
-                    rendered_text = "".join([e for e in word if ord(e) in cmap])
-                except Exception as e:
-                    valid = False
-                    break
-                if len(rendered_text) == 0:
-                    valid = False
-                    break
-            if valid:
-                valid_fonts.append(new_font)
-                print(f"Added replacement font {new_font}")
-                added_this_round = True
-                if len(valid_fonts) >= dataset_size:
-                    break
-        if not added_this_round:
-            raise ValueError(f"Not enough valid fonts available. Only {len(valid_fonts)} valid fonts found, required {dataset_size}.")
+    # Validate fonts (handling both TTF and OTF with CFF), reusing results from previous runs.
+    # The sampled fonts come first; the remaining fonts are streamed in as replacements.
+    sampled = set(selected_fonts)
+    candidate_fonts = selected_fonts + [f for f in dict.fromkeys(all_fonts) if f not in sampled]
+    valid_fonts, _ = validate_fonts(candidate_fonts, selected_words, font_index, dataset_size + args.spare_fonts,
+                                    processes=args.processes, timeout=args.font_timeout)
+    font_index.save()
+    if len(valid_fonts) < dataset_size:
+        raise ValueError(f"Not enough valid fonts available. Only {len(valid_fonts)} valid fonts found, required {dataset_size}.")
+    for font in valid_fonts[:dataset_size]:
+        if font not in sampled:
+            print(f"Added replacement font {font}")
     selected_fonts = valid_fonts[:dataset_size]
+    spare_fonts = valid_fonts[dataset_size:]
+    print(f"Keeping {len(spare_fonts)} validated spare fonts to replace fonts quarantined during generation.")
     print(f"Final set of fonts: {[os.path.basename(f) for f in selected_fonts]}")
     print(f"Selected {len(selected_fonts)} unique fonts and {len(selected_words)} unique words for the dataset.")
 
@@ -430,79 +801,280 @@ def main(args):
         for font in selected_fonts:
             f.write(font + "\n")
     print("Exported selected fonts to 'selected_fonts.txt'.")
+    return selected_fonts, selected_words, spare_fonts
+
+def main(args):
+    if args.incremental is not None and (args.shards or args.mask_store is not None or args.no_images):
+        raise ValueError("--incremental reuses image files, so it cannot be combined with --shards, --mask_store or --no_images.")
+    if args.shard is not None and args.run_plan is None and not args.resume:
+        raise ValueError("--shard needs --run_plan: every part must generate the same fonts and words.")
+
+    # Define output paths. Each run writes into its own directory <data_dir>@<run id>, which is
+    # published as word_images/<data_dir> (a symlink) once all cells are generated. Part i of k
+    # of a --shard run is <data_dir>_shard<i>of<k>, so the parts never share a directory, and
+    # its worker logs and failed font list carry that name, so parts can run side by side.
+    run_name = args.data_dir if args.shard is None else f"{args.data_dir}_shard{args.shard[0]}of{args.shard[1]}"
+    part_suffix = "" if args.shard is None else f"_{run_name}"
+    log_prefix = f"worker{part_suffix}"
+
+    # Delete old worker log files (<log_prefix>_<worker slot>.log).
+    log_files = glob.glob(os.path.join(glob.escape(os.getcwd()), f"{glob.escape(log_prefix)}_[0-9]*.log"))
+    for log_file in log_files:
+        try:
+            os.remove(log_file)
+        except Exception as e:
+            print(f"Error deleting log file {log_file}: {e}")
+    OUTPUT_PATH = os.path.join("word_images", run_name)
+    FONT_PATH = './fonts_2K'
+    BACKGROUND_FOLDER = './images/'
+
+    if args.resume:
+        runs = run_directories(OUTPUT_PATH)
+        if not runs:
+            raise ValueError(f"No run of {OUTPUT_PATH} to resume.")
+        run_path = runs[-1]
+        print(f"Resuming run {run_path}.")
+    else:
+        run_path = f"{OUTPUT_PATH}@{time.strftime('%Y%m%d-%H%M%S')}"
+    os.makedirs("word_dict", exist_ok=True)
+
+    # Clean old files. A part of a --shard run only replaces its own label file, so parts run
+    # on one machine keep each other's.
+    stale = glob.glob(os.path.join("word_dict", "*")) if args.shard is None else \
+        glob.glob(os.path.join("word_dict", glob.escape(run_name) + ".tsv"))
+    for f in stale:
+        os.remove(f)
+    if args.mask_store is not None and not args.resume:
+        for f in glob.glob(os.path.join(args.mask_store, "masks_*")):
+            os.remove(f)
+
+    FONT_SIZE = 80
+    IMAGE_HT = 64
+
+    # Sorted, so a cell's seed picks the same background whatever order the file system lists them in.
+    BACKGROUND_FOLDER_NAME = sorted(glob.glob(BACKGROUND_FOLDER + "*.png"))
+
+    font_index = FontIndex(FONT_INDEX_FILE)
+    if args.resume:
+        selected_fonts, selected_words, spare_fonts, quarantined = load_run(run_path)
+        print(f"Resuming with the {len(selected_fonts)} fonts and {len(selected_words)} words of the run.")
+    else:
+        if args.run_plan is not None:
+            # Fonts and words chosen once (e.g. by render_dataset.py or an earlier run), so every part agrees.
+            plan = os.path.dirname(args.run_plan) if os.path.basename(args.run_plan) == RUN_FILE else args.run_plan
+            selected_fonts, selected_words, spare_fonts, _ = load_run(plan)
+            print(f"Using the {len(selected_fonts)} fonts and {len(selected_words)} words of {args.run_plan}.")
+        else:
+            selected_fonts, selected_words, spare_fonts = choose_fonts_and_words(args, FONT_PATH, font_index)
+        if args.shard is not None:
+            # Each part gets its own spares, so two parts never pick the same replacement font.
+            spare_fonts = spare_fonts[args.shard[0]::args.shard[1]]
+        quarantined = []
+        save_run(run_path, selected_fonts, selected_words, spare_fonts)
 
-    # Build groups: each font gets paired with each word.
-    groups = []
-    for font in selected_fonts:
-        group = [(word, font, i) for i, word in enumerate(selected_words, start=1)]
-        groups.append(group)
-    total_images = sum(len(g) for g in groups)
+    # Each font gets paired with each word; with --shard, this part generates the rows of its fonts.
+    font_ids = shard_fonts(len(selected_fonts), args.shard)
+    # A resumed run does not render again the fonts it quarantined without a spare.
+    dropped = {entry['font_idx'] for entry in quarantined if entry['replacement'] is None}
+    font_ids = [font_idx for font_idx in font_ids if font_idx not in dropped]
+    total_images = len(font_ids) * len(selected_words)
+    if args.shard is not None:
+        print(f"Part {args.shard[0]} of {args.shard[1]}: {len(font_ids)} of {len(selected_fonts)} fonts.")
     print(f"Total images to generate (Cartesian product): {total_images}")
 
-    # Split groups evenly among processes.
-    num_processes = args.processes
-    groups_sublists = np.array_split(groups, num_processes)
-    sublists = [[tpl for group in sublist for tpl in group] for sublist in groups_sublists]
-
-    manager = multiprocessing.Manager()
-    failed_fonts_gen = manager.list()
-    progress_counter = multiprocessing.Value('i', 0)
-
-    processes = []
-    for i, sublist in enumerate(sublists):
-        p = multiprocessing.Process(
-            target=worker_process_groups,
-            args=(list(sublist), BACKGROUND_FOLDER_NAME, FONT_SIZE, IMAGE_HT, OUTPUT_PATH,
-                  GLOBAL_SEED + i, i, failed_fonts_gen, progress_counter, selected_words)
-        )
-        processes.append(p)
-
-    for p in processes:
-        p.start()
-
-    with tqdm(total=total_images, desc="Total Progress", position=0) as progress_bar:
-        while any(p.is_alive() for p in processes):
-            with progress_counter.get_lock():
-                current = progress_counter.value
-            progress_bar.n = current
-            progress_bar.refresh()
-            time.sleep(0.5)
-        with progress_counter.get_lock():
-            progress_bar.n = progress_counter.value
-        progress_bar.refresh()
-
-    for p in processes:
-        p.join()
+    options = {'mask_store': args.mask_store, 'save_images': not args.no_images,
+               'distortion_bank': args.distortion_bank,
+               'shard_size': args.shard_size * 2**20 if args.shards else None,
+               'codec': args.codec, 'quality': args.quality,
+               'writer_threads': args.writer_threads, 'write_queue': args.write_queue,
+               'profile': args.profile, 'log_prefix': log_prefix}
+    # Every cell is journaled with a key of all its inputs, so a later --incremental run can reuse it.
+    font_hashes = {font: font_index.font_hash(font) for font in selected_fonts + spare_fonts}
+    font_index.save()
+    context = render_context(BACKGROUND_FOLDER_NAME, args.background_max_side, selected_words, FONT_SIZE, IMAGE_HT, options)
+
+    # Hand out (font, word range) chunks dynamically, so a worker that draws slow fonts does not
+    # hold up the run while the others sit idle.
+    costs = [font_cost(font, font_index) for font in selected_fonts] if args.cost_order else None
+    done = None
+    if args.resume:
+        done = read_journal(run_path, selected_fonts, len(selected_words), save_images=not args.no_images)
+        print(f"Skipping {done.sum()} cells already generated.")
+    if args.incremental is not None:
+        previous_run = os.path.realpath(args.incremental or OUTPUT_PATH)
+        if done is None:
+            done = np.zeros((len(selected_fonts), len(selected_words) + 1), dtype=bool)
+        if os.path.isdir(previous_run) and previous_run != os.path.realpath(run_path):
+            reused = reuse_cells(previous_run, run_path, selected_fonts, selected_words, font_ids, font_hashes, context, done)
+            print(f"Reused {reused} unchanged cells of {previous_run}; {total_images - done.sum()} cells left to render.")
+        else:
+            print(f"No previous run {previous_run} to reuse; rendering every cell.")
+    chunks = make_chunks(selected_fonts, len(selected_words), args.chunk_size, costs, done, font_ids)
+    print(f"Split the work into {len(chunks)} chunks of up to {args.chunk_size} words.")
+    failed_fonts_gen = []
+
+    # Decode the backgrounds once into shared memory; workers sample patches from it.
+    background_pool = BackgroundPool.create(BACKGROUND_FOLDER_NAME, max_side=args.background_max_side)
+    print(f"Loaded {len(background_pool)} backgrounds into shared memory ({background_pool.nbytes / 2**20:.1f} MiB).")
+
+    write_stats = collections.Counter()
+    run_profile = StageTimer() if args.profile else None
+    # Workers send a heartbeat before every sample, so a render that hangs (e.g. a FreeType hinting
+    # program that does not terminate) gets its worker killed after render_timeout seconds.
+    render_timeout = args.render_timeout or None
+    with TimeoutPool(args.processes, generate_chunk, timeout=render_timeout, initializer=init_generation_worker,
+                     initargs=(background_pool, FONT_SIZE, IMAGE_HT, run_path, selected_words, font_hashes, context,
+                               options), finalizer=close_worker_image_writer) as pool, \
+            tqdm(total=total_images, initial=0 if done is None else done.sum(), desc="Total Progress", position=0) as progress_bar:
+        for chunk in chunks:
+            pool.submit(*chunk)
+        for (font, font_idx, word_ids), result, error in pool.as_completed():
+            if error is not None:
+                print(f"Words {word_ids[0]}-{word_ids[-1]} of font {font} failed: {error}")
+                already_quarantined = any(entry['font_idx'] == font_idx and entry['font'] == font for entry in quarantined)
+                if isinstance(error, (TaskTimeout, WorkerDied)) and font == selected_fonts[font_idx] and not already_quarantined:
+                    # Quarantine the font: exclude it from later runs and regenerate its cells with a spare font.
+                    exclude_font(font)
+                    cancelled = pool.cancel(lambda task: task[1] == font_idx)
+                    cancelled_words = sum(len(task[2]) for task in cancelled)
+                    replacement = spare_fonts.pop(0) if spare_fonts else None
+                    quarantined.append({'font': font, 'font_idx': font_idx, 'error': str(error), 'replacement': replacement})
+                    if replacement is not None:
+                        print(f"Quarantined font {font}; replacing it with {replacement}.")
+                        selected_fonts[font_idx] = replacement
+                        for _, _, ids in make_chunks([replacement], len(selected_words), args.chunk_size):
+                            pool.submit(replacement, font_idx, ids)
+                        progress_bar.total += len(selected_words) - cancelled_words
+                        progress_bar.refresh()
+                    else:
+                        print(f"Quarantined font {font}; no spare fonts left, so its remaining words are skipped.")
+                        progress_bar.update(cancelled_words)
+                        failed_fonts_gen.append(font)
+                    save_run(run_path, selected_fonts, selected_words, spare_fonts, quarantined)
+                elif font == selected_fonts[font_idx] and not already_quarantined and font not in failed_fonts_gen:
+                    failed_fonts_gen.append(font)
+            else:
+                if run_profile is not None:
+                    run_profile.merge(result[2])
+                chunk_stats = result[1]
+                write_stats['max_queue_depth'] = max(write_stats['max_queue_depth'], chunk_stats.pop('max_queue_depth', 0))
+                write_stats.update(chunk_stats)
+                # Mean writer queue depth seen by each new image, and render time lost waiting on the writers.
+                progress_bar.set_postfix(queue=f"{write_stats['queue_depth'] / max(1, write_stats['images']):.1f}",
+                                         stall=f"{write_stats['stall_seconds']:.1f}s", refresh=False)
+            progress_bar.update(len(word_ids))
+        # The workers write and journal the images still in their queues before they exit.
+        pool.close(timeout=None)
+    background_pool.close()
+    if args.shards:
+        finalize_shards(run_path)
+    remove_quarantined_images(run_path, quarantined)
+    if args.mask_store is not None and quarantined:
+        dropped = remove_quarantined_masks(args.mask_store, quarantined, selected_words, font_index, context)
+        print(f"Dropped {dropped} masks of quarantined fonts from {args.mask_store}.")
+    if run_profile is not None:
+        # Kept with the run, so the report of a published dataset can be looked up later.
+        report = run_profile.report()
+        with open(os.path.join(run_path, "profile.txt"), 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+        run_profile.save(os.path.join(run_path, "profile.json"))
+        print(report)
+
+    # The labels (with the image size and the word, for lines.py's index and splits) are streamed
+    # from the journals (so they also cover cells generated before a resume) into one file sorted
+    # by font, which lines.py merges without loading it.
+    font_counts = collections.Counter()
+    dict_filename = os.path.join("word_dict", f"{run_name}.tsv")
+    with open(dict_filename, 'w', encoding='utf-8') as f:
+        current_fonts = [os.path.basename(font) for font in selected_fonts]
+        quarantined_fonts = {(entry['font_idx'], os.path.basename(entry['font'])) for entry in quarantined}
+        for font_idx, idx, file_name, font, width, height, key in merge_journals(run_path):
+            # Rows of a quarantined font are left out; its replacement (if any) regenerated the cells.
+            if file_name and font == current_fonts[int(font_idx)] and (int(font_idx), font) not in quarantined_fonts:
+                f.write(f"{os.path.join(OUTPUT_PATH, file_name)}\t{font}\t{width}\t{height}\t{selected_words[int(idx) - 1]}\n")
+                font_counts[int(font_idx)] += 1
+    print(f"Saved {sum(font_counts.values())} image labels to {dict_filename}.")
+    publish_run(run_path, OUTPUT_PATH)
+    print(f"Published {run_path} as {OUTPUT_PATH}.")
 
     print("Done with Creation of dataset.")
+    if write_stats['images']:
+        print(f"Image writer: {write_stats['images']} images, {write_stats['write_seconds']:.1f}s encoding and writing, "
+              f"mean queue depth {write_stats['queue_depth'] / write_stats['images']:.1f} "
+              f"(max {write_stats['max_queue_depth']}), {write_stats['stall_seconds']:.1f}s waiting on a full queue.")
 
-    jpg_files = glob.glob(os.path.join(OUTPUT_PATH, "*.jpg"))
-    total_generated = len(jpg_files)
-    print(f"Total generated JPEG files: {total_generated}")
-    if total_generated < total_images:
-        print(f"WARNING: Only {total_generated} images were generated, but {total_images} were expected.")
-        expected_count = len(selected_words)
-        for font in selected_fonts:
-            base_font = os.path.splitext(os.path.basename(font))[0]
-            font_files = glob.glob(os.path.join(OUTPUT_PATH, f"{base_font}_*.jpg"))
-            count_font = len(font_files)
-            if count_font < expected_count:
-                print(f"Font {base_font}: {count_font} images generated (expected {expected_count}).")
-    else:
-        print("All images were successfully generated.")
+    if not args.no_images:
+        total_generated = sum(font_counts.values())
+        print(f"Total generated JPEG files: {total_generated}")
+        if total_generated < total_images:
+            print(f"WARNING: Only {total_generated} images were generated, but {total_images} were expected.")
+            expected_count = len(selected_words)
+            for font_idx in font_ids:
+                font = selected_fonts[font_idx]
+                base_font = os.path.splitext(os.path.basename(font))[0]
+                count_font = font_counts[font_idx]
+                if count_font < expected_count:
+                    print(f"Font {base_font}: {count_font} images generated (expected {expected_count}).")
+        else:
+            print("All images were successfully generated.")
 
     if failed_fonts_gen:
         print("The following fonts failed during generation:")
         for font in failed_fonts_gen:
             print(font)
-        with open("failed_fonts_generation.txt", "w", encoding="utf-8") as f:
+        failed_file = f"failed_fonts_generation{part_suffix}.txt"
+        with open(failed_file, "w", encoding="utf-8") as f:
             for font in failed_fonts_gen:
                 f.write(font + "\n")
-        print("Exported failed fonts (during generation) to 'failed_fonts_generation.txt'.")
+        print(f"Exported failed fonts (during generation) to '{failed_file}'.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("dataset_size", type=int, help="Number of unique fonts and words to sample (dataset will be size x size)")
     parser.add_argument("processes", type=int, help="Number of processes to use")
     parser.add_argument("data_dir", help="Name of the output directory under word_images")
+    parser.add_argument("--words", default=WORDS_FILE,
+                        help="Pickled word list; it is preprocessed once into corpus_cache (see corpus.py)")
+    parser.add_argument("--font_timeout", type=float, default=FONT_CHECK_TIMEOUT,
+                        help="Seconds before a hanging font check is killed and the font rejected")
+    parser.add_argument("--background_max_side", type=int, default=None,
+                        help="Downscale backgrounds so their longest side is at most this many pixels")
+    parser.add_argument("--mask_store", default=None,
+                        help="Also store the clean text mask of every sample in this directory (see mask_store.py)")
+    parser.add_argument("--no_images", action="store_true",
+                        help="Do not write JPEGs; only useful together with --mask_store")
+    parser.add_argument("--distortion_bank", type=int, default=None,
+                        help="Draw barrel/arc/rotate parameters from this many fixed settings per method (reuses remap grids)")
+    parser.add_argument("--render_timeout", type=float, default=RENDER_TIMEOUT,
+                        help="Seconds a worker may spend on one sample before it is killed and the font quarantined (0: no limit)")
+    parser.add_argument("--spare_fonts", type=int, default=SPARE_FONTS,
+                        help="Extra validated fonts kept to replace quarantined fonts")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE,
+                        help="Words of one font per task handed to a worker")
+    parser.add_argument("--cost_order", action="store_true",
+                        help="Start with the fonts whose validation render was slowest (from the font index)")
+    parser.add_argument("--shards", action="store_true",
+                        help="Append images to tar shards in the run directory instead of writing one JPEG per sample")
+    parser.add_argument("--shard_size", type=int, default=SHARD_SIZE // 2**20,
+                        help="Size in MiB at which a worker starts a new shard")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the latest run of data_dir, skipping cells already generated")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="I/K",
+                        help="Generate part I (0-based) of K of the grid: every K-th font. Run all K parts (on any "
+                             "hosts) with the same --run_plan (required), then merge their word_dict files with lines.py")
+    parser.add_argument("--run_plan", default=None,
+                        help="run.json (or run directory) to take the fonts and words from instead of sampling them")
+    parser.add_argument("--incremental", nargs='?', const='', default=None, metavar="RUN",
+                        help="Hard-link the images of cells whose inputs (font file, word, seed, backgrounds, settings) "
+                             "are unchanged from a previous run (default: the published word_images/<data_dir>)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time the stages of every sample and write a report (profile.txt) to the run directory")
+    parser.add_argument("--codec", choices=list(IMAGE_CODECS), default='jpeg',
+                        help="Image format of the generated samples")
+    parser.add_argument("--quality", type=int, default=None,
+                        help="Encoder quality for jpeg/webp (default: the PIL default of the codec)")
+    parser.add_argument("--writer_threads", type=int, default=WRITER_THREADS,
+                        help="Threads per worker that encode and write images while the next ones render (0: write inline)")
+    parser.add_argument("--write_queue", type=int, default=WRITE_QUEUE,
+                        help="Images per worker waiting to be written before rendering blocks")
     main(parser.parse_args())
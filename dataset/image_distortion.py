@@ -5,6 +5,7 @@ warnings.filterwarnings("ignore", message="256 extra bytes in post.stringData ar
 
 import cv2
 import numpy as np
+from collections import OrderedDict
 from scipy.interpolate import griddata
 from PIL import Image
 
@@ -13,9 +14,50 @@ INTERPOLATION = {
     "cubic": cv2.INTER_CUBIC
 }
 
+WARP_CACHE_SIZE = 16  # Pixel grids kept for the fast warp, one per (h, w, mesh interval)
+_warp_grids = OrderedDict()
+
+def _mesh_grid(h, w, h_mesh_interval, w_mesh_interval):
+    """Returns the (x, y) coordinates of every pixel in control-mesh units, cached per image shape."""
+    key = (h, w, h_mesh_interval, w_mesh_interval)
+    grid = _warp_grids.get(key)
+    if grid is not None:
+        _warp_grids.move_to_end(key)
+        return grid
+    grid_y, grid_x = np.mgrid[0:h, 0:w].astype(np.float32)
+    grid = (grid_x / np.float32(w_mesh_interval), grid_y / np.float32(h_mesh_interval))
+    _warp_grids[key] = grid
+    if len(_warp_grids) > WARP_CACHE_SIZE:
+        _warp_grids.popitem(last=False)
+    return grid
+
+def _mesh_warp_maps(source, destination, mesh_shape, h, w, h_mesh_interval, w_mesh_interval):
+    """
+    Fast replacement for griddata(destination, source, pixel grid).
+    The control points lie on a regular mesh, so the displacement of every pixel is the bilinear
+    upsampling of the control point displacements (a cv2.remap of a tiny array). The inverse
+    mapping p -> s with s + d(s) = p is approximated by one fixed-point step s = p - d(p - d(p)).
+    """
+    mesh_x, mesh_y = _mesh_grid(h, w, h_mesh_interval, w_mesh_interval)
+    displacement = (destination - source).reshape(mesh_shape[0], mesh_shape[1], 2)
+    mesh_displacement = np.empty(displacement.shape, dtype=np.float32)
+    mesh_displacement[..., 0] = displacement[..., 1] / w_mesh_interval
+    mesh_displacement[..., 1] = displacement[..., 0] / h_mesh_interval
+    d = cv2.remap(mesh_displacement, mesh_x, mesh_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    d = cv2.remap(mesh_displacement, mesh_x - d[..., 0], mesh_y - d[..., 1], cv2.INTER_LINEAR,
+                  borderMode=cv2.BORDER_REPLICATE)
+    map_x = (mesh_x - d[..., 0]) * np.float32(w_mesh_interval)
+    map_y = (mesh_y - d[..., 1]) * np.float32(h_mesh_interval)
+    return map_x, map_y
+
 def warp_image(img, random_state=None, **kwargs):
+    # Pass exact=True to interpolate the mesh with scipy's griddata (a Delaunay triangulation of the
+    # perturbed mesh per call) instead of the cached mesh upsampling, which is several times faster.
+    # The two differ by under half a pixel on average (bilinear cells instead of linear triangles);
+    # test_image_distortion bounds the resulting difference in the images.
+    # Without a random_state the mesh is drawn from the global stream, so a seeded sample is reproducible.
     if random_state is None:
-        random_state = np.random.RandomState()
+        random_state = np.random
 
     w_mesh_interval = kwargs.get('w_mesh_interval', 12)
     w_mesh_std = kwargs.get('w_mesh_std', 1.5)
@@ -41,6 +83,7 @@ def warp_image(img, random_state=None, **kwargs):
 
     # Get control points
     source = np.mgrid[0:h+h_mesh_interval:h_mesh_interval, 0:w+w_mesh_interval:w_mesh_interval]
+    mesh_shape = source.shape[1:]
     source = source.transpose(1,2,0).reshape(-1,2)
 
     if kwargs.get("draw_grid_lines", False):
@@ -61,25 +104,78 @@ def warp_image(img, random_state=None, **kwargs):
     
     
     # Warp image
-    grid_x, grid_y = np.mgrid[0:h, 0:w]
-    grid_z = griddata(destination, source, (grid_x, grid_y), method=interpolation_method).astype(np.float32)
-    map_x = grid_z[:,:,1]
-    map_y = grid_z[:,:,0]
+    if kwargs.get("exact", False):
+        grid_x, grid_y = np.mgrid[0:h, 0:w]
+        grid_z = griddata(destination, source, (grid_x, grid_y), method=interpolation_method).astype(np.float32)
+        map_x = grid_z[:,:,1]
+        map_y = grid_z[:,:,0]
+    else:
+        map_x, map_y = _mesh_warp_maps(source, destination, mesh_shape, h, w, h_mesh_interval, w_mesh_interval)
     warped = cv2.remap(img, map_x, map_y, INTERPOLATION[interpolation_method], borderValue=(255,255,255))
 
     return warped
 
+REMAP_CACHE_SIZE = 16      # Remap grids kept per process for barrel, rotate and arc distortions
+REMAP_BUCKET_WIDTH = 64    # With a parameter bank, rotate/arc grids are built for widths rounded up to this and sliced
+PARAMETER_STEPS = {'k': 1e-3, 'theta': 1e-3, 'r': 0.1}  # Quantization of cache keys with a parameter bank
+_remap_cache = OrderedDict()
+
+# Ranges the random distortion parameters are drawn from in apply_random_transform.
+PARAMETER_RANGES = {
+    'barrel': [(.01, .05), (.01, .05)],                   # k_1, k_2
+    'arc_left': [(np.pi/3, np.pi/4), (20, 30)],           # theta_max, r
+    'arc_right': [(np.pi/3, np.pi/4), (20, 30)],          # theta_max, r
+    'rotate_right': [(np.pi/2+.3, 5*np.pi/6)],            # theta
+    'rotate_left': [(np.pi/6, np.pi/2-.3)],               # theta
+}
+PARAMETER_BANK = None
+
+def set_parameter_bank(size, seed=0):
+    """
+    Make apply_random_transform draw barrel/arc/rotate parameters from a fixed bank of `size`
+    settings per method (drawn once from PARAMETER_RANGES) instead of fresh uniform draws, so
+    their remap grids are reused from the cache. size=None restores continuous draws.
+    """
+    global PARAMETER_BANK
+    if size is None:
+        PARAMETER_BANK = None
+        return
+    rng = np.random.RandomState(seed)
+    PARAMETER_BANK = {method: np.stack([rng.uniform(low, high, size) for low, high in ranges], axis=1)
+                      for method, ranges in PARAMETER_RANGES.items()}
+
+def _draw_parameters(method):
+    """One value per range of PARAMETER_RANGES[method], from the parameter bank if one is set."""
+    if PARAMETER_BANK is not None:
+        bank = PARAMETER_BANK[method]
+        return list(bank[np.random.randint(len(bank))])
+    return [np.random.uniform(low, high) for low, high in PARAMETER_RANGES[method]]
+
+def _quantize(value, step):
+    return round(float(value) / step) * step
+
+def _bucket_width(w):
+    return -(-w // REMAP_BUCKET_WIDTH) * REMAP_BUCKET_WIDTH
+
+def _cached_maps(key, build):
+    """Return build() for key from a small LRU cache of (map_x, map_y) grids."""
+    maps = _remap_cache.get(key)
+    if maps is not None:
+        _remap_cache.move_to_end(key)
+        return maps
+    map_x, map_y = build()
+    maps = (map_x.astype(np.float32, copy=False), map_y.astype(np.float32, copy=False))
+    _remap_cache[key] = maps
+    if len(_remap_cache) > REMAP_CACHE_SIZE:
+        _remap_cache.popitem(last=False)
+    return maps
+
 # https://stackoverflow.com/questions/60609607/how-to-create-this-barrel-radial-distortion-with-python-opencv
 # Also see x_u and y_u at https://en.wikipedia.org/wiki/Distortion_(optics)
 #img: input image
 # barrel distortion
 # adjust k_1 and k_2 to achieve the required distortion
-def barrel_distortion(img, k_1=0.2, k_2=0.05):
-
-    #img = input_img
-    h,w = img.shape[:2]
-    # distorted img boundary
-    
+def _barrel_maps(h, w, k_1, k_2):
     x,y = np.meshgrid(np.float32(np.arange(w)),np.float32(np.arange(h))) # meshgrid for interpolation mapping
     # center and scale the grid for radius calculation (distance from center of image)
     x_c = w/2 
@@ -99,8 +195,14 @@ def barrel_distortion(img, k_1=0.2, k_2=0.05):
     # reset all the shifting
     x = x*x_c + x_c
     y = y*y_c + y_c
+    return x, y
+
+def barrel_distortion(img, k_1=0.2, k_2=0.05):
+
+    #img = input_img
+    h,w = img.shape[:2]
+    x, y = _distortion_maps('barrel', h, w, (k_1, k_2))
 
-    
     result = cv2.remap(img, x, y, cv2.INTER_CUBIC, borderMode = cv2.BORDER_REFLECT, borderValue=0)
  #   result = result[x_lims[0]:x_lims[1]+1, y_lims[0]:y_lims[1]+1]
     result = resize_height(result, h)
@@ -110,19 +212,7 @@ def barrel_distortion(img, k_1=0.2, k_2=0.05):
 #(a,b) are coord of dst
 #(x,y) maps to (x+ycos(theta)+ysin(theta))
 #(a,b) maps to (a-ycos(theta),b/sin(theta))
-def my_distort_rotate(src, theta):
-    
-    if theta == np.pi/2:
-        return src
-    if theta == 0:
-        return np.zeros(src.shape)
-    
-    # If theta is zero then img reduces to a single line
-    # Img same when theta = 90
-    
-    src_h, src_w = src.shape[:2]
-    dst_h, dst_w = np.abs(int(src_h*np.sin(theta))), np.abs(int(src_w*np.cos(theta)))
-    
+def _rotate_maps(src_h, src_w, theta):
     map_x,map_y = np.meshgrid(np.float32(np.arange(src_w)),np.float32(np.arange(src_h))) # meshgrid for interpolation mapping
     
     x_c = src_w/2 
@@ -139,13 +229,23 @@ def my_distort_rotate(src, theta):
     # w.r.t upper left
     map_y = map_y + y_c
     map_x = map_x + x_c
+    return map_x, map_y
+
+def my_distort_rotate(src, theta):
     
-    dst = cv2.remap(src, map_x, map_y, cv2.INTER_CUBIC, borderMode = cv2.BORDER_REFLECT, borderValue=0)
-    # crop above and below
-    to_crop = (src_h - dst_h)//2
+    if theta == np.pi/2:
+        return src
+    if theta == 0:
+        return np.zeros(src.shape)
     
-    dst = dst[to_crop:, :]
-    dst = dst[0:dst.shape[0]-to_crop,:]
+    # If theta is zero then img reduces to a single line
+    # Img same when theta = 90
+    
+    src_h, src_w = src.shape[:2]
+    # The maps are already cropped above and below (see _distortion_maps).
+    map_x, map_y = _distortion_maps('rotate', src_h, src_w, (theta,))
+    
+    dst = cv2.remap(src, map_x, map_y, cv2.INTER_CUBIC, borderMode = cv2.BORDER_REFLECT, borderValue=0)
     dst = resize_height(dst, src_h)
     return dst
 
@@ -159,10 +259,12 @@ def my_distort_rotate(src, theta):
 # When origin is center of box
 # max(a,b) = (src_w/2,r*sin(theta_max))
 # min_a = -src_w/2+rcos(theta_max)-r  
-def my_distort_arc_left(src, theta_max=np.pi/6, r=30):
-    src_h, src_w = src.shape[:2]
+def _arc_dst_width(src_w, theta_max, r):
+    return int(src_w/2-r*np.cos(theta_max)+r + src_w/2)
+
+def _arc_left_maps(src_h, src_w, theta_max, r):
     max_dst_y = int(r*np.sin(theta_max))
-    max_dst_x = int(src_w/2-r*np.cos(theta_max)+r + src_w/2)
+    max_dst_x = _arc_dst_width(src_w, theta_max, r)
    
     map_x,map_y = np.meshgrid(np.float32(np.arange(max_dst_x)),np.float32(np.arange(2*max_dst_y))) # meshgrid for interpolation mapping
     
@@ -181,6 +283,11 @@ def my_distort_arc_left(src, theta_max=np.pi/6, r=30):
     # w.r.t. upper left
     map_y = map_y + y_c
     map_x = map_x + x_c    
+    return map_x, map_y
+
+def my_distort_arc_left(src, theta_max=np.pi/6, r=30):
+    src_h, src_w = src.shape[:2]
+    map_x, map_y = _distortion_maps('arc_left', src_h, src_w, (theta_max, r))
     
     # map values
     dst = cv2.remap(src, map_x, map_y, cv2.INTER_CUBIC, borderMode = cv2.BORDER_REFLECT, borderValue=0)
@@ -196,10 +303,9 @@ def my_distort_arc_left(src, theta_max=np.pi/6, r=30):
 # When origin is center of box
 # max(a,b) = (src_w/2,r*sin(theta_max))
 # min_a = -src_w/2+rcos(theta_max)-r  
-def my_distort_arc_right(src, theta_max=np.pi/2, r=30):
-    src_h, src_w = src.shape[:2]
+def _arc_right_maps(src_h, src_w, theta_max, r):
     max_dst_y = int(r*np.sin(theta_max))
-    max_dst_x = int(src_w/2-r*np.cos(theta_max)+r + src_w/2)
+    max_dst_x = _arc_dst_width(src_w, theta_max, r)
     
     map_x,map_y = np.meshgrid(np.float32(np.arange(max_dst_x)),np.float32(np.arange(2*max_dst_y))) # meshgrid for interpolation mapping
     
@@ -219,16 +325,92 @@ def my_distort_arc_right(src, theta_max=np.pi/2, r=30):
     # w.r.t. upper left
     map_y = map_y + y_c
     map_x = map_x + x_c    
+    return map_x, map_y
+
+def my_distort_arc_right(src, theta_max=np.pi/2, r=30):
+    src_h, src_w = src.shape[:2]
+    map_x, map_y = _distortion_maps('arc_right', src_h, src_w, (theta_max, r))
     
     # map values
     dst = cv2.remap(src, map_x, map_y, cv2.INTER_CUBIC, borderMode = cv2.BORDER_REFLECT, borderValue=0)
     dst = resize_height(dst, src_h)
     return dst
-    
+
+def _distortion_maps(kind, h, w, params):
+    """
+    Cached (map_x, map_y) for a 'barrel', 'rotate', 'arc_left' or 'arc_right' distortion of an
+    h x w image. Rotate maps are cropped above and below like the output of my_distort_rotate.
+    Without a parameter bank the grids are built for the exact parameters and width, so they give
+    the same pixels as computing them on every call. With a bank (see set_parameter_bank) the
+    parameters are quantized before keying and building, and rotate and arc grids, which only
+    shift x per row, are built for the width rounded up to REMAP_BUCKET_WIDTH and sliced, so
+    images of similar widths share them. The barrel grid is normalised by the exact width, so it
+    is always cached per width.
+    """
+    banked = PARAMETER_BANK is not None
+    quantize = _quantize if banked else lambda value, step: value
+    if kind == 'barrel':
+        k_1, k_2 = [quantize(k, PARAMETER_STEPS['k']) for k in params]
+        return _cached_maps(('barrel', h, w, k_1, k_2), lambda: _barrel_maps(h, w, k_1, k_2))
+    bucket_w = _bucket_width(w) if banked else w
+    if kind == 'rotate':
+        theta = quantize(params[0], PARAMETER_STEPS['theta'])
+        map_x, map_y = _cached_maps(('rotate', h, bucket_w, theta), lambda: _rotate_maps(h, bucket_w, theta))
+        # crop above and below
+        to_crop = (h - np.abs(int(h*np.sin(theta))))//2
+        rows = slice(to_crop, h - to_crop)
+        return map_x[rows, :w], map_y[rows, :w]
+    theta_max, r = quantize(params[0], PARAMETER_STEPS['theta']), quantize(params[1], PARAMETER_STEPS['r'])
+    build = _arc_left_maps if kind == 'arc_left' else _arc_right_maps
+    map_x, map_y = _cached_maps((kind, h, bucket_w, theta_max, r), lambda: build(h, bucket_w, theta_max, r))
+    dst_w = _arc_dst_width(w, theta_max, r)
+    return map_x[:, :dst_w], map_y[:, :dst_w]
+
+def width_buckets(widths, bucket_width=REMAP_BUCKET_WIDTH):
+    """Group indices by width rounded up to bucket_width; returns {bucket width: [indices]}."""
+    buckets = {}
+    for i, w in enumerate(widths):
+        buckets.setdefault(-(-w // bucket_width) * bucket_width, []).append(i)
+    return buckets
+
+METHOD_NAMES = ['distort_w', 'distort_h', 'barrel', 'arc_left', 'arc_right', 'rotate_right', 'rotate_left', 'Nothing']
+
+def apply_random_transform_batch(images, method_indices=None, bucket_width=REMAP_BUCKET_WIDTH):
+    """
+    Batch version of apply_random_transform for NumPy images that share a height.
+    Every image draws its own method. Barrel, arc and rotate images are then grouped by method and
+    width bucket; each group shares one parameter draw, so its images reuse the cached remap grids.
+    Each image is remapped on its own, giving the same pixels as the single-image function with
+    the group's parameters. The warps keep per-image meshes. Returns (images, method names) in
+    input order.
+    """
+    if method_indices is None:
+        method_indices = [np.random.randint(len(METHOD_NAMES)) for _ in images]
+    methods = [METHOD_NAMES[i] for i in method_indices]
+    results = list(images)
+    groups = {}
+    for i, (img, method) in enumerate(zip(images, methods)):
+        if method == 'distort_w':
+            results[i] = warp_image(img, w_mesh_std = np.random.uniform(2,2.6))
+        elif method == 'distort_h':
+            results[i] = warp_image(img, h_mesh_std = np.random.uniform(2,2.6))
+        elif method in PARAMETER_RANGES and not (method.startswith('arc') and img.shape[1] < 70):
+            groups.setdefault(method, []).append(i)
+    for method, indices in groups.items():
+        kind = 'rotate' if method.startswith('rotate') else method
+        for bucket in width_buckets([images[i].shape[1] for i in indices], bucket_width).values():
+            group = [indices[j] for j in bucket]
+            params = _draw_parameters(method)
+            for i in group:
+                h, w = images[i].shape[:2]
+                map_x, map_y = _distortion_maps(kind, h, w, params)
+                dst = cv2.remap(images[i], map_x, map_y, cv2.INTER_CUBIC, borderMode = cv2.BORDER_REFLECT, borderValue=0)
+                results[i] = resize_height(dst, h)
+    return results, methods
 
 # method_index is for testing
 def apply_random_transform(img, seed=0, method_index=None):
-    method_name = ['distort_w', 'distort_h', 'barrel', 'arc_left', 'arc_right', 'rotate_right', 'rotate_left', 'Nothing']
+    method_name = METHOD_NAMES
     
     h, w = img.shape[:2]
     
@@ -246,19 +428,22 @@ def apply_random_transform(img, seed=0, method_index=None):
     if method_name[selected_method] == 'distort_h':
         return warp_image(img, h_mesh_std = np.random.uniform(2,2.6)), method_name[selected_method]
     if method_name[selected_method] == 'barrel':
-        return barrel_distortion(img, k_1=np.random.uniform(.01, .05), k_2=np.random.uniform(.01,.05)), method_name[selected_method]
+        k_1, k_2 = _draw_parameters('barrel')
+        return barrel_distortion(img, k_1=k_1, k_2=k_2), method_name[selected_method]
     if method_name[selected_method] == 'arc_left':
         if w < 70:
             return img, method_name[selected_method]
-        return my_distort_arc_left(img, theta_max=np.random.uniform(np.pi/3, np.pi/4), r=np.random.uniform(20,30)), method_name[selected_method]
+        theta_max, r = _draw_parameters('arc_left')
+        return my_distort_arc_left(img, theta_max=theta_max, r=r), method_name[selected_method]
     if method_name[selected_method] == 'arc_right':
         if w < 70:
             return img, method_name[selected_method]
-        return my_distort_arc_right(img, theta_max=np.random.uniform(np.pi/3, np.pi/4), r=np.random.uniform(20,30)), method_name[selected_method]
+        theta_max, r = _draw_parameters('arc_right')
+        return my_distort_arc_right(img, theta_max=theta_max, r=r), method_name[selected_method]
     if method_name[selected_method] == "rotate_right":
-        return my_distort_rotate(img, np.random.uniform(np.pi/2+.3, 5*np.pi/6)), method_name[selected_method]
+        return my_distort_rotate(img, *_draw_parameters('rotate_right')), method_name[selected_method]
     if method_name[selected_method] == "rotate_left":
-        return my_distort_rotate(img, np.random.uniform(np.pi/6, np.pi/2-.3)), method_name[selected_method]
+        return my_distort_rotate(img, *_draw_parameters('rotate_left')), method_name[selected_method]
     if method_name[selected_method] == "Nothing":
         #print("Nothing distortion")
         return img, method_name[selected_method]
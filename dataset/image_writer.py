@@ -0,0 +1,105 @@
+import collections
+import io
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# codec name -> (PIL format, file extension)
+IMAGE_CODECS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+}
+WRITER_THREADS = 2
+WRITE_QUEUE = 16  # images encoded or written at once per worker before rendering waits
+
+def encode_image(img, codec='jpeg', quality=None):
+    """Encode a PIL image with one of IMAGE_CODECS; quality=None keeps the PIL default of the codec."""
+    buf = io.BytesIO()
+    options = {} if quality is None else {'quality': quality}
+    img.convert('RGB').save(buf, format=IMAGE_CODECS[codec][0], **options)
+    return buf.getvalue()
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+class ImageWriter:
+    """
+    Encodes and stores images on a small thread pool, so the next image can be rendered while
+    the previous ones are encoded and written (PIL encoders and file writes release the GIL).
+    At most max_pending images are in flight; submit() blocks on the oldest one beyond that.
+    Results come back from submit() and drain() in submission order, so callers can journal
+    them in order. With threads=0 every image is encoded and stored inside submit().
+    """
+
+    def __init__(self, threads=WRITER_THREADS, max_pending=WRITE_QUEUE, codec='jpeg', quality=None):
+        if codec not in IMAGE_CODECS:
+            raise ValueError(f"Unknown codec {codec}, choose from {list(IMAGE_CODECS)}")
+        self.codec = codec
+        self.quality = quality
+        self.extension = IMAGE_CODECS[codec][1]
+        self.max_pending = max(1, max_pending)
+        self.executor = ThreadPoolExecutor(threads) if threads > 0 else None
+        self.pending = collections.deque()
+        self.stats = collections.Counter()
+
+    def _encode_and_store(self, img, store):
+        start = time.perf_counter()
+        data = encode_image(img, self.codec, self.quality)
+        encoded = time.perf_counter()
+        result = store(data)
+        return result, (encoded - start, time.perf_counter() - encoded)
+
+    def submit(self, img, store, tag=None):
+        """
+        Queue img to be encoded and passed to store(data), whose return value is the result.
+        Returns the (tag, result, error) of the images that have finished, in submission order;
+        results are (store result, (encode seconds, store seconds)).
+        """
+        self.stats['images'] += 1
+        self.stats['queue_depth'] += len(self.pending)
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self.pending))
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(self._encode_and_store(img, store))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self.executor.submit(self._encode_and_store, img, store)
+        self.pending.append((tag, future))
+        return self._collect(self.max_pending, 'stall_seconds')
+
+    def poll(self):
+        """Return the (tag, result, error) of the images that have finished, without waiting."""
+        return self._collect(len(self.pending), 'stall_seconds')
+
+    def drain(self):
+        """Wait for every queued image; returns their (tag, result, error) in submission order."""
+        return self._collect(0, 'drain_seconds')
+
+    def _collect(self, keep, wait_stat):
+        finished = []
+        while self.pending and (len(self.pending) > keep or self.pending[0][1].done()):
+            tag, future = self.pending.popleft()
+            start = time.perf_counter()
+            error = future.exception()
+            self.stats[wait_stat] += time.perf_counter() - start
+            if error is not None:
+                finished.append((tag, None, error))
+                continue
+            result, seconds = future.result()
+            self.stats['write_seconds'] += sum(seconds)
+            finished.append((tag, (result, seconds), None))
+        return finished
+
+    def close(self):
+        self.drain()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
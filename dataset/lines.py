@@ -1,8 +1,23 @@
 import argparse
+import array
+import bisect
+import collections
+import hashlib
+import heapq
+import json
 import glob
 import tqdm
 import pickle
 import os
+import re
+import tempfile
+import numpy as np
+from shards import iter_shard, list_shards, shard_label
+from manifests import merge_manifests
+
+INDEX_FILE = 'data.npz'  # columnar index written next to data.csv
+SPLITS = ['train', 'val', 'test']
+SPLIT_FRACTIONS = [0.90, 0.09, 0.01]
 
 def csv_field(field):
     """Return the CSV field properly quoted if it contains a comma or a double quote."""
@@ -11,43 +26,228 @@ def csv_field(field):
         return f'"{field}"'
     return field
 
+def font_clean(font_label):
+    """Clean the font name: remove file extension and trailing spaces/underscores."""
+    return os.path.splitext(os.path.basename(font_label))[0].rstrip(" _")
+
+def label_rows():
+    """
+    Yield (image path, font file, image width, image height, word) rows of all label files in
+    word_dict, sorted by font. generation.py writes sorted <data_dir>.tsv files, which are k-way
+    merged while streaming; pickled dicts from older runs are loaded and sorted in memory.
+    Fields that older runs did not record are "".
+    """
+    key = lambda row: font_clean(row[1])
+    runs = [merge_manifests(sorted(glob.glob("word_dict/*.tsv")), 5, key, optional=3)]
+    for pickle_file in glob.glob("word_dict/*pkl"):
+        with open(pickle_file, 'rb') as handle:
+            data_dict = pickle.load(handle)
+        runs.append(sorted(((name, font, "", "", "") for name, font in data_dict.items()), key=key))
+    return heapq.merge(*runs, key=key)
+
+def check_shard_parts(label_files):
+    """Warn about `generation.py --shard i/k` runs of which not all k label files are present."""
+    parts = collections.defaultdict(set)
+    for label_file in label_files:
+        match = re.fullmatch(r"(.*)_shard(\d+)of(\d+)\.tsv", os.path.basename(label_file))
+        if match:
+            parts[match.group(1), int(match.group(3))].add(int(match.group(2)))
+    for (name, k), found in sorted(parts.items()):
+        missing = sorted(set(range(k)) - found)
+        if missing:
+            print(f"WARNING: {name} was generated in {k} parts, but the label files of parts {missing} are missing.")
+
+def split_of(label, key, thresholds):
+    """
+    Split id of a sample: a hash of (font label, key) mapped to [0, 1) and compared with the
+    cumulative split fractions, so it never depends on row order or on the other rows.
+    """
+    digest = hashlib.blake2b(f"{label}\t{key}".encode('utf-8'), digest_size=8).digest()
+    return min(bisect.bisect(thresholds, int.from_bytes(digest, 'little') / 2**64), len(thresholds) - 1)
+
+class IndexWriter:
+    """
+    Builds the columnar index of data.csv one row at a time: int32 label ids with the font name
+    table, int32 image width and height (0 where unknown), a uint8 split id (a hash of font and
+    word, see split_of) and the image locations (paths, or shard, offset and nbytes), stored with
+    np.savez. font_datasets.FontDataset and ShardFontDataset load it with split= selecting rows.
+    """
+
+    def __init__(self, fractions=SPLIT_FRACTIONS):
+        self.thresholds = np.cumsum(fractions) / np.sum(fractions)
+        self.label_ids = {}
+        self.provisional = array.array('i')
+        self.widths, self.heights = array.array('i'), array.array('i')
+        self.splits = array.array('B')
+        self.blob = bytearray()
+        self.path_offsets = array.array('q', [0])
+        self.shard_ids = {}
+        self.shards, self.offsets, self.nbytes = array.array('i'), array.array('q'), array.array('i')
+
+    def _add(self, label, width, height, split_key):
+        self.provisional.append(self.label_ids.setdefault(label, len(self.label_ids)))
+        self.widths.append(int(width) if width else 0)
+        self.heights.append(int(height) if height else 0)
+        self.splits.append(split_of(label, split_key, self.thresholds))
+        return SPLITS[self.splits[-1]]
+
+    def add_file(self, path, label, width, height, word):
+        """Add an image file and return its split; rows without a recorded word are split by their path."""
+        self.blob += path.encode('utf-8')
+        self.path_offsets.append(len(self.blob))
+        return self._add(label, width, height, word or path)
+
+    def add_member(self, shard, offset, nbytes, label, width, height, word):
+        """Add a shard member (a byte range of shard) and return its split."""
+        self.shards.append(self.shard_ids.setdefault(shard, len(self.shard_ids)))
+        self.offsets.append(offset)
+        self.nbytes.append(nbytes)
+        return self._add(label, width, height, word or f"{shard}:{offset}")
+
+    def save(self, path):
+        first_seen = list(self.label_ids)
+        order = sorted(range(len(first_seen)), key=lambda i: first_seen[i])
+        remap = np.empty(len(first_seen), dtype=np.int32)
+        remap[order] = np.arange(len(first_seen), dtype=np.int32)
+        columns = {
+            'labels': np.array([first_seen[i] for i in order], dtype=str),
+            'targets': remap[np.frombuffer(self.provisional, dtype=np.int32)],
+            'widths': np.frombuffer(self.widths, dtype=np.int32),
+            'heights': np.frombuffer(self.heights, dtype=np.int32),
+            'splits': np.frombuffer(self.splits, dtype=np.uint8),
+            'split_names': np.array(SPLITS, dtype=str),
+        }
+        if self.shard_ids:
+            columns.update(shard_files=np.array(list(self.shard_ids), dtype=str),
+                           shards=np.frombuffer(self.shards, dtype=np.int32),
+                           offsets=np.frombuffer(self.offsets, dtype=np.int64),
+                           nbytes=np.frombuffer(self.nbytes, dtype=np.int32))
+        else:
+            columns.update(paths=np.frombuffer(bytes(self.blob), dtype=np.uint8),
+                           path_offsets=np.frombuffer(self.path_offsets, dtype=np.int64))
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(tmp, path)
+        counts = np.bincount(columns['splits'], minlength=len(SPLITS))
+        print(f"Index {path}: " + ", ".join(f"{name} {n}" for name, n in zip(SPLITS, counts)))
+
+def read_run(shard_dir):
+    """The run.json generation.py stored in a run directory ({} if there is none)."""
+    run_file = os.path.join(shard_dir, "run.json")
+    if not os.path.exists(run_file):
+        return {}
+    with open(run_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def member_order(member_path):
+    """
+    Sort key of a shard member '<shard file>/<member>' (or a bare member name): font label,
+    font index and word index (parsed from the member name), then the path itself.
+    """
+    name = member_path.rsplit('/', 1)[-1]
+    parts = os.path.splitext(name)[0].rsplit('_', 2)
+    if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+        return shard_label(name), int(parts[1]), int(parts[2]), member_path
+    return shard_label(name), -1, -1, member_path
+
+def journal_cells(shard_dir):
+    """
+    Stream the generation journal rows of shard_dir that name a shard member, in member_order of
+    their '<shard file>/<member>' (a k-way merge, see manifests.py). Fields that older runs did
+    not record are "".
+    """
+    journals = sorted(glob.glob(os.path.join(glob.escape(shard_dir), ".journal", "journal_*.tsv")))
+    for row in merge_manifests(journals, 7, lambda row: member_order(row[2]), optional=3):
+        if '/' in row[2]:
+            yield row
+
+def quarantined_prefixes(run):
+    """Member name prefixes of the fonts generation.py quarantined in a run, replaced or not (see read_run)."""
+    return tuple(f"{os.path.splitext(os.path.basename(entry['font']))[0]}_{entry['font_idx']}_"
+                 for entry in run.get('quarantined', []))
+
+def shard_rows(base, shard_dir):
+    """
+    Stream (path, offset, nbytes, font, width, height, word) rows for every image in the shards
+    of shard_dir, sorted by font label (see member_order). The tar headers are spilled to a
+    temporary manifest, merged in member_order and joined with the journal rows streamed in the
+    same order, which give the size and (through run.json) the word ("" if not recorded).
+    """
+    run = read_run(shard_dir)
+    words = run.get('words', [])
+    skip = quarantined_prefixes(run)
+    handle, members_file = tempfile.mkstemp(suffix=".tsv")
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            for shard in list_shards(shard_dir):
+                for name, offset, size in iter_shard(shard):
+                    if not (skip and name.startswith(skip)):
+                        f.write(f"{os.path.basename(shard)}/{name}\t{offset}\t{size}\n")
+        cells = journal_cells(shard_dir)
+        cell = next(cells, None)
+        for member_path, offset, size in merge_manifests([members_file], 3, lambda row: member_order(row[0])):
+            order = member_order(member_path)
+            while cell is not None and member_order(cell[2]) < order:
+                cell = next(cells, None)
+            width, height, word = "", "", ""
+            if cell is not None and cell[2] == member_path:
+                idx = int(cell[1])
+                width, height, word = cell[4], cell[5], words[idx - 1] if idx <= len(words) else ""
+            shard, name = member_path.split('/', 1)
+            yield os.path.join(base, shard_dir, shard), int(offset), int(size), shard_label(name), width, height, word
+    finally:
+        os.remove(members_file)
+
 def main(args):
     outfile = 'data.csv'
+    index = IndexWriter(args.splits)
+    if args.shards is not None:
+        # Shard layout: each row points at a byte range of a shard (see font_datasets.ShardFontDataset).
+        # Rows are streamed already sorted by font label (see shard_rows).
+        total_files = 0
+        with open(outfile, 'w', encoding='utf-8') as csvfile:
+            csvfile.write("img_path,offset,nbytes,text,width,height,split\n")
+            for path, offset, size, label, width, height, word in shard_rows(args.base_dir, args.shards):
+                split = index.add_member(path, offset, size, label, width, height, word)
+                csvfile.write(f"{csv_field(path)},{offset},{size},{csv_field(label)},{width},{height},{split}\n")
+                total_files += 1
+        index.save(INDEX_FILE)
+        print("Total Files:", total_files)
+        return
+
     # Set base to args.base_dir; in your case, pass the root (e.g., "/Users/hamza/Research/One-DM")
     base = args.base_dir
 
     # Define the unwanted prefix that should be removed from each image path.
     unwanted_prefix = os.path.join("test", "dataset") + os.sep
 
-    # Collect all rows in a list.
-    rows = []
+    # The parts of a --shard run are merged like separate runs; check that none is missing.
+    check_shard_parts(glob.glob("word_dict/*.tsv"))
+
+    # Stream the label rows, already sorted by font label, straight into the CSV and the index.
     total_files = 0
-    for pickle_file in glob.glob("word_dict/*pkl"):
-        with open(pickle_file, 'rb') as handle:
-            data_dict = pickle.load(handle)
-            for name, font_label in data_dict.items():
-                # Remove the unwanted prefix from the image path, if present.
-                if name.startswith(unwanted_prefix):
-                    name = name[len(unwanted_prefix):]
-                total_files += 1
-                # Construct the full path using the base directory.
-                path = os.path.join(base, name)
-                # Clean the font name: remove file extension and trailing spaces/underscores.
-                font_clean = os.path.splitext(os.path.basename(font_label))[0].rstrip(" _")
-                rows.append((path, font_clean))
-    
-    # Sort rows by the font label.
-    rows.sort(key=lambda x: x[1])
-    
-    # Write sorted rows to CSV.
     with open(outfile, 'w', encoding='utf-8') as csvfile:
-        csvfile.write("img_path,text\n")
-        for path, font_clean in rows:
-            csvfile.write(f"{csv_field(path)},{csv_field(font_clean)}\n")
-    
+        csvfile.write("img_path,text,width,height,split\n")
+        for name, font_label, width, height, word in label_rows():
+            # Remove the unwanted prefix from the image path, if present.
+            if name.startswith(unwanted_prefix):
+                name = name[len(unwanted_prefix):]
+            total_files += 1
+            # Construct the full path using the base directory.
+            path = os.path.join(base, name)
+            label = font_clean(font_label)
+            split = index.add_file(path, label, width, height, word)
+            csvfile.write(f"{csv_field(path)},{csv_field(label)},{width},{height},{split}\n")
+    index.save(INDEX_FILE)
+
     print("Total Files:", total_files)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("base_dir", nargs='?', default="")
+    parser.add_argument("--shards", default=None,
+                        help="Index the tar shards in this directory (e.g. word_images/<data_dir>) instead of word_dict")
+    parser.add_argument("--splits", type=float, nargs=3, default=SPLIT_FRACTIONS, metavar=("TRAIN", "VAL", "TEST"),
+                        help="Fractions of the train/val/test splits (assigned by a hash of font and word)")
     main(parser.parse_args())
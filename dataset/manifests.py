@@ -0,0 +1,67 @@
+import heapq
+import tempfile
+
+# Manifests are append-only TSV files written one row at a time (the generation journals and the
+# word_dict/*.tsv label files). They are merged with heapq.merge, so only one row per file is in
+# memory; a file that is not sorted is first split into sorted runs of at most this many rows.
+MERGE_BLOCK_ROWS = 1_000_000
+
+def read_rows(path, columns, optional=0):
+    """
+    Yield the rows of a TSV manifest as lists of fields, skipping lines cut short by a crash.
+    Rows written before the last `optional` columns were added are padded with empty fields.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                continue
+            fields = line[:-1].split('\t')
+            if columns - optional <= len(fields) <= columns:
+                yield fields + [''] * (columns - len(fields))
+
+def _is_sorted(rows, key):
+    previous = None
+    for row in rows:
+        current = key(row)
+        if previous is not None and current < previous:
+            return False
+        previous = current
+    return True
+
+def _spill(block):
+    run = tempfile.TemporaryFile('w+', encoding='utf-8')
+    for row in block:
+        run.write('\t'.join(row) + '\n')
+    run.seek(0)
+    return run
+
+def _read_run(run):
+    with run:
+        for line in run:
+            yield line[:-1].split('\t')
+
+def sorted_runs(path, columns, key, block_rows=MERGE_BLOCK_ROWS, optional=0):
+    """
+    Return iterables of the rows of a manifest, each sorted by key. A sorted file is returned as is;
+    otherwise it is sorted in blocks of block_rows rows spilled to temporary files.
+    """
+    if _is_sorted(read_rows(path, columns, optional), key):
+        return [read_rows(path, columns, optional)]
+    runs = []
+    block = []
+    for row in read_rows(path, columns, optional):
+        block.append(row)
+        if len(block) >= block_rows:
+            block.sort(key=key)
+            runs.append(_read_run(_spill(block)))
+            block = []
+    block.sort(key=key)
+    runs.append(iter(block))
+    return runs
+
+def merge_manifests(paths, columns, key, block_rows=MERGE_BLOCK_ROWS, optional=0):
+    """Stream the rows of several manifests in key order (a k-way merge)."""
+    runs = []
+    for path in paths:
+        runs.extend(sorted_runs(path, columns, key, block_rows, optional))
+    return heapq.merge(*runs, key=key)
@@ -0,0 +1,133 @@
+import glob
+import os
+import zlib
+import numpy as np
+
+# Each store directory holds one (.bin, .tsv) pair per writer. The .bin file is a blob of
+# zlib-compressed 1-bit masks; the .tsv file has one row per mask with its offset and metadata.
+# key is the cell key of generation.py, so a cell rendered again (e.g. by --resume) is read once.
+INDEX_COLUMNS = ['offset', 'nbytes', 'height', 'width', 'source_width', 'source_height', 'font', 'word', 'key']
+
+def encode_mask(mask):
+    """Pack a uint8 coverage mask into zlib-compressed bits (coverage >= 128 counts as ink)."""
+    return zlib.compress(np.packbits(mask >= 128).tobytes(), 1)
+
+def decode_mask(data, height, width):
+    """Inverse of encode_mask: returns an (height, width) uint8 mask with values 0 and 255."""
+    bits = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    return np.unpackbits(bits, count=height * width).reshape(height, width) * np.uint8(255)
+
+class MaskStoreWriter:
+    """
+    Appends clean text masks to <directory>/masks_<tag>.bin and their index rows to
+    masks_<tag>.tsv. Use one writer (tag) per process; both files are append-only.
+    Masks are stored at generation height, where 1 bit per pixel loses little: the
+    samples are downscaled several times afterwards, which restores anti-aliasing.
+    """
+
+    def __init__(self, directory, tag):
+        os.makedirs(directory, exist_ok=True)
+        self.blob = open(os.path.join(directory, f"masks_{tag}.bin"), 'ab')
+        self.index = open(os.path.join(directory, f"masks_{tag}.tsv"), 'a', encoding='utf-8')
+        self.offset = self.blob.tell()
+
+    def append(self, mask, source_size, font, word, key=""):
+        """Store a mask with the font label and word it was rendered from, and the key of its cell."""
+        data = encode_mask(mask)
+        self.blob.write(data)
+        height, width = mask.shape
+        self.index.write(f"{self.offset}\t{len(data)}\t{height}\t{width}\t{source_size[0]}\t{source_size[1]}\t"
+                         f"{font}\t{word}\t{key}\n")
+        self.offset += len(data)
+
+    def flush(self):
+        self.blob.flush()
+        self.index.flush()
+
+    def close(self):
+        self.blob.close()
+        self.index.close()
+
+def drop_masks(directory, keys):
+    """
+    Remove the index rows of the cells in keys from every index of a store directory (their
+    bytes stay in the blobs, unreferenced); returns the number of rows removed. Run it only
+    while no writer has the store open.
+    """
+    dropped = 0
+    for index_file in sorted(glob.glob(os.path.join(directory, "masks_*.tsv"))):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        kept = [line for line in lines if line.rstrip('\n').split('\t')[-1] not in keys]
+        if len(kept) == len(lines):
+            continue
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.writelines(kept)
+        os.replace(tmp_file, index_file)
+        dropped += len(lines) - len(kept)
+    return dropped
+
+class MaskStore:
+    """
+    Read-only view of a mask store directory. Index columns are kept in NumPy arrays and the
+    blobs are memory-mapped, so the store can be shared by forked DataLoader workers.
+    Fonts are mapped to integer labels in sorted order. A cell stored more than once (same
+    key) is read once.
+    """
+
+    def __init__(self, directory):
+        self.blob_files = []
+        columns = {name: [] for name in INDEX_COLUMNS}
+        blob_ids = []
+        keys = set()
+        for index_file in sorted(glob.glob(os.path.join(directory, "masks_*.tsv"))):
+            blob_file = index_file[:-len(".tsv")] + ".bin"
+            blob_size = os.path.getsize(blob_file)
+            self.blob_files.append(blob_file)
+            with open(index_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    # Skip rows cut short by a crash, or whose bytes never reached the blob.
+                    if len(fields) != len(INDEX_COLUMNS) or int(fields[0]) + int(fields[1]) > blob_size:
+                        continue
+                    key = fields[-1]
+                    if key:
+                        if key in keys:
+                            continue
+                        keys.add(key)
+                    for name, value in zip(INDEX_COLUMNS, fields):
+                        columns[name].append(value)
+                    blob_ids.append(len(self.blob_files) - 1)
+        self.blob_ids = np.array(blob_ids, dtype=np.int32)
+        self.offsets = np.array(columns['offset'], dtype=np.int64)
+        self.nbytes = np.array(columns['nbytes'], dtype=np.int32)
+        self.shapes = np.array([columns['height'], columns['width']], dtype=np.int32).T.reshape(-1, 2)
+        self.source_sizes = np.array([columns['source_width'], columns['source_height']], dtype=np.int32).T.reshape(-1, 2)
+        self.fonts = sorted(set(columns['font']))
+        font_to_label = {font: i for i, font in enumerate(self.fonts)}
+        self.labels = np.array([font_to_label[font] for font in columns['font']], dtype=np.int32)
+        self.words = columns['word']
+        self.blobs = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _blob(self, i):
+        # Opened lazily so each DataLoader worker maps the files itself.
+        if self.blobs is None:
+            self.blobs = [np.memmap(f, dtype=np.uint8, mode='r') if os.path.getsize(f) else np.zeros(0, np.uint8)
+                          for f in self.blob_files]
+        return self.blobs[self.blob_ids[i]]
+
+    def __getitem__(self, i):
+        """Return mask i as an (height, width) uint8 array with values 0 and 255."""
+        start = self.offsets[i]
+        data = self._blob(i)[start:start + self.nbytes[i]]
+        height, width = self.shapes[i]
+        return decode_mask(data.tobytes(), height, width)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['blobs'] = None
+        return state
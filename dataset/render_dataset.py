@@ -0,0 +1,166 @@
+import argparse
+import os
+import random
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+import gen_line_images as synthetic
+from font_datasets import resize_to_height
+from font_index import FontIndex, FONT_INDEX_FILE
+from generation import (FONT_CHECK_TIMEOUT, SPARE_FONTS, cell_seed, choose_fonts_and_words, create_placeholder_image,
+                        flush_logger, load_run, render_word, save_run, worker_logger)
+from corpus import WORDS_FILE
+
+FONT_PATH = './fonts_2K'
+FONT_SIZE = 80     # as in generation.py
+IMAGE_HEIGHT = 64  # as in generation.py
+FONTS_PER_WINDOW = synthetic.FONT_CACHE_SIZE  # fonts FontWindowSampler mixes at a time
+
+class RenderedFontDataset(Dataset):
+    """
+    Font classification samples rendered on demand, with the same cells, rendering, fallbacks
+    and labels as a generation.py run, but without writing any image. Sample idx is the cell
+    (font idx // len(words), word idx % len(words)); it is rendered after seeding the random
+    generators with the cell's seed for the current epoch (see set_epoch and cell_seed). Epoch 0
+    therefore gives the images generation.py writes (before encoding), and every epoch can be replayed.
+
+    Fonts are parsed once per DataLoader worker (the load_font/load_cmap caches of
+    gen_line_images hold FONT_CACHE_SIZE fonts, so sample with FontWindowSampler rather than
+    uniformly over thousands of fonts). Pass a BackgroundPool as backgrounds, so the decoded
+    backgrounds are shared by all workers instead of reread for every sample.
+
+    Args:
+        fonts (list): Font files (e.g. the validated fonts of a run, see from_run).
+        words (list): Words; fallback words are drawn from the same list.
+        backgrounds: BackgroundPool, list of background files or a single file.
+        transform (callable, optional): Transform applied to the PIL image.
+        font_size, image_height (int): Rendering size and output height (generation.py uses 80 and 64).
+        font_index (FontIndex, optional): Source of the font content hashes the seeds derive from;
+            by default the index in FONT_INDEX_FILE (fonts it does not know are hashed).
+    """
+
+    def __init__(self, fonts, words, backgrounds, transform=None, font_size=FONT_SIZE, image_height=IMAGE_HEIGHT,
+                 font_index=None):
+        if font_index is None:
+            font_index = FontIndex(FONT_INDEX_FILE)
+        self.fonts = list(fonts)
+        self.font_hashes = [font_index.font_hash(font) for font in self.fonts]
+        self.words = list(words)
+        self.backgrounds = backgrounds
+        self.transform = transform
+        self.font_size = font_size
+        self.image_height = image_height
+        self.epoch = 0
+        self.labels = sorted({synthetic.font_label(font) for font in self.fonts})
+        self.label_to_index = {label: idx for idx, label in enumerate(self.labels)}
+        self.font_targets = np.array([self.label_to_index[synthetic.font_label(font)] for font in self.fonts], dtype=np.int32)
+        self.logger = None
+
+    @classmethod
+    def from_run(cls, run_path, backgrounds, **kwargs):
+        """Dataset of the fonts (after quarantine replacements) and words of a run directory."""
+        fonts, words, _, _ = load_run(run_path)
+        return cls(fonts, words, backgrounds, **kwargs)
+
+    def __len__(self):
+        return len(self.fonts) * len(self.words)
+
+    def set_epoch(self, epoch):
+        """
+        Render the samples of another epoch. Call it before creating the epoch's iterator; workers
+        started with persistent_workers=True keep the epoch they were started with.
+        """
+        self.epoch = epoch
+
+    def cell(self, idx):
+        """(font index, 1-based word index) of a sample, as in the file names of generation.py."""
+        font_idx, word_idx = divmod(idx, len(self.words))
+        return font_idx, word_idx + 1
+
+    def seed(self, idx):
+        font_idx, word_idx = self.cell(idx)
+        return cell_seed(self.font_hashes[font_idx], self.words[word_idx - 1], self.epoch)
+
+    def render(self, idx):
+        """Render sample idx as a PIL image of height image_height (a placeholder if the font fails)."""
+        if self.logger is None:
+            self.logger = worker_logger(f"render_worker_{os.getpid()}")
+        font_idx, word_idx = self.cell(idx)
+        word, font = self.words[word_idx - 1], self.fonts[font_idx]
+        # The caller's random state is restored, so rendering in the main process does not reseed it.
+        state = random.getstate(), np.random.get_state()
+        seed = self.seed(idx)
+        random.seed(seed)
+        np.random.seed(seed)
+        try:
+            _, img, _ = render_word(word, font, self.font_size, self.backgrounds, self.image_height, self.words, self.logger)
+            if img is None:
+                self.logger.error(f"Failed to generate image for (word: {word}, font: {font}). Using placeholder.")
+                flush_logger(self.logger)
+                img = create_placeholder_image(font, self.image_height)
+        finally:
+            random.setstate(state[0])
+            np.random.set_state(state[1])
+        return resize_to_height(img, self.image_height)
+
+    def __getitem__(self, idx):
+        image = self.render(idx).convert('RGB')
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.font_targets[idx // len(self.words)])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['logger'] = None
+        return state
+
+class FontWindowSampler(Sampler):
+    """
+    Shuffles a RenderedFontDataset so that each stretch of the epoch draws on only
+    fonts_per_window fonts: the fonts are shuffled, cut into windows, and the cells of each
+    window are shuffled together. A worker then keeps hitting its font cache, at the cost of
+    batches mixing fonts_per_window classes rather than all of them. Seeded per epoch.
+    """
+
+    def __init__(self, dataset, fonts_per_window=FONTS_PER_WINDOW, seed=0):
+        self.num_fonts = len(dataset.fonts)
+        self.num_words = len(dataset.words)
+        self.fonts_per_window = max(1, fonts_per_window)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_fonts * self.num_words
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        fonts = torch.randperm(self.num_fonts, generator=generator)
+        for start in range(0, self.num_fonts, self.fonts_per_window):
+            window = fonts[start:start + self.fonts_per_window]
+            cells = torch.randperm(len(window) * self.num_words, generator=generator)
+            indices = window[cells // self.num_words] * self.num_words + cells % self.num_words
+            yield from indices.tolist()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Choose and validate the fonts and words of a run for RenderedFontDataset, without generating images")
+    parser.add_argument("dataset_size", type=int, help="Number of unique fonts and words to sample")
+    parser.add_argument("processes", type=int, help="Number of processes for font validation")
+    parser.add_argument("run_path", help="Directory to store the run in (run.json, as generation.py writes)")
+    parser.add_argument("--words", default=WORDS_FILE,
+                        help="Pickled word list; it is preprocessed once into corpus_cache (see corpus.py)")
+    parser.add_argument("--fonts", default=FONT_PATH, help="Font directory")
+    parser.add_argument("--font_timeout", type=float, default=FONT_CHECK_TIMEOUT,
+                        help="Seconds before a hanging font check is killed and the font rejected")
+    parser.add_argument("--spare_fonts", type=int, default=SPARE_FONTS,
+                        help="Extra validated fonts stored with the run")
+    args = parser.parse_args()
+    font_index = FontIndex(FONT_INDEX_FILE)
+    selected_fonts, selected_words, spare_fonts = choose_fonts_and_words(args, args.fonts, font_index)
+    save_run(args.run_path, selected_fonts, selected_words, spare_fonts)
+    print(f"Saved {len(selected_fonts)} fonts and {len(selected_words)} words to {args.run_path}; "
+          f"{len(selected_fonts) * len(selected_words)} samples.")
@@ -0,0 +1,105 @@
+import glob
+import os
+import tarfile
+import threading
+
+# Shards are plain tar files (WebDataset layout): one member per image, named <font>_<font index>_<word index>.jpg,
+# so the font label is the member name without its last two fields.
+SHARD_SIZE = 1024 * 2**20  # bytes per shard before a writer starts the next one
+END_OF_ARCHIVE = b"\0" * (2 * tarfile.BLOCKSIZE)
+
+def shard_label(name):
+    """Font label of a shard member name (same cleanup as lines.py)."""
+    return os.path.splitext(name)[0].rsplit('_', 2)[0].rstrip(" _")
+
+class ShardWriter:
+    """
+    Appends files to <directory>/<prefix>_<n>.tar, starting a new shard once one exceeds max_bytes.
+    Members are written as raw tar blocks and flushed right away, so everything add() returned
+    is on disk even if the process is killed. The end-of-archive marker is written by
+    finalize_shards once all writers are done. Use one writer (prefix) per process; add() may be
+    called from several threads. Shards are never appended to: a shard name already on disk (e.g.
+    left by an earlier attempt of a resumed run whose worker had the same pid) is skipped.
+    """
+
+    def __init__(self, directory, prefix, max_bytes=SHARD_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.count = 0
+        self.file = None
+        self.name = None
+        self.lock = threading.Lock()
+
+    def _open_next(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        while self.file is None:
+            self.name = f"{self.prefix}_{self.count:05d}.tar"
+            self.count += 1
+            try:
+                self.file = open(os.path.join(self.directory, self.name), 'xb')
+            except FileExistsError:
+                continue
+
+    def add(self, name, data):
+        """Store data as member `name`; returns the file name of the shard it went into."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.GNU_FORMAT)
+        with self.lock:
+            if self.file is None or self.file.tell() >= self.max_bytes:
+                self._open_next()
+            self.file.write(header)
+            self.file.write(data)
+            self.file.write(b"\0" * (-len(data) % tarfile.BLOCKSIZE))
+            self.file.flush()
+            return self.name
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def iter_shard(path):
+    """
+    Yield (member name, data offset, size) for the complete members of a shard, in file order.
+    Only tar headers are read; a member cut short by a crash ends the iteration.
+    """
+    file_size = os.path.getsize(path)
+    try:
+        tar = tarfile.open(path, 'r:')
+    except tarfile.ReadError:
+        return  # empty, or the first header was cut short
+    with tar:
+        for info in tar:
+            if not info.isfile() or info.offset_data + info.size > file_size:
+                break
+            yield info.name, info.offset_data, info.size
+
+def read_shard(path):
+    """Yield (member name, bytes) for every complete member of a shard, reading it sequentially."""
+    with open(path, 'rb') as f:
+        for name, offset, size in iter_shard(path):
+            f.seek(offset)
+            yield name, f.read(size)
+
+def list_shards(directory):
+    return sorted(glob.glob(os.path.join(directory, "*.tar")))
+
+def finalize_shards(directory):
+    """
+    Make every shard in directory a well-formed tar file: drop a member left incomplete by a
+    killed writer and append the end-of-archive marker. Safe to run again on finished shards.
+    """
+    for path in list_shards(directory):
+        end = 0
+        for name, offset, size in iter_shard(path):
+            end = offset + size + (-size % tarfile.BLOCKSIZE)
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+            f.seek(end)
+            f.write(END_OF_ARCHIVE)
@@ -0,0 +1,162 @@
+import bisect
+import contextlib
+import json
+import time
+
+# Stages of one generated sample, in pipeline order. Times are exclusive: a stage that runs
+# inside another (a font load during text drawing) is not counted in the outer one. Encoding
+# and writing usually run on writer threads, overlapping the other stages.
+STAGES = ['font_load', 'cmap_filter', 'draw', 'blur', 'distortion', 'retry', 'resize', 'encode', 'write']
+# Events counted per font.
+EVENTS = ['retry', 'fallback', 'placeholder']
+# Histogram bin edges in seconds: 8 log-spaced bins per decade from 10 us to 100 s.
+BIN_EDGES = [10 ** (e / 8) for e in range(-40, 17)]
+TOP_FONTS = 15
+
+_active = None
+_no_stage = contextlib.nullcontext()
+
+def stage(name):
+    """Context manager timing a stage of the active StageTimer; does nothing if none is active."""
+    return _no_stage if _active is None else _active.stage(name)
+
+def count(event, font):
+    """Count an event (see EVENTS) for font in the active StageTimer, if any."""
+    if _active is not None:
+        _active.count(event, font)
+
+def activate(timer):
+    """Make timer the target of stage() and count() in this process (None to stop timing)."""
+    global _active
+    _active = timer
+
+class _Stage:
+    __slots__ = ('timer', 'name')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer._push(self.name)
+
+    def __exit__(self, *exc):
+        self.timer._pop()
+
+class StageTimer:
+    """
+    Per-sample stage times of a worker. Between start_sample() and end_sample(), time spent in
+    stage() blocks is summed per stage; end_sample() adds each sum to the histogram of its stage,
+    and the wall time of the sample ('total') to its font. Times measured on other threads are
+    added with record(). Timers of several workers and chunks are combined with merge() on
+    their to_dict() form.
+    """
+
+    def __init__(self):
+        self.histograms = {name: [0] * (len(BIN_EDGES) + 1) for name in STAGES + ['total']}
+        self.seconds = {name: 0.0 for name in STAGES + ['total']}
+        self.samples = {name: 0 for name in STAGES + ['total']}
+        self.fonts = {}  # font -> {'samples', 'seconds', event counts}
+        self._stages = {name: _Stage(self, name) for name in STAGES}
+        self._stack = []
+        self._sample = None
+
+    def stage(self, name):
+        return self._stages[name]
+
+    def _push(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(self._stack[-1], now)
+        self._stack.append(name)
+        self._mark = now
+
+    def _pop(self):
+        now = time.perf_counter()
+        self._charge(self._stack.pop(), now)
+        self._mark = now
+
+    def _charge(self, name, now):
+        if self._sample is not None:
+            self._sample[name] = self._sample.get(name, 0.0) + now - self._mark
+
+    def record(self, name, seconds):
+        """Add one sample's time of a stage measured elsewhere (e.g. on a writer thread)."""
+        self.histograms[name][bisect.bisect(BIN_EDGES, seconds)] += 1
+        self.seconds[name] += seconds
+        self.samples[name] += 1
+
+    def _font(self, font):
+        if font not in self.fonts:
+            self.fonts[font] = {'samples': 0, 'seconds': 0.0, **{event: 0 for event in EVENTS}}
+        return self.fonts[font]
+
+    def count(self, event, font):
+        self._font(font)[event] += 1
+
+    def start_sample(self):
+        self._sample = {}
+        self._sample_start = time.perf_counter()
+
+    def end_sample(self, font):
+        """Close the current sample, generated with font."""
+        sample, self._sample = self._sample, None
+        sample['total'] = time.perf_counter() - self._sample_start
+        for name, seconds in sample.items():
+            self.record(name, seconds)
+        stats = self._font(font)
+        stats['samples'] += 1
+        stats['seconds'] += sample['total']
+
+    def to_dict(self):
+        return {'histograms': self.histograms, 'seconds': self.seconds, 'samples': self.samples, 'fonts': self.fonts}
+
+    def merge(self, data):
+        """Add the counts of another timer's to_dict()."""
+        for name, counts in data['histograms'].items():
+            self.histograms[name] = [a + b for a, b in zip(self.histograms[name], counts)]
+            self.seconds[name] += data['seconds'][name]
+            self.samples[name] += data['samples'][name]
+        for font, stats in data['fonts'].items():
+            mine = self._font(font)
+            for key, value in stats.items():
+                mine[key] += value
+
+    def percentile(self, name, p):
+        """Upper bin edge (seconds) below which p percent of the samples of a stage fall."""
+        counts = self.histograms[name]
+        target = p / 100 * sum(counts)
+        cumulative = 0
+        for i, c in enumerate(counts):
+            cumulative += c
+            if c and cumulative >= target:
+                return BIN_EDGES[i] if i < len(BIN_EDGES) else float('inf')
+        return 0.0
+
+    def report(self, top_fonts=TOP_FONTS):
+        """Text report: time per stage, and the fonts with the highest mean time per sample."""
+        lines = ["Stage          samples   total s   mean ms    p50 ms    p90 ms    p99 ms   share"]
+        total = self.seconds['total'] or 1.0
+        for name in STAGES + ['total']:
+            n = self.samples[name]
+            if n == 0:
+                continue
+            mean = self.seconds[name] / n * 1000
+            p50, p90, p99 = (self.percentile(name, p) * 1000 for p in (50, 90, 99))
+            lines.append(f"{name:<12} {n:>9} {self.seconds[name]:>9.1f} {mean:>9.2f} "
+                         f"{p50:>9.2f} {p90:>9.2f} {p99:>9.2f} {self.seconds[name] / total:>7.1%}")
+        lines.append("Percentiles are upper edges of log-spaced bins (8 per decade). 'total' is the wall time of the")
+        lines.append("worker per sample; encode and write run on the writer threads unless --writer_threads 0.")
+        ranked = sorted(self.fonts.items(), key=lambda item: -item[1]['seconds'] / max(1, item[1]['samples']))
+        lines.append("")
+        lines.append(f"Most expensive fonts (mean time per sample, top {top_fonts}):")
+        lines.append("Font                                      samples   mean ms   total s  retries fallbacks placeholders")
+        for font, stats in ranked[:top_fonts]:
+            mean = stats['seconds'] / max(1, stats['samples']) * 1000
+            lines.append(f"{font[:40]:<40} {stats['samples']:>9} {mean:>9.2f} {stats['seconds']:>9.1f} "
+                         f"{stats['retry']:>8} {stats['fallback']:>9} {stats['placeholder']:>12}")
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'bin_edges': BIN_EDGES, **self.to_dict()}, f)
@@ -0,0 +1,174 @@
+import collections
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+class TaskError(Exception):
+    """A task raised an exception inside its worker."""
+
+class TaskTimeout(Exception):
+    """A task exceeded its time budget and its worker was killed."""
+
+class WorkerDied(Exception):
+    """A worker process exited (e.g. segfaulted) while running a task."""
+
+# (beats array, slot) inside a pool worker, None in any other process.
+_worker_state = None
+
+def heartbeat():
+    """
+    Reset the time budget of the task running in this worker.
+    Long tasks made of many small steps call this before each step, so the timeout
+    applies per step instead of per task. Does nothing outside a TimeoutPool worker.
+    """
+    if _worker_state is not None:
+        beats, slot = _worker_state
+        beats[slot] = time.time()
+
+def worker_slot():
+    """Return the slot number of the calling pool worker, or None outside a pool."""
+    return None if _worker_state is None else _worker_state[1]
+
+def _worker_loop(slot, conn, beats, func, initializer, initargs, finalizer):
+    global _worker_state
+    _worker_state = (beats, slot)
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        heartbeat()
+        try:
+            result = func(*item)
+        except Exception as e:
+            conn.send((None, f"{type(e).__name__}: {e}"))
+        else:
+            conn.send((result, None))
+    if finalizer is not None:
+        finalizer()
+    conn.close()
+
+class TimeoutPool:
+    """
+    A process pool that runs func(*args) for each submitted task and kills any worker
+    whose task goes longer than `timeout` seconds without a heartbeat().
+    Killed or crashed workers are replaced, so one pathological input (e.g. a font
+    whose hinting program hangs FreeType) costs one task instead of the whole run.
+    Each worker owns a pipe, so killing it cannot corrupt a shared queue. finalizer() runs in
+    each worker when close() stops it (not in killed workers).
+    """
+
+    def __init__(self, processes, func, timeout=None, initializer=None, initargs=(), poll_interval=0.2,
+                 finalizer=None):
+        self.processes = max(1, processes)
+        self.func = func
+        self.timeout = timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self.finalizer = finalizer
+        self.poll_interval = poll_interval
+        self.beats = multiprocessing.Array('d', self.processes, lock=False)
+        self.workers = [None] * self.processes
+        self.running = {}
+        self.pending = collections.deque()
+        for slot in range(self.processes):
+            self._start(slot)
+
+    def _start(self, slot):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        p = multiprocessing.Process(
+            target=_worker_loop,
+            args=(slot, child_conn, self.beats, self.func, self.initializer, self.initargs, self.finalizer),
+            daemon=True
+        )
+        p.start()
+        child_conn.close()
+        self.workers[slot] = (p, parent_conn)
+
+    def _restart(self, slot):
+        p, conn = self.workers[slot]
+        if p.is_alive():
+            p.kill()
+        p.join()
+        conn.close()
+        self._start(slot)
+
+    def submit(self, *args):
+        """Queue a task; tasks are handed to workers in submission order."""
+        self.pending.append(args)
+
+    def cancel(self, predicate):
+        """Drop the queued tasks whose args satisfy predicate (running tasks are kept); returns their args."""
+        cancelled = [args for args in self.pending if predicate(args)]
+        self.pending = collections.deque(args for args in self.pending if not predicate(args))
+        return cancelled
+
+    def as_completed(self):
+        """
+        Yield (args, result, error) for every submitted task as it finishes, where error is
+        None, a TaskError, a TaskTimeout or a WorkerDied. Tasks may be submitted while iterating.
+        """
+        while self.pending or self.running:
+            for slot in range(self.processes):
+                if slot in self.running or not self.pending:
+                    continue
+                args = self.pending.popleft()
+                self.beats[slot] = time.time()
+                self.workers[slot][1].send(args)
+                self.running[slot] = args
+
+            conns = {self.workers[slot][1]: slot for slot in self.running}
+            for conn in wait(list(conns), timeout=self.poll_interval):
+                slot = conns[conn]
+                args = self.running.pop(slot)
+                try:
+                    result, error = conn.recv()
+                except (EOFError, OSError):
+                    exitcode = self.workers[slot][0].exitcode
+                    self._restart(slot)
+                    yield args, None, WorkerDied(f"worker {slot} exited with code {exitcode}")
+                    continue
+                yield args, result, TaskError(error) if error is not None else None
+
+            if self.timeout is None:
+                continue
+            now = time.time()
+            for slot, args in list(self.running.items()):
+                if now - self.beats[slot] > self.timeout:
+                    del self.running[slot]
+                    self._restart(slot)
+                    yield args, None, TaskTimeout(f"no progress for {self.timeout} seconds")
+
+    def close(self, timeout=5):
+        """Stop the workers after their current task, killing those not done within timeout seconds (None: wait)."""
+        for p, conn in self.workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for p, conn in self.workers:
+            p.join(timeout=timeout)
+            if p.is_alive():
+                p.kill()
+                p.join()
+            conn.close()
+
+    def terminate(self):
+        """Kill the workers immediately, dropping queued and running tasks."""
+        self.pending.clear()
+        self.running.clear()
+        for p, conn in self.workers:
+            if p.is_alive():
+                p.kill()
+            p.join()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.terminate()
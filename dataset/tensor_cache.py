@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from tqdm import tqdm
+from font_datasets import FontDataset, ShardFontDataset
+from lines import SPLITS
+from task_pool import TimeoutPool
+
+# The notebook resizes every image to 224 x 224 and normalizes with the ImageNet statistics.
+IMAGE_SIZE = (224, 224)  # (height, width)
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+BLOCK_SIZE = 1024  # images per decoding task
+
+def open_source(csv_file, base_dir="", split=None):
+    """
+    The dataset of a lines.py CSV or data.npz (only the rows of split, if given): ShardFontDataset
+    for shard indexes, FontDataset otherwise.
+    """
+    if csv_file.endswith('.npz'):
+        with np.load(csv_file) as index:
+            columns = ['offset'] if 'shard_files' in index.files else []
+    else:
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            columns = [name.strip() for name in f.readline().split(',')]
+    if 'offset' in columns:
+        return ShardFontDataset(csv_file, base_dir, split=split)
+    return FontDataset(csv_file, base_dir, split=split)
+
+# Source dataset and output array of a decoding worker, set by init_decode_worker.
+_decode_state = None
+
+def init_decode_worker(csv_file, base_dir, split, images_file):
+    global _decode_state
+    _decode_state = (open_source(csv_file, base_dir, split), np.load(images_file, mmap_mode='r+'))
+
+def decode_block(start, stop):
+    """Decode and resize images start..stop-1 of the source into the cache (same resize as transforms.Resize)."""
+    source, images = _decode_state
+    height, width = images.shape[1:3]
+    for i in range(start, stop):
+        image, _ = source[i]
+        images[i] = np.asarray(image.resize((width, height), Image.BILINEAR))
+    images.flush()
+    return stop - start
+
+def build_tensor_cache(csv_file, directory, base_dir="", size=IMAGE_SIZE, processes=1, split=None):
+    """
+    Decode every image listed in csv_file (only the rows of split, with a data.npz index) once,
+    resized to size, into <directory>/images.npy (N x height x width x 3 uint8) with int32 labels
+    in labels.npy. meta.json, holding the label names, is written last and marks the cache as
+    complete.
+    """
+    source = open_source(csv_file, base_dir, split)
+    os.makedirs(directory, exist_ok=True)
+    meta_file = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    images_file = os.path.join(directory, "images.npy")
+    height, width = size
+    np.lib.format.open_memmap(images_file, mode='w+', dtype=np.uint8, shape=(len(source), height, width, 3)).flush()
+    np.save(os.path.join(directory, "labels.npy"), np.asarray(source.targets, dtype=np.int32))
+    print(f"Decoding {len(source)} images to {height}x{width} ({len(source) * height * width * 3 / 2**30:.1f} GiB).")
+    failed = 0
+    with TimeoutPool(processes, decode_block, initializer=init_decode_worker,
+                     initargs=(csv_file, base_dir, split, images_file)) as pool, \
+            tqdm(total=len(source), desc="Decoding") as progress_bar:
+        for start in range(0, len(source), BLOCK_SIZE):
+            pool.submit(start, min(start + BLOCK_SIZE, len(source)))
+        for (start, stop), _, error in pool.as_completed():
+            if error is not None:
+                print(f"Images {start}-{stop - 1} failed: {error}")
+                failed += 1
+            progress_bar.update(stop - start)
+    if failed:
+        raise RuntimeError(f"{failed} blocks failed; the cache in {directory} is incomplete.")
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump({'source': csv_file, 'split': split, 'size': [height, width], 'count': len(source),
+                   'labels': list(source.labels)}, f, ensure_ascii=False)
+
+class TensorCacheDataset(Dataset):
+    """
+    Font classification samples from a cache written by build_tensor_cache. Items are
+    (height x width x 3 uint8 array, label), where the array is a view of the memory-mapped
+    cache: nothing is decoded or resized. Batches collate to uint8 NHWC tensors; convert them
+    on the device with normalize_batch, which gives the same values as the notebook's
+    Resize/ToTensor/Normalize transform.
+
+    Args:
+        directory (str): Cache directory.
+        transform (callable, optional): Applied to the uint8 array.
+    """
+
+    def __init__(self, directory, transform=None):
+        meta_file = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_file):
+            raise ValueError(f"{directory} is not a complete tensor cache (no meta.json).")
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.directory = directory
+        self.transform = transform
+        self.labels = meta['labels']
+        self.label_to_index = {label: idx for idx, label in enumerate(self.labels)}
+        self.targets = np.load(os.path.join(directory, "labels.npy"))
+        self.images = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        # Mapped lazily so each DataLoader worker maps the cache itself. Copy-on-write, so the
+        # views are writable (as torch expects) without ever touching the file.
+        if self.images is None:
+            self.images = np.load(os.path.join(self.directory, "images.npy"), mmap_mode='c')
+        image = self.images[idx]
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.targets[idx])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['images'] = None
+        return state
+
+def normalize_batch(images, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """uint8 NHWC batch -> normalized float NCHW batch (ToTensor and Normalize for a whole batch)."""
+    images = images.permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(mean, device=images.device).view(1, -1, 1, 1)
+    std = torch.tensor(std, device=images.device).view(1, -1, 1, 1)
+    return images.sub_(mean).div_(std)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode and resize a dataset once into a memory-mapped uint8 array")
+    parser.add_argument("csv_file", help="CSV written by lines.py (image files or shards)")
+    parser.add_argument("directory", help="Output directory of the cache")
+    parser.add_argument("--base_dir", default="", help="Base directory to prepend to the image paths")
+    parser.add_argument("--size", type=int, nargs=2, default=list(IMAGE_SIZE), metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Decoding processes")
+    parser.add_argument("--split", choices=SPLITS, default=None,
+                        help="Only cache the rows of this split (needs the data.npz index)")
+    args = parser.parse_args()
+    build_tensor_cache(args.csv_file, args.directory, args.base_dir, tuple(args.size), args.processes, args.split)
@@ -0,0 +1,100 @@
+import os
+import pickle
+import random
+import subprocess
+import sys
+import numpy as np
+import pytest
+from PIL import Image
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset")
+# The dataset scripts import each other as top-level modules.
+sys.path.insert(0, DATASET_DIR)
+
+ARABIC_LETTERS = [chr(c) for c in range(0x0621, 0x064B)]
+
+def make_font(path, family, weight=80):
+    """Write a small TrueType font with a box glyph for every basic Arabic letter."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    chars = [ord(c) for c in ARABIC_LETTERS] + [0x20]
+    names = [".notdef"] + [f"uni{c:04X}" for c in chars]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({c: f"uni{c:04X}" for c in chars})
+    glyphs = {}
+    for i, name in enumerate(names):
+        pen = TTGlyphPen(None)
+        if name != "uni0020":
+            height, width = 300 + (i * 37) % 500, weight + i % 200
+            pen.moveTo((50, 0))
+            pen.lineTo((50, height))
+            pen.lineTo((50 + width, height))
+            pen.lineTo((50 + width, 0))
+            pen.closePath()
+        glyphs[name] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (400, 50) for name in names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(path)
+
+def make_workspace(root, num_fonts=6, num_backgrounds=3, num_words=200):
+    """
+    Lay out what generation.py expects in its working directory: fonts_2K/<family>/<family>.ttf,
+    background PNGs in images/ and a pickled word list (words.pickle).
+    """
+    for i in range(num_fonts):
+        directory = os.path.join(root, "fonts_2K", f"Font{i}")
+        os.makedirs(directory)
+        make_font(os.path.join(directory, f"Font{i}.ttf"), f"Font{i}", 60 + 10 * i)
+    os.makedirs(os.path.join(root, "images"))
+    rng = np.random.RandomState(0)
+    for i in range(num_backgrounds):
+        height, width = rng.randint(200, 600), rng.randint(300, 900)
+        pixels = (200 + rng.randint(0, 55, size=(height, width, 3))).astype(np.uint8)
+        Image.fromarray(pixels).save(os.path.join(root, "images", f"bg{i}.png"))
+    words = ["".join(random.Random(k).choices(ARABIC_LETTERS, k=2 + k % 7)) for k in range(num_words)]
+    with open(os.path.join(root, "words.pickle"), 'wb') as f:
+        pickle.dump(words, f)
+    return root
+
+# Runs a script (argv[2:]) with the distortion chance of every sample set to argv[1], so tests can
+# exercise the random distortions. Pool workers are forked, so they inherit the patched function.
+DISTORTED_RUN = """
+import runpy, sys
+import gen_line_images
+apply_augmentations = gen_line_images.apply_augmentations
+chance, sys.argv = float(sys.argv[1]), sys.argv[2:]
+gen_line_images.apply_augmentations = lambda img, distort_chance=0.3, blur_chance=0.5, flip=False: \\
+    apply_augmentations(img, chance, blur_chance, flip)
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def run_script(workspace, script, *args, distort_chance=None):
+    """
+    Run one of the dataset scripts in workspace; returns its stdout, failing the test on a non-zero
+    exit. distort_chance overrides the distortion chance of every rendered sample.
+    """
+    command = [sys.executable, os.path.join(DATASET_DIR, script), *map(str, args)]
+    if distort_chance is not None:
+        command = [sys.executable, "-c", DISTORTED_RUN, str(distort_chance)] + command[1:]
+    result = subprocess.run(command, cwd=workspace, env=dict(os.environ, PYTHONPATH=DATASET_DIR),
+                            capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+def read_images(directory):
+    """{file name: bytes} of the images in a directory (run metadata and journals left out)."""
+    images = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(('.jpg', '.png', '.webp')):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images[name] = f.read()
+    return images
+
+@pytest.fixture
+def workspace(tmp_path):
+    return str(make_workspace(str(tmp_path)))
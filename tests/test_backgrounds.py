@@ -0,0 +1,50 @@
+import pickle
+import numpy as np
+import pytest
+from PIL import Image
+from backgrounds import BackgroundPool
+
+def make_backgrounds(directory, sizes):
+    files = []
+    rng = np.random.RandomState(0)
+    for i, (width, height) in enumerate(sizes):
+        files.append(str(directory / f"bg{i}.png"))
+        Image.fromarray(rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)).save(files[-1])
+    return files
+
+def test_pool_holds_the_decoded_backgrounds(tmp_path):
+    files = make_backgrounds(tmp_path, [(300, 200), (120, 90), (64, 400)])
+    pool = BackgroundPool.create(files)
+    try:
+        assert len(pool) == 3 and pool.nbytes == 3 * (300 * 200 + 120 * 90 + 64 * 400)
+        for i, background_file in enumerate(files):
+            assert np.array_equal(pool.image(i), np.asarray(Image.open(background_file).convert('RGB')))
+        # choice() draws the same background as np.random.choice on the file list.
+        for seed in range(10):
+            np.random.seed(seed)
+            expected = np.random.choice(files)
+            np.random.seed(seed)
+            assert np.array_equal(pool.choice(), pool.image(files.index(expected)))
+
+        # A pickled pool (as sent to spawned workers) maps the same block instead of a copy.
+        attached = pickle.loads(pickle.dumps(pool))
+        assert not attached.owner and attached.files == files
+        attached.image(1)[0, 0] = (1, 2, 3)
+        assert tuple(pool.image(1)[0, 0]) == (1, 2, 3)
+        attached.close()
+    finally:
+        pool.close()
+    assert not pool.owner
+
+def test_large_backgrounds_are_downscaled(tmp_path):
+    files = make_backgrounds(tmp_path, [(1000, 500), (300, 200)])
+    pool = BackgroundPool.create(files, max_side=400)
+    try:
+        assert pool.image(0).shape == (200, 400, 3)
+        assert pool.image(1).shape == (200, 300, 3)
+    finally:
+        pool.close()
+
+def test_no_backgrounds():
+    with pytest.raises(ValueError):
+        BackgroundPool.create([])
@@ -0,0 +1,56 @@
+import os
+import pickle
+import random
+import pytest
+import corpus
+from corpus import WordCorpus
+
+def write_words(path, words):
+    with open(path, 'wb') as f:
+        pickle.dump(words, f)
+    return str(path)
+
+def all_words(words_corpus):
+    return [words_corpus[i] for i in range(len(words_corpus))]
+
+def test_corpus_keeps_distinct_arabic_words_by_length(tmp_path):
+    words = ["كتاب", "بيت", "word", "كتاب", "ب", "مدرسة", "بيت", "قلم", "كتب٣", "باب", "مكتبة"]
+    source = write_words(tmp_path / "words.pickle", words)
+    words_corpus = WordCorpus.load(source, str(tmp_path / "cache"))
+    # Sorted by length, in source order within a length.
+    assert all_words(words_corpus) == ["بيت", "قلم", "باب", "كتاب", "مدرسة", "مكتبة"]
+    assert [words_corpus[i] for i in words_corpus.length_range(3, 3)] == ["بيت", "قلم", "باب"]
+    assert [words_corpus[i] for i in words_corpus.length_range(4)] == ["كتاب", "مدرسة", "مكتبة"]
+    assert [words_corpus[i] for i in words_corpus.length_range(max_length=4)] == ["بيت", "قلم", "باب", "كتاب"]
+    assert len(words_corpus.length_range(6, 9)) == 0 and len(words_corpus.length_range(5, 2)) == 0
+
+    sample = words_corpus.sample(3, min_length=4, rng=random.Random(0))
+    assert sorted(sample) == sorted(["كتاب", "مدرسة", "مكتبة"])
+    assert len(set(words_corpus.sample(6, rng=random.Random(1)))) == 6
+    with pytest.raises(ValueError):
+        words_corpus.sample(4, max_length=3)
+
+def test_corpus_cache_is_keyed_by_the_source_content(tmp_path, monkeypatch):
+    source = write_words(tmp_path / "words.pickle", ["بيت", "قلم"])
+    cache_dir = str(tmp_path / "cache")
+    directory = WordCorpus.load(source, cache_dir).directory
+    assert directory == os.path.join(cache_dir, corpus.source_hash(source))
+
+    def unexpected_build(source, directory):
+        raise AssertionError("the corpus was built again")
+
+    monkeypatch.setattr(corpus, 'build_corpus', unexpected_build)
+    assert all_words(WordCorpus.load(source, cache_dir)) == ["بيت", "قلم"]
+    monkeypatch.undo()
+    write_words(source, ["بيت", "قلم", "باب"])
+    changed = WordCorpus.load(source, cache_dir)
+    assert changed.directory != directory and len(changed) == 3
+
+def test_empty_corpus(tmp_path):
+    for name, words in [("empty", []), ("filtered", ["word", "ب", "١٢٣"])]:
+        source = write_words(tmp_path / f"{name}.pickle", words)
+        words_corpus = WordCorpus.load(source, str(tmp_path / "cache"))
+        assert len(words_corpus) == 0 and len(words_corpus.length_range(2, 5)) == 0
+        assert words_corpus.sample(0) == []
+        with pytest.raises(ValueError):
+            words_corpus.sample(1)
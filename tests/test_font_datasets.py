@@ -0,0 +1,79 @@
+import csv
+import os
+import numpy as np
+import torch
+from conftest import run_script
+from font_datasets import FontDataset, ShardFontDataset, WidthBucketBatchSampler, pad_collate
+
+def test_npz_index_matches_the_csv(workspace, monkeypatch):
+    run_script(workspace, "generation.py", 6, 2, "run", "--chunk_size", 4)
+    run_script(workspace, "lines.py", "--splits", 40, 40, 20)
+    monkeypatch.chdir(workspace)
+    from_csv, from_npz = FontDataset("data.csv", cache=False), FontDataset("data.npz")
+    assert len(from_csv) == len(from_npz) == 36
+    assert list(from_csv.labels) == list(from_npz.labels)
+    assert list(from_csv.widths) == list(from_npz.widths)
+    for idx in range(len(from_csv)):
+        image, target = from_csv[idx]
+        assert from_npz[idx][1] == target
+        assert image.size[0] == from_csv.widths[idx]
+        assert np.array_equal(np.asarray(image), np.asarray(from_npz[idx][0]))
+    # The splits partition the rows, and their label ids are those of the whole index.
+    with open("data.csv", encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    for split in ('train', 'val', 'test'):
+        dataset = FontDataset("data.npz", split=split)
+        expected = [row for row in rows if row['split'] == split]
+        assert len(dataset) == len(expected)
+        assert list(dataset.labels) == list(from_npz.labels)
+        assert [dataset.labels[t] for t in dataset.targets] == [row['text'] for row in expected]
+
+def test_shard_dataset_matches_the_file_layout(workspace, monkeypatch):
+    run_script(workspace, "generation.py", 6, 2, "files", "--chunk_size", 4)
+    run_script(workspace, "lines.py")
+    os.rename(os.path.join(workspace, "data.npz"), os.path.join(workspace, "files.npz"))
+    run_script(workspace, "generation.py", 6, 2, "shards", "--run_plan", os.path.join("word_images", "files"), "--shards")
+    run_script(workspace, "lines.py", "--shards", os.path.join("word_images", "shards"))
+    monkeypatch.chdir(workspace)
+    files, shards = FontDataset("files.npz"), ShardFontDataset("data.npz")
+    assert list(files.labels) == list(shards.labels)
+    decoded = lambda dataset: sorted((dataset.labels[target], np.asarray(image).tobytes()) for image, target in map(dataset.__getitem__, range(len(dataset))))
+    assert decoded(files) == decoded(shards)
+
+def test_batches_come_from_one_width_bucket():
+    rng = np.random.RandomState(0)
+    widths = np.concatenate([rng.randint(30, 500, size=500), np.zeros(20, dtype=int)])
+    sampler = WidthBucketBatchSampler(widths, 16, bucket_width=32)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(widths)))
+    for batch in batches:
+        assert len({-(-widths[i] // 32) for i in batch}) == 1
+        assert len(batch) <= 16
+
+def test_batches_replay_per_epoch():
+    widths = np.random.RandomState(1).randint(30, 500, size=300)
+    sampler = WidthBucketBatchSampler(widths, 8, seed=5)
+    first = list(sampler)
+    assert first == list(WidthBucketBatchSampler(widths, 8, seed=5))
+    sampler.set_epoch(1)
+    assert list(sampler) != first
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+def test_drop_last_keeps_full_batches_only():
+    widths = [40] * 10 + [200] * 7
+    sampler = WidthBucketBatchSampler(widths, 4, drop_last=True)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 3
+    assert all(len(batch) == 4 for batch in batches)
+
+def test_pad_collate_pads_on_the_right():
+    images = [torch.full((3, 64, width), float(width)) for width in (50, 80, 65)]
+    batch, labels = pad_collate(list(zip(images, [2, 0, 1])), pad_value=-1.0)
+    assert batch.shape == (3, 3, 64, 80)
+    assert labels.tolist() == [2, 0, 1]
+    for img, padded in zip(images, batch):
+        width = img.shape[2]
+        assert torch.equal(padded[:, :, :width], img)
+        assert (padded[:, :, width:] == -1.0).all()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import time
+import font_index
+import generation
+from conftest import make_font
+from font_index import FontIndex
+
+def slow_check(i, font, test_word):
+    time.sleep(5)
+
+def test_timed_out_fonts_are_checked_again(tmp_path, monkeypatch):
+    font = str(tmp_path / "Font0.ttf")
+    make_font(font, "Font0")
+    index_file = str(tmp_path / "font_index.json")
+    index = FontIndex(index_file)
+    monkeypatch.setattr(generation, 'check_font_task', slow_check)
+    valid, failed = generation.validate_fonts([font], ["بيت"], index, processes=1, timeout=0.5)
+    assert (valid, failed) == ([], [font])
+    assert index.lookup(font) is None
+    index.save()
+
+    monkeypatch.undo()
+    index = FontIndex(index_file)
+    valid, failed = generation.validate_fonts([font], ["بيت"], index, processes=1, timeout=30)
+    assert (valid, failed) == ([font], [])
+    assert index.lookup(font)['valid']
+
+def test_records_follow_the_font_content(tmp_path, monkeypatch):
+    font = str(tmp_path / "Font0.ttf")
+    make_font(font, "Font0")
+    index_file = str(tmp_path / "font_index.json")
+    index = FontIndex(index_file)
+    record = index.validate(font, "بيت")
+    assert record['valid'] and record['coverage'] == [[0x0621, 0x064A]]
+    index.save()
+
+    def unexpected_check(font, test_word):
+        raise AssertionError(f"{font} was checked again")
+
+    # A renamed or moved copy of the same file is found by its content, also after reloading the index.
+    monkeypatch.setattr(font_index, 'check_font', unexpected_check)
+    index = FontIndex(index_file)
+    moved = str(tmp_path / "moved" / "Renamed.ttf")
+    os.makedirs(os.path.dirname(moved))
+    shutil.copy(font, moved)
+    assert index.font_hash(moved) == index.font_hash(font) == font_index.file_hash(font)
+    assert index.validate(moved, "بيت")['valid']
+
+    # A font whose content changed is checked again.
+    monkeypatch.undo()
+    make_font(font, "Font0", weight=120)
+    assert index.lookup(font) is None
+    assert index.validate(font, "بيت")['valid']
+    assert len(index.entries) == 2
+
+def test_broken_fonts_are_recorded(tmp_path):
+    font = str(tmp_path / "Broken.ttf")
+    with open(font, 'wb') as f:
+        f.write(b"not a font")
+    index = FontIndex(str(tmp_path / "font_index.json"))
+    record = index.validate(font, "بيت")
+    assert not record['valid'] and record['error_class'] == 'unreadable'
+    assert index.lookup(font) == dict(record, path=font)
+    assert index.lookup(str(tmp_path / "missing.ttf")) is None
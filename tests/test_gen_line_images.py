@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+import gen_line_images
+from conftest import ARABIC_LETTERS, make_font
+
+def make_curved_font(path):
+    """A font of slanted, curved glyphs, so the rendered text has anti-aliased edges."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    chars = [ord(c) for c in ARABIC_LETTERS]
+    names = [".notdef"] + [f"uni{c:04X}" for c in chars]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({c: f"uni{c:04X}" for c in chars})
+    glyphs = {}
+    for i, name in enumerate(names):
+        pen = TTGlyphPen(None)
+        pen.moveTo((40, 0))
+        pen.lineTo((200 + 7 * i, 650 - 5 * i))
+        pen.qCurveTo((330, 420 + 3 * i), (360 - i, 0))
+        pen.closePath()
+        glyphs[name] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (380, 40) for name in names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "Curved", "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(path)
+
+def test_composited_text_matches_drawing_it(tmp_path):
+    font = str(tmp_path / "Curved.ttf")
+    make_curved_font(font)
+    rng = np.random.RandomState(0)
+    for case in range(20):
+        text = "".join(rng.choice(ARABIC_LETTERS, size=rng.randint(2, 9)))
+        font_size = int(rng.randint(30, 120))
+        color = (0, 0, 0) if case % 2 else (int(rng.randint(50, 150)),) * 3
+        mask = gen_line_images.render_text_mask(text, font, font_size)
+        patch = rng.randint(150, 256, size=mask.shape + (3,)).astype(np.uint8)
+        # What draw_text_on_background did before: draw the text straight onto the background.
+        image_font = gen_line_images.load_font(font, font_size)
+        left, top = image_font.getbbox(text)[:2]
+        drawn = Image.fromarray(patch)
+        ImageDraw.Draw(drawn).text((-left, -top), text, font=image_font, fill=color)
+        assert ((mask > 0) & (mask < 255)).any()
+        assert np.array_equal(gen_line_images.composite_text(patch, mask, color), np.asarray(drawn))
+
+def test_fonts_are_parsed_once_per_path_and_size(tmp_path):
+    font = str(tmp_path / "Font0.ttf")
+    make_font(font, "Font0")
+    gen_line_images.load_font.cache_clear()
+    gen_line_images.load_cmap.cache_clear()
+    handle = gen_line_images.load_font(font, 30)
+    assert gen_line_images.load_font(font, 30) is handle
+    assert gen_line_images.load_font(font, 31) is not handle
+    assert gen_line_images.load_font(font, 31).size == 31
+    cmap = gen_line_images.load_cmap(font)
+    assert gen_line_images.load_cmap(font) is cmap
+    assert all(ord(c) in cmap for c in ARABIC_LETTERS)
+
+    # Past FONT_CACHE_SIZE handles, the least recently used one is parsed again.
+    for size in range(100, 100 + gen_line_images.FONT_CACHE_SIZE):
+        gen_line_images.load_font(font, size)
+    assert gen_line_images.load_font.cache_info().currsize == gen_line_images.FONT_CACHE_SIZE
+    assert gen_line_images.load_font(font, 30) is not handle
+
+def test_unreadable_fonts_are_not_cached(tmp_path):
+    font = str(tmp_path / "missing.ttf")
+    gen_line_images.load_font.cache_clear()
+    for _ in range(2):
+        with pytest.raises(OSError):
+            gen_line_images.load_font(font, 30)
+    assert gen_line_images.load_font.cache_info().currsize == 0
+    make_font(font, "Font0")
+    assert gen_line_images.load_font(font, 30).size == 30
@@ -0,0 +1,276 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import generation
+from conftest import DATASET_DIR, read_images, run_script
+from mask_store import MaskStore
+from shards import ShardWriter
+
+def test_shard_parts_match_a_single_run(workspace):
+    run_script(workspace, "generation.py", 6, 2, "full", "--chunk_size", 4)
+    single = read_images(os.path.join(workspace, "word_images", "full"))
+    assert len(single) == 36
+    parts = {}
+    for i in range(3):
+        run_script(workspace, "generation.py", 6, 2, "part", "--run_plan", os.path.join("word_images", "full"),
+                   "--shard", f"{i}/3", "--chunk_size", 5)
+        parts.update(read_images(os.path.join(workspace, "word_images", f"part_shard{i}of3")))
+    assert parts == single
+
+def test_images_do_not_depend_on_processes_or_chunk_size(workspace):
+    run_script(workspace, "generation.py", 6, 1, "one", "--chunk_size", 36, distort_chance=0.5)
+    run_script(workspace, "generation.py", 6, 3, "three", "--run_plan", os.path.join("word_images", "one"),
+               "--chunk_size", 2, distort_chance=0.5)
+    one = read_images(os.path.join(workspace, "word_images", "one"))
+    assert len(one) == 36
+    assert read_images(os.path.join(workspace, "word_images", "three")) == one
+
+# Runs a script (argv[1:]) with every glob.glob listing in reverse name order, standing in for the
+# hash order in which some file systems (e.g. ext4) list a directory.
+REVERSED_LISTING_RUN = """
+import glob, runpy, sys
+listing = glob.glob
+glob.glob = lambda *args, **kwargs: sorted(listing(*args, **kwargs), reverse=True)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def test_images_do_not_depend_on_the_directory_order(workspace):
+    run_script(workspace, "generation.py", 6, 2, "listed", "--chunk_size", 4)
+    result = subprocess.run([sys.executable, "-c", REVERSED_LISTING_RUN, os.path.join(DATASET_DIR, "generation.py"),
+                             "6", "2", "reversed", "--run_plan", os.path.join("word_images", "listed"), "--chunk_size", "4"],
+                            cwd=workspace, env=dict(os.environ, PYTHONPATH=DATASET_DIR),
+                            capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stdout + result.stderr
+    listed = read_images(os.path.join(workspace, "word_images", "listed"))
+    assert len(listed) == 36
+    assert read_images(os.path.join(workspace, "word_images", "reversed")) == listed
+
+def test_render_context_ignores_the_listing_order(workspace):
+    backgrounds = [os.path.join(workspace, "images", f"bg{i}.png") for i in range(3)]
+    options = {'distortion_bank': None, 'codec': 'jpeg', 'quality': None}
+    context = lambda files, words: generation.render_context(files, None, words, 80, 64, options)
+    assert context(backgrounds, ["a", "b"]) == context(backgrounds[::-1], ["a", "b"])
+    assert context(backgrounds, ["a", "b"]) != context(backgrounds[:2], ["a", "b"])
+    assert context(backgrounds, ["a", "b"]) != context(backgrounds, ["a", "c"])
+
+def test_cell_keys_follow_every_input(workspace):
+    backgrounds = [os.path.join(workspace, "images", f"bg{i}.png") for i in range(3)]
+    options = {'distortion_bank': None, 'codec': 'jpeg', 'quality': None}
+    context = generation.render_context(backgrounds, None, ["a"], 80, 64, options)
+    assert context != generation.render_context(backgrounds, 512, ["a"], 80, 64, options)
+    assert context != generation.render_context(backgrounds, None, ["a"], 80, 48, options)
+    assert context != generation.render_context(backgrounds, None, ["a"], 80, 64, dict(options, codec='png'))
+    # Backgrounds are keyed by their content, not their names.
+    with open(backgrounds[0], 'ab') as f:
+        f.write(b"\0")
+    assert context != generation.render_context(backgrounds, None, ["a"], 80, 64, options)
+
+    key = generation.cell_key("0" * 40, "بيت", 7, context)
+    assert key == generation.cell_key("0" * 40, "بيت", 7, context)
+    others = [generation.cell_key("1" * 40, "بيت", 7, context), generation.cell_key("0" * 40, "باب", 7, context),
+              generation.cell_key("0" * 40, "بيت", 8, context), generation.cell_key("0" * 40, "بيت", 7, "other")]
+    assert key not in others and len(set(others)) == 4
+
+def test_resume_regenerates_the_same_images(workspace):
+    run_script(workspace, "generation.py", 6, 2, "full", "--chunk_size", 4, distort_chance=0.5)
+    full_run = os.path.realpath(os.path.join(workspace, "word_images", "full"))
+    full = read_images(full_run)
+    # An interrupted run: half of the images never made it to disk.
+    interrupted = os.path.join(workspace, "word_images", "resumed@20000101-000000")
+    shutil.copytree(full_run, interrupted)
+    for name in list(full)[::2]:
+        os.remove(os.path.join(interrupted, name))
+    output = run_script(workspace, "generation.py", 6, 2, "resumed", "--resume", "--chunk_size", 3,
+                        distort_chance=0.5)
+    assert "Skipping 18 cells" in output
+    assert read_images(os.path.join(workspace, "word_images", "resumed")) == full
+
+def test_incremental_reuses_cells_that_moved(workspace):
+    run_script(workspace, "generation.py", 6, 2, "full", "--chunk_size", 4, distort_chance=0.5)
+    with open(os.path.join(workspace, "word_images", "full", "run.json"), encoding='utf-8') as f:
+        plan = json.load(f)
+    # Dropping the second font moves every later font to a lower index.
+    del plan['fonts'][1]
+    os.makedirs(os.path.join(workspace, "plan"))
+    with open(os.path.join(workspace, "plan", "run.json"), 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False)
+    output = run_script(workspace, "generation.py", 5, 2, "full", "--run_plan", "plan", "--incremental",
+                        distort_chance=0.5)
+    assert "Reused 30 unchanged cells" in output
+    run_script(workspace, "generation.py", 5, 2, "fresh", "--run_plan", "plan", distort_chance=0.5)
+    incremental = read_images(os.path.join(workspace, "word_images", "full"))
+    assert len(incremental) == 30
+    assert incremental == read_images(os.path.join(workspace, "word_images", "fresh"))
+
+# Runs generation.py (argv[2:]) with every render of the font named argv[1] hanging after the
+# first two a worker draws, so the font times out and gets quarantined part way through.
+HANGING_FONT_RUN = """
+import runpy, sys, time
+import gen_line_images
+main_generate_image, rendered = gen_line_images.main_generate_image, []
+hanging, sys.argv = sys.argv[1], sys.argv[2:]
+def generate(text, font, *args, **kwargs):
+    if font.endswith(hanging):
+        rendered.append(text)
+        if len(rendered) > 2:
+            time.sleep(600)
+    return main_generate_image(text, font, *args, **kwargs)
+gen_line_images.main_generate_image = generate
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def test_quarantined_font_without_a_spare_leaves_nothing(workspace):
+    run_script(workspace, "generation.py", 4, 2, "full")
+    with open(os.path.join(workspace, "word_images", "full", "run.json"), encoding='utf-8') as f:
+        plan = json.load(f)
+    plan['spares'] = []
+    os.makedirs(os.path.join(workspace, "plan"))
+    with open(os.path.join(workspace, "plan", "run.json"), 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False)
+    hanging = os.path.basename(plan['fonts'][1])
+    result = subprocess.run([sys.executable, "-c", HANGING_FONT_RUN, hanging, os.path.join(DATASET_DIR, "generation.py"),
+                             "4", "2", "run", "--run_plan", "plan", "--chunk_size", "4", "--render_timeout", "3",
+                             "--mask_store", "masks"],
+                            cwd=workspace, env=dict(os.environ, PYTHONPATH=DATASET_DIR),
+                            capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "no spare fonts left" in result.stdout
+    prefix = f"{os.path.splitext(hanging)[0]}_1_"
+    images = read_images(os.path.join(workspace, "word_images", "run"))
+    assert len(images) == 12
+    assert not any(name.startswith(prefix) for name in images)
+    with open(os.path.join(workspace, "word_dict", "run.tsv"), encoding='utf-8') as f:
+        labels = f.read().splitlines()
+    assert len(labels) == 12
+    assert not any(hanging in label for label in labels)
+    masks = MaskStore(os.path.join(workspace, "masks"))
+    assert len(masks) == 12
+    assert os.path.splitext(hanging)[0] not in masks.fonts
+
+# Runs generation.py (argv[2:]) with every render of the font named argv[1] failing. getsize (gone
+# in Pillow 10) is put back, so create_placeholder_image can draw its placeholders.
+FAILING_FONT_RUN = """
+import runpy, sys
+import gen_line_images
+from PIL import ImageFont
+ImageFont.FreeTypeFont.getsize = lambda self, text: self.getbbox(text)[2:]
+main_generate_image = gen_line_images.main_generate_image
+failing, sys.argv = sys.argv[1], sys.argv[2:]
+gen_line_images.main_generate_image = lambda text, font, *args, **kwargs: \\
+    (None, None) if font.endswith(failing) else main_generate_image(text, font, *args, **kwargs)
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def test_masks_only_run_writes_no_placeholders(workspace):
+    run_script(workspace, "render_dataset.py", 4, 2, "plan")
+    with open(os.path.join(workspace, "plan", "run.json"), encoding='utf-8') as f:
+        failing = os.path.basename(json.load(f)['fonts'][0])
+    result = subprocess.run([sys.executable, "-c", FAILING_FONT_RUN, failing, os.path.join(DATASET_DIR, "generation.py"),
+                             "4", "2", "run", "--run_plan", "plan", "--mask_store", "masks", "--no_images"],
+                            cwd=workspace, env=dict(os.environ, PYTHONPATH=DATASET_DIR),
+                            capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert read_images(os.path.join(workspace, "word_images", "run")) == {}
+    journaled = []
+    for journal in glob.glob(os.path.join(workspace, "word_images", "run", ".journal", "journal_*.tsv")):
+        with open(journal, encoding='utf-8') as f:
+            journaled += [line.split('\t')[3] for line in f]
+    assert len(journaled) == 12
+    assert failing not in journaled
+
+def test_worker_shard_writer_is_created_once(tmp_path, monkeypatch):
+    import generation
+    created = []
+
+    class SlowShardWriter(ShardWriter):
+        def __init__(self, *args):
+            # Long enough for every thread to reach the check before the first writer exists.
+            time.sleep(0.05)
+            created.append(self)
+            super().__init__(*args)
+
+    monkeypatch.setattr(generation, 'ShardWriter', SlowShardWriter)
+    monkeypatch.setattr(generation, '_shard_writer', None)
+    writers = []
+    threads = [threading.Thread(target=lambda: writers.append(generation.worker_shard_writer(str(tmp_path), 0, 2**20)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(writer is created[0] for writer in writers)
+
+def test_queued_images_are_journaled_when_the_worker_stops(tmp_path, monkeypatch):
+    import generation
+    from PIL import Image
+    monkeypatch.setattr(generation, '_image_writer', None)
+    logger = generation.worker_logger(str(tmp_path / "worker"))
+    writer, journal = generation.worker_image_writer(str(tmp_path), 0, 2, 16, 'png', None, logger)
+    assert generation.worker_image_writer(str(tmp_path), 0, 2, 16, 'png', None, logger) == (writer, journal)
+    for idx in range(1, 6):
+        store = lambda data, name=f"Font0_0_{idx}.png": generation.write_file(str(tmp_path / name), data) or name
+        finished = writer.submit(Image.new('RGB', (40, 64), 'white'), store, ("word", "Font0.ttf", 0, idx, (40, 64), f"key{idx}"))
+        generation.journal_written(journal, finished, logger)
+    generation.close_worker_image_writer()
+    assert generation._image_writer is None
+    with open(tmp_path / ".journal" / "journal_0.tsv", encoding='utf-8') as f:
+        rows = [line.rstrip('\n').split('\t') for line in f]
+    assert sorted(row[2] for row in rows) == [f"Font0_0_{idx}.png" for idx in range(1, 6)]
+    assert all(os.path.exists(tmp_path / row[2]) for row in rows)
+
+def test_shard_needs_a_run_plan(workspace):
+    result = subprocess.run([sys.executable, os.path.join(DATASET_DIR, "generation.py"), "6", "2", "part", "--shard", "0/2"],
+                            cwd=workspace, capture_output=True, text=True, encoding='utf-8')
+    assert result.returncode != 0
+    assert "--shard needs --run_plan" in result.stderr
+
+def test_parts_run_side_by_side(workspace):
+    run_script(workspace, "render_dataset.py", 6, 2, "plan")
+    parts = [subprocess.Popen([sys.executable, os.path.join(DATASET_DIR, "generation.py"), "6", "2", "part",
+                               "--run_plan", "plan", "--shard", f"{i}/2"],
+                              cwd=workspace, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8')
+             for i in range(2)]
+    for part in parts:
+        output, _ = part.communicate()
+        assert part.returncode == 0, output
+    for i in range(2):
+        assert len(read_images(os.path.join(workspace, "word_images", f"part_shard{i}of2"))) == 18
+        assert os.path.exists(os.path.join(workspace, "word_dict", f"part_shard{i}of2.tsv"))
+        assert os.path.exists(os.path.join(workspace, f"worker_part_shard{i}of2_0.log"))
+
+def test_cell_seeds_are_stable():
+    font_hash = "0" * 40
+    # Changing a seed changes the image of its cell in every dataset generated before, so they are pinned.
+    assert generation.cell_seed(font_hash, "بيت") == 215048623
+    assert generation.cell_seed(font_hash, "بيت", epoch=1) == 1376256296
+    assert generation.cell_seed("1" * 40, "بيت") == 417365211
+    seeds = {generation.cell_seed(font_hash, word, epoch) for word in ("بيت", "باب", "تب") for epoch in range(3)}
+    assert len(seeds) == 9 and all(0 <= seed < 2 ** 32 for seed in seeds)
+
+def test_failed_removal_of_old_runs_does_not_fail_publishing(tmp_path, monkeypatch, capsys):
+    output_path = str(tmp_path / "full")
+    runs = [f"{output_path}@2000010{i}-000000" for i in range(3)]
+    for run in runs:
+        os.makedirs(os.path.join(run, "images"))
+
+    def failing_rmtree(path, *args, **kwargs):
+        raise PermissionError(f"cannot remove {path}")
+
+    monkeypatch.setattr(generation.shutil, 'rmtree', failing_rmtree)
+    generation.publish_run(runs[1], output_path).join()
+    assert os.readlink(output_path) == os.path.basename(runs[1])
+    assert "WARNING: Could not remove" in capsys.readouterr().out
+    # The old runs are out of the way of --resume, and the next publish removes them.
+    assert generation.run_directories(output_path) == [runs[1]]
+    monkeypatch.undo()
+    os.makedirs(runs[2])
+    generation.publish_run(runs[2], output_path).join()
+    assert os.readlink(output_path) == os.path.basename(runs[2])
+    assert sorted(os.listdir(tmp_path)) == ["full", os.path.basename(runs[2])]
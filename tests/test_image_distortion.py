@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+import pytest
+import image_distortion
+
+def text_like_image(height=64, width=180, seed=0):
+    rng = np.random.RandomState(seed)
+    img = np.full((height, width, 3), 230, dtype=np.uint8)
+    for _ in range(12):
+        top, left = rng.randint(0, height - 20), rng.randint(0, width - 20)
+        img[top:top + rng.randint(5, 20), left:left + rng.randint(3, 20)] = rng.randint(0, 80)
+    return img
+
+@pytest.mark.parametrize("method_index", [0, 1])
+def test_warp_follows_the_global_seed(method_index):
+    img = text_like_image()
+    outputs = []
+    for _ in range(2):
+        np.random.seed(1234)
+        warped, method = image_distortion.apply_random_transform(img.copy(), method_index=method_index)
+        outputs.append(warped)
+    assert method == image_distortion.METHOD_NAMES[method_index]
+    assert np.array_equal(outputs[0], outputs[1])
+
+@pytest.mark.parametrize("std", ['w_mesh_std', 'h_mesh_std'])
+def test_mesh_upsampling_stays_close_to_griddata(std):
+    # The fast path interpolates the mesh bilinearly per cell where griddata interpolates linearly
+    # per triangle, so the maps differ by a fraction of a pixel and the images only near strokes
+    # (these blocky images reach 3.7 gray levels on average and 3.5 % of pixels beyond 32).
+    rng = np.random.RandomState(11)
+    for seed in range(12):
+        img = text_like_image(width=rng.randint(70, 400), seed=seed)
+        kwargs = {std: rng.uniform(2, 2.6)}
+        fast = image_distortion.warp_image(img.copy(), random_state=np.random.RandomState(seed), **kwargs)
+        exact = image_distortion.warp_image(img.copy(), random_state=np.random.RandomState(seed), exact=True, **kwargs)
+        assert fast.shape == exact.shape
+        diff = np.abs(fast.astype(np.int16) - exact.astype(np.int16))
+        assert diff.mean() < 4.0
+        assert (diff.max(axis=-1) > 32).mean() < 0.04
+
+def remap(img, map_x, map_y):
+    return cv2.remap(img, map_x.astype(np.float32), map_y.astype(np.float32), cv2.INTER_CUBIC,
+                     borderMode=cv2.BORDER_REFLECT, borderValue=0)
+
+def reference_distortion(img, kind, params):
+    """A distortion computed from scratch on every call, cropping after the remap like the original functions."""
+    h, w = img.shape[:2]
+    if kind == 'barrel':
+        dst = remap(img, *image_distortion._barrel_maps(h, w, *params))
+    elif kind == 'rotate':
+        dst = remap(img, *image_distortion._rotate_maps(h, w, *params))
+        to_crop = (h - np.abs(int(h * np.sin(params[0])))) // 2
+        dst = dst[to_crop:h - to_crop]
+    elif kind == 'arc_left':
+        dst = remap(img, *image_distortion._arc_left_maps(h, w, *params))
+    else:
+        dst = remap(img, *image_distortion._arc_right_maps(h, w, *params))
+    return image_distortion.resize_height(dst, h)
+
+DISTORTIONS = {
+    'barrel': lambda img, params: image_distortion.barrel_distortion(img, *params),
+    'rotate': lambda img, params: image_distortion.my_distort_rotate(img, *params),
+    'arc_left': lambda img, params: image_distortion.my_distort_arc_left(img, *params),
+    'arc_right': lambda img, params: image_distortion.my_distort_arc_right(img, *params),
+}
+RANGES = {'barrel': 'barrel', 'rotate': 'rotate_right', 'arc_left': 'arc_left', 'arc_right': 'arc_right'}
+
+@pytest.mark.parametrize("kind", list(DISTORTIONS))
+def test_cached_grids_without_a_bank_match_computing_them(kind):
+    image_distortion.set_parameter_bank(None)
+    rng = np.random.RandomState(7)
+    for case in range(40):
+        img = text_like_image(width=rng.randint(70, 400), seed=case)
+        params = [rng.uniform(low, high) for low, high in image_distortion.PARAMETER_RANGES[RANGES[kind]]]
+        assert np.array_equal(DISTORTIONS[kind](img, params), reference_distortion(img, kind, params))
+
+SINGLE_IMAGE = {
+    'barrel': lambda img, params: image_distortion.barrel_distortion(img, *params),
+    'arc_left': lambda img, params: image_distortion.my_distort_arc_left(img, *params),
+    'arc_right': lambda img, params: image_distortion.my_distort_arc_right(img, *params),
+    'rotate_right': lambda img, params: image_distortion.my_distort_rotate(img, *params),
+    'rotate_left': lambda img, params: image_distortion.my_distort_rotate(img, *params),
+}
+
+@pytest.mark.parametrize("method", list(SINGLE_IMAGE))
+def test_batch_matches_single_images(method):
+    # A bank of one setting, so every group of the batch draws the parameters used below.
+    image_distortion.set_parameter_bank(1)
+    try:
+        params = list(image_distortion.PARAMETER_BANK[method][0])
+        rng = np.random.RandomState(3)
+        images = [rng.randint(0, 256, size=(64, width, 3)).astype(np.uint8) for width in rng.randint(70, 400, size=48)]
+        method_index = image_distortion.METHOD_NAMES.index(method)
+        results, methods = image_distortion.apply_random_transform_batch(images, [method_index] * len(images))
+        assert methods == [method] * len(images)
+        for img, result in zip(images, results):
+            assert np.array_equal(result, SINGLE_IMAGE[method](img, params))
+    finally:
+        image_distortion.set_parameter_bank(None)
@@ -0,0 +1,46 @@
+import collections
+import csv
+import io
+import os
+import numpy as np
+from PIL import Image
+from conftest import run_script
+from lines import SPLIT_FRACTIONS, split_of
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+def test_shard_index_streams_every_member(workspace):
+    run_script(workspace, "generation.py", 6, 2, "run", "--shards", "--shard_size", 1, "--chunk_size", 4)
+    run_script(workspace, "lines.py", "--shards", os.path.join("word_images", "run"))
+    rows = read_csv(os.path.join(workspace, "data.csv"))
+    assert len(rows) == 36
+    labels = [row['text'] for row in rows]
+    assert labels == sorted(labels)
+    for row in rows:
+        with open(os.path.join(workspace, row['img_path']), 'rb') as f:
+            f.seek(int(row['offset']))
+            image = Image.open(io.BytesIO(f.read(int(row['nbytes']))))
+        assert image.size == (int(row['width']), int(row['height']))
+    index = np.load(os.path.join(workspace, "data.npz"))
+    assert index['offsets'].tolist() == [int(row['offset']) for row in rows]
+
+def test_splits_agree_between_layouts(workspace):
+    run_script(workspace, "generation.py", 6, 2, "files", "--chunk_size", 4)
+    run_script(workspace, "lines.py")
+    files = read_csv(os.path.join(workspace, "data.csv"))
+    run_script(workspace, "generation.py", 6, 2, "shards", "--run_plan", os.path.join("word_images", "files"), "--shards")
+    run_script(workspace, "lines.py", "--shards", os.path.join("word_images", "shards"))
+    shards = read_csv(os.path.join(workspace, "data.csv"))
+    cells = lambda rows: collections.Counter((row['text'], row['width'], row['height'], row['split']) for row in rows)
+    assert len(files) == 36
+    assert cells(files) == cells(shards)
+
+def test_split_of_depends_only_on_label_and_key():
+    thresholds = np.cumsum(SPLIT_FRACTIONS) / np.sum(SPLIT_FRACTIONS)
+    keys = [(f"Font{i % 50}", f"word{i}") for i in range(20000)]
+    splits = [split_of(label, key, thresholds) for label, key in keys]
+    assert splits == [split_of(label, key, thresholds) for label, key in reversed(keys)][::-1]
+    counts = np.bincount(splits, minlength=3) / len(keys)
+    assert np.allclose(counts, SPLIT_FRACTIONS, atol=0.01)
@@ -0,0 +1,27 @@
+import random
+from manifests import merge_manifests
+
+def write_manifest(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write('\t'.join(row) + '\n')
+
+def test_merge_spills_unsorted_manifests_in_blocks(tmp_path):
+    rng = random.Random(0)
+    rows = [[f"Font{rng.randrange(20):02d}", str(i), f"img_{i}.jpg"] for i in range(200)]
+    paths = []
+    for part in range(3):
+        paths.append(str(tmp_path / f"journal_{part}.tsv"))
+        # One sorted manifest and two unsorted ones.
+        part_rows = rows[part::3]
+        write_manifest(paths[-1], sorted(part_rows) if part == 0 else part_rows)
+    key = lambda row: (row[0], int(row[1]))
+    merged = list(merge_manifests(paths, 3, key, block_rows=7))
+    assert merged == sorted(rows, key=key)
+
+def test_rows_of_older_manifests_are_padded_and_cut_lines_skipped(tmp_path):
+    path = str(tmp_path / "journal_0.tsv")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("0\t1\ta.jpg\tFont0.ttf\n0\t2\tb.jpg\tFont0.ttf\t120\t64\tkey\n0\t3\tc.jpg")
+    rows = list(merge_manifests([path], 7, lambda row: int(row[1]), optional=3))
+    assert rows == [["0", "1", "a.jpg", "Font0.ttf", "", "", ""], ["0", "2", "b.jpg", "Font0.ttf", "120", "64", "key"]]
@@ -0,0 +1,61 @@
+import glob
+import os
+import numpy as np
+from PIL import Image
+import gen_line_images
+from conftest import run_script
+from font_datasets import MaskAugmentDataset, resize_to_height
+from mask_store import MaskStore, decode_mask, encode_mask
+
+def test_encoding_keeps_the_ink_bits():
+    mask = np.random.RandomState(0).randint(0, 256, size=(37, 101)).astype(np.uint8)
+    decoded = decode_mask(encode_mask(mask), *mask.shape)
+    assert np.array_equal(decoded, np.where(mask >= 128, 255, 0).astype(np.uint8))
+
+def test_stored_masks_are_the_rendered_text(workspace, monkeypatch):
+    run_script(workspace, "generation.py", 4, 2, "run", "--mask_store", "masks", "--no_images")
+    monkeypatch.chdir(workspace)
+    store = MaskStore("masks")
+    assert len(store) == 16
+    for i in range(len(store)):
+        font = os.path.join("fonts_2K", store.fonts[store.labels[i]], store.fonts[store.labels[i]] + ".ttf")
+        rendered = gen_line_images.render_text_mask(store.words[i], font, 80)
+        assert tuple(store.source_sizes[i]) == rendered.shape[::-1]
+        height, width = store.shapes[i]
+        # generation.py renders the masks at 5 times the image height.
+        assert height == 320 and width == int(rendered.shape[1] / rendered.shape[0] * 320)
+        expected = np.asarray(Image.fromarray(rendered).resize((width, height))) >= 128
+        assert np.array_equal(store[i], expected.astype(np.uint8) * 255)
+
+    # On a white background, without blur or distortion, a sample is the mask in the drawn ink colour.
+    Image.new('RGB', (800, 600), 'white').save("white.png")
+    dataset = MaskAugmentDataset("masks", "white.png", image_height=64, distort_chance=0, blur_chance=0)
+    for i in range(len(dataset)):
+        np.random.seed(i)
+        image, label = dataset[i]
+        np.random.seed(i)
+        color = gen_line_images.choose_text_color()
+        mask = store[i]
+        white = np.full(mask.shape + (3,), 255, dtype=np.uint8)
+        expected = resize_to_height(Image.fromarray(gen_line_images.composite_text(white, mask, color)), 64)
+        assert label == store.labels[i]
+        assert np.array_equal(np.asarray(image), np.asarray(expected.convert('RGB')))
+
+def test_resumed_cells_are_read_once(workspace):
+    run_script(workspace, "generation.py", 6, 2, "run", "--mask_store", "masks", "--no_images")
+    store = MaskStore(os.path.join(workspace, "masks"))
+    assert len(store) == 36
+    # Forget every cell, so the resume renders and stores all of them again.
+    for journal in glob.glob(os.path.join(workspace, "word_images", "run", ".journal", "journal_*.tsv")):
+        os.remove(journal)
+    output = run_script(workspace, "generation.py", 6, 2, "run", "--mask_store", "masks", "--no_images", "--resume")
+    assert "Skipping 0 cells" in output
+    rows = 0
+    for index_file in glob.glob(os.path.join(workspace, "masks", "masks_*.tsv")):
+        with open(index_file, encoding='utf-8') as f:
+            rows += sum(1 for _ in f)
+    assert rows == 72
+    resumed = MaskStore(os.path.join(workspace, "masks"))
+    assert len(resumed) == 36
+    stored = lambda s: sorted((s.fonts[s.labels[i]], s.words[i], s[i].tobytes()) for i in range(len(s)))
+    assert stored(resumed) == stored(store)
@@ -0,0 +1,39 @@
+import glob
+import os
+import numpy as np
+from PIL import Image
+import generation
+from conftest import run_script
+from render_dataset import RenderedFontDataset
+
+def test_rendering_replays_every_epoch(workspace, monkeypatch):
+    monkeypatch.chdir(workspace)
+    # Distort every sample, so the warps are part of what has to replay.
+    monkeypatch.setattr(generation, 'DISTORT_CHANCE', 1.0)
+    fonts = sorted(glob.glob(os.path.join("fonts_2K", "*", "*.ttf")))[:2]
+    words = ["بيت", "كتاب", "مدرسة", "قلم", "باب", "شمس", "قمر", "نهر", "جبل", "بحر"]
+    dataset = RenderedFontDataset(fonts, words, sorted(glob.glob(os.path.join("images", "*.png"))))
+
+    def render_all():
+        return [np.asarray(dataset.render(idx)) for idx in range(len(dataset))]
+
+    first = render_all()
+    assert all(np.array_equal(a, b) for a, b in zip(first, render_all()))
+    dataset.set_epoch(1)
+    other_epoch = render_all()
+    assert any(a.shape != b.shape or not np.array_equal(a, b) for a, b in zip(first, other_epoch))
+    dataset.set_epoch(0)
+    assert all(np.array_equal(a, b) for a, b in zip(first, render_all()))
+
+def test_epoch_zero_matches_generation(workspace, monkeypatch):
+    run_script(workspace, "generation.py", 4, 2, "run", "--codec", "png", distort_chance=0.5)
+    monkeypatch.chdir(workspace)
+    monkeypatch.setattr(generation, 'DISTORT_CHANCE', 0.5)
+    run_path = os.path.join("word_images", "run")
+    # In the order generation.py lists them.
+    dataset = RenderedFontDataset.from_run(run_path, sorted(glob.glob("./images/*.png")))
+    for idx in range(len(dataset)):
+        font_idx, word_idx = dataset.cell(idx)
+        name = f"{os.path.splitext(os.path.basename(dataset.fonts[font_idx]))[0]}_{font_idx}_{word_idx}.png"
+        written = np.asarray(Image.open(os.path.join(run_path, name)).convert('RGB'))
+        assert np.array_equal(np.asarray(dataset.render(idx).convert('RGB')), written), name
@@ -0,0 +1,30 @@
+import os
+from shards import ShardWriter, finalize_shards, list_shards, read_shard
+
+def test_resumed_writer_does_not_append_to_finalized_shards(tmp_path):
+    directory = str(tmp_path)
+    first = ShardWriter(directory, "shard_0_100")
+    first.add("Font0_0_1.jpg", b"first attempt")
+    first.close()
+    finalize_shards(directory)
+    # A resumed run whose worker got the same pid uses the same prefix.
+    second = ShardWriter(directory, "shard_0_100")
+    second.add("Font0_0_2.jpg", b"second attempt")
+    second.close()
+    finalize_shards(directory)
+    assert [os.path.basename(path) for path in list_shards(directory)] == ["shard_0_100_00000.tar", "shard_0_100_00001.tar"]
+    members = {name: data for path in list_shards(directory) for name, data in read_shard(path)}
+    assert members == {"Font0_0_1.jpg": b"first attempt", "Font0_0_2.jpg": b"second attempt"}
+
+def test_finalize_drops_a_member_cut_short(tmp_path):
+    directory = str(tmp_path)
+    writer = ShardWriter(directory, "shard_0_100")
+    writer.add("Font0_0_1.jpg", b"a" * 1000)
+    writer.add("Font0_0_2.jpg", b"b" * 1000)
+    path = os.path.join(directory, writer.name)
+    writer.close()
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 600)
+    finalize_shards(directory)
+    finalize_shards(directory)
+    assert list(read_shard(path)) == [("Font0_0_1.jpg", b"a" * 1000)]
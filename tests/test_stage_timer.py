@@ -0,0 +1,84 @@
+import json
+import pytest
+import stage_timer
+from stage_timer import BIN_EDGES, StageTimer
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(stage_timer.time, 'perf_counter', clock)
+    return clock
+
+def test_nested_stages_are_exclusive(clock):
+    timer = StageTimer()
+    timer.start_sample()
+    clock.now = 1
+    with timer.stage('draw'):
+        clock.now = 3
+        with timer.stage('font_load'):
+            clock.now = 7
+        clock.now = 8
+    clock.now = 9
+    # A stage left through an exception is closed too.
+    with pytest.raises(RuntimeError):
+        with timer.stage('blur'):
+            clock.now = 9.5
+            raise RuntimeError
+    clock.now = 10
+    timer.end_sample("A")
+    assert timer.seconds['draw'] == 3 and timer.seconds['font_load'] == 4 and timer.seconds['blur'] == 0.5
+    assert timer.seconds['total'] == 10 and timer.seconds['distortion'] == 0
+    assert timer.samples['draw'] == timer.samples['total'] == 1 and timer.samples['distortion'] == 0
+    assert timer.fonts["A"]['samples'] == 1 and timer.fonts["A"]['seconds'] == 10
+    assert sum(timer.histograms['draw']) == 1
+    assert timer.percentile('draw', 50) == min(edge for edge in BIN_EDGES if edge > 3)
+
+    # Stages outside a sample are not recorded.
+    with timer.stage('draw'):
+        clock.now = 20
+    assert timer.seconds['draw'] == 3
+
+def test_module_functions_need_an_active_timer(clock):
+    timer = StageTimer()
+    stage_timer.activate(None)
+    with stage_timer.stage('draw'):
+        clock.now = 1
+    stage_timer.count('retry', "A")
+    stage_timer.activate(timer)
+    try:
+        timer.start_sample()
+        with stage_timer.stage('draw'):
+            clock.now = 3
+        stage_timer.count('retry', "A")
+        timer.end_sample("A")
+    finally:
+        stage_timer.activate(None)
+    assert timer.seconds['draw'] == 2 and timer.fonts["A"]['retry'] == 1
+
+def test_merged_timers_rank_the_fonts(clock, tmp_path):
+    timers = [StageTimer(), StageTimer()]
+    for timer, font, seconds in [(timers[0], "Fast", 0.01), (timers[1], "Slow", 0.5), (timers[1], "Fast", 0.03)]:
+        timer.start_sample()
+        clock.now += seconds
+        timer.end_sample(font)
+    timers[1].count('placeholder', "Slow")
+    timers[1].record('write', 0.002)
+    merged = StageTimer()
+    for timer in timers:
+        merged.merge(json.loads(json.dumps(timer.to_dict())))
+    assert merged.samples['total'] == 3 and merged.samples['write'] == 1
+    assert merged.seconds['total'] == pytest.approx(0.54)
+    assert merged.fonts["Fast"]['samples'] == 2 and merged.fonts["Slow"]['placeholder'] == 1
+    report = merged.report(top_fonts=1)
+    assert "Slow" in report and "Fast" not in report
+    merged.save(str(tmp_path / "stages.json"))
+    with open(tmp_path / "stages.json", encoding='utf-8') as f:
+        saved = json.load(f)
+    assert saved['bin_edges'] == BIN_EDGES and saved['fonts'] == merged.fonts
@@ -0,0 +1,65 @@
+import functools
+import os
+import time
+from task_pool import TimeoutPool, TaskError, TaskTimeout, WorkerDied, heartbeat, worker_slot
+
+def run_task(kind, value):
+    if kind == 'sleep':
+        time.sleep(value)
+    elif kind == 'raise':
+        raise ValueError(value)
+    elif kind == 'exit':
+        os._exit(value)
+    elif kind == 'steps':
+        # value steps of 0.4 s, each well within the timeout, but not all of them together.
+        for _ in range(value):
+            heartbeat()
+            time.sleep(0.4)
+    return kind, value, worker_slot()
+
+def outcomes(pool):
+    return {args: (result, error) for args, result, error in pool.as_completed()}
+
+def test_pool_reports_results_errors_timeouts_and_crashes():
+    with TimeoutPool(2, run_task, timeout=1, poll_interval=0.05) as pool:
+        tasks = [('sleep', 30), ('raise', "bad input"), ('exit', 3)] + [('value', i) for i in range(6)]
+        for task in tasks:
+            pool.submit(*task)
+        done = outcomes(pool)
+    assert set(done) == set(tasks)
+    assert isinstance(done[('sleep', 30)][1], TaskTimeout)
+    assert isinstance(done[('raise', "bad input")][1], TaskError)
+    assert "ValueError: bad input" in str(done[('raise', "bad input")][1])
+    assert isinstance(done[('exit', 3)][1], WorkerDied)
+    # The killed and crashed workers were replaced and ran the rest of the tasks.
+    for i in range(6):
+        result, error = done[('value', i)]
+        assert error is None
+        assert result[:2] == ('value', i) and result[2] in (0, 1)
+
+def test_heartbeat_restarts_the_time_budget():
+    with TimeoutPool(1, run_task, timeout=1, poll_interval=0.05) as pool:
+        pool.submit('steps', 6)
+        done = outcomes(pool)
+    assert done[('steps', 6)] == (('steps', 6, 0), None)
+
+def write_pid(directory):
+    with open(os.path.join(directory, str(os.getpid())), 'w') as f:
+        f.write("stopped")
+
+def test_finalizer_runs_in_every_worker_on_close(tmp_path):
+    pool = TimeoutPool(3, run_task, finalizer=functools.partial(write_pid, str(tmp_path)), poll_interval=0.05)
+    pids = {p.pid for p, _ in pool.workers}
+    pool.submit('value', 1)
+    list(pool.as_completed())
+    pool.close(timeout=None)
+    assert set(map(int, os.listdir(tmp_path))) == pids
+
+def test_cancel_drops_queued_tasks_only():
+    with TimeoutPool(1, run_task, poll_interval=0.05) as pool:
+        for i in range(5):
+            pool.submit('value', i)
+        cancelled = pool.cancel(lambda task: task[1] % 2 == 1)
+        done = outcomes(pool)
+    assert cancelled == [('value', 1), ('value', 3)]
+    assert sorted(done) == [('value', 0), ('value', 2), ('value', 4)]
@@ -0,0 +1,20 @@
+import numpy as np
+from PIL import Image
+from conftest import run_script
+from font_datasets import FontDataset
+from tensor_cache import TensorCacheDataset
+
+def test_cache_holds_one_split(workspace, monkeypatch):
+    run_script(workspace, "generation.py", 6, 2, "run", "--chunk_size", 4)
+    run_script(workspace, "lines.py", "--splits", 50, 50, 0)
+    run_script(workspace, "tensor_cache.py", "data.npz", "cache", "--split", "val", "--size", 16, 48, "--processes", 2)
+    monkeypatch.chdir(workspace)
+    source = FontDataset("data.npz", split="val")
+    cache = TensorCacheDataset("cache")
+    assert 0 < len(cache) == len(source) < 36
+    assert cache.labels == list(source.labels)
+    for idx in range(len(cache)):
+        image, target = source[idx]
+        cached, cached_target = cache[idx]
+        assert cached_target == target
+        assert np.array_equal(cached, np.asarray(image.resize((48, 16), Image.BILINEAR)))